@@ -0,0 +1,151 @@
+# batch_journal.py
+import os
+import sqlite3
+import threading
+import time
+
+BATCH_JOURNAL_FILENAME = ".batch_journal.sqlite3"
+
+# 结果状态
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+class BatchJournal:
+    """
+    批处理运行日志，保存在输出文件夹中 (基于 SQLite，可在多个线程与进程间共享)。
+    对每个输入文件记录路径、大小、修改时间、内容哈希、参数指纹与输出状态，
+    重新运行时跳过输出已是最新的文件，失败或中断的文件会重新处理。
+    """
+
+    # 记录先缓存在内存中，每累计这么多条在一个短事务中写入，避免逐条提交拖慢大批量处理；
+    # 写锁只在写入的瞬间持有，同一输出文件夹上的其他连接 (其他进程) 不会长时间等待
+    COMMIT_INTERVAL = 200
+
+    def __init__(self, output_folder, params_fingerprint):
+        self.output_folder = str(output_folder)
+        self.params_fingerprint = params_fingerprint
+        self.db_path = os.path.join(self.output_folder, BATCH_JOURNAL_FILENAME)
+        os.makedirs(self.output_folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._pending_rows = []
+        self.skipped = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " input_path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " content_hash TEXT,"
+                " params_fingerprint TEXT NOT NULL,"
+                " output_path TEXT,"
+                " status TEXT NOT NULL,"
+                " error TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _key(file_path):
+        return os.path.abspath(str(file_path))
+
+    def iter_pending(self, file_paths, content_hash_func=None, on_skip=None):
+        """
+        逐个检查 file_paths (可以是边遍历边产出的生成器)，只产出需要处理的文件。
+        文件大小、修改时间与参数指纹均与上次成功记录一致且输出文件仍存在时跳过；
+        若只有修改时间不同且提供了 content_hash_func，则按内容哈希确认文件未变化后同样跳过。
+        跳过的文件数累计在 self.skipped 中，提供 on_skip 时对每个跳过的文件以 (路径, 输出路径) 调用。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT input_path, size, mtime_ns, content_hash, output_path FROM entries"
+                " WHERE status=? AND params_fingerprint=?",
+                (STATUS_DONE, self.params_fingerprint),
+            ).fetchall()
+        completed = {row[0]: row[1:] for row in rows}
+        del rows
+
+        refreshed = []
+        try:
+            for file_path in file_paths:
+                entry = completed.get(self._key(file_path))
+                if entry is None:
+                    yield file_path
+                    continue
+                size, mtime_ns, content_hash, output_path = entry
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    yield file_path
+                    continue
+                if stat.st_size != size or not output_path or not os.path.exists(output_path):
+                    yield file_path
+                    continue
+                if stat.st_mtime_ns != mtime_ns:
+                    # 修改时间变化但内容可能相同 (例如复制或同步后的文件)，按内容哈希再确认一次
+                    if content_hash_func is None or not content_hash or content_hash_func(file_path) != content_hash:
+                        yield file_path
+                        continue
+                    refreshed.append((stat.st_mtime_ns, time.time(), self._key(file_path)))
+                self.skipped += 1
+                if on_skip is not None:
+                    on_skip(file_path, output_path)
+        finally:
+            if refreshed:
+                with self._lock:
+                    self._conn.executemany("UPDATE entries SET mtime_ns=?, updated_at=? WHERE input_path=?", refreshed)
+                    self._conn.commit()
+
+    def record(self, file_path, file_stat, output_path=None, error=None, content_hash=None):
+        """
+        记录单个文件的处理结果。file_stat 为处理开始前获取的 os.stat 结果，
+        处理期间被修改的文件在下次运行时会因修改时间不一致而重新处理。
+        """
+        if file_stat is None:
+            return
+        with self._lock:
+            self._pending_rows.append(
+                (self._key(file_path), file_stat.st_size, file_stat.st_mtime_ns, content_hash, self.params_fingerprint,
+                 str(output_path) if output_path else None, STATUS_FAILED if error else STATUS_DONE,
+                 str(error) if error else None, time.time()))
+            if len(self._pending_rows) >= self.COMMIT_INTERVAL:
+                self._write_pending()
+
+    def _write_pending(self):
+        """将缓存的记录在一个事务中写入 (调用方需持有 self._lock)"""
+        if not self._pending_rows:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (input_path, size, mtime_ns, content_hash, params_fingerprint,"
+                " output_path, status, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending_rows,
+            )
+        self._pending_rows = []
+
+    def summary(self):
+        """返回当前参数指纹下各状态的文件数，例如 {"done": 120, "failed": 3}"""
+        with self._lock:
+            self._write_pending()
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM entries WHERE params_fingerprint=? GROUP BY status",
+                (self.params_fingerprint,),
+            ).fetchall()
+        return dict(rows)
+
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+
+    def close(self):
+        with self._lock:
+            self._write_pending()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,265 @@
+# cli.py
+"""
+无界面命令行入口：不导入 tkinter / ttkbootstrap / tkinterdnd2 / requests / bs4，
+可在没有图形环境的服务器上运行，也适合脚本调用。
+
+每个文件的处理结果以 JSON Lines 写入标准输出 ({"type": "result"} / {"type": "summary"}，
+无法开始处理时为 {"type": "error"})，其余日志一律写入标准错误。
+
+示例:
+    python cli.py 输入文件夹 -o 输出文件夹 --mosaic-type 黑色线条 --line-direction diagonal
+    python cli.py photo.jpg -o photo_censored.png --regions nipple_f,pussy
+    python cli.py clip.mp4 -o clip_censored.mp4 --detect-interval 5
+"""
+import sys
+import time
+
+_CLI_START_TIME = time.perf_counter()
+
+import argparse
+import contextlib
+import json
+import os
+import threading
+
+# 标准输出只用于 JSON 结果，各模块的 print 日志转到标准错误 (见 main)；
+# spawn 出的批处理工作进程会以 __mp_main__ 重新导入本模块，在此处同样转向
+if __name__ == "__mp_main__":
+    sys.stdout = sys.stderr
+
+# 与 image_processor.MOSAIC_EFFECTS 对应，命令行中也可使用英文名称
+MOSAIC_TYPE_ALIASES = {
+    "blur": "常规模糊",
+    "black_lines": "黑色线条",
+    "white_mist": "白色雾气",
+    "light": "光效马赛克",
+    "custom_image": "自定义图像",
+}
+SINGLE_OUTPUT_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')
+# 与 video_processor.SUPPORTED_VIDEO_EXTENSIONS 一致 (此处不导入，避免拖慢启动)
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm', '.wmv')
+
+def _parse_color(value):
+    """解析 #RRGGBB 或 R,G,B 格式的颜色"""
+    text = value.strip()
+    try:
+        if text.startswith('#') and len(text) == 7:
+            return tuple(int(text[i:i + 2], 16) for i in (1, 3, 5))
+        parts = tuple(int(part) for part in text.split(','))
+        if len(parts) == 3 and all(0 <= part <= 255 for part in parts):
+            return parts
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"无效的颜色: {value} (应为 #RRGGBB 或 R,G,B)")
+
+def _parse_mosaic_type(value):
+    mosaic_type = MOSAIC_TYPE_ALIASES.get(value, value)
+    if mosaic_type not in MOSAIC_TYPE_ALIASES.values():
+        choices = "、".join(list(MOSAIC_TYPE_ALIASES.values()) + list(MOSAIC_TYPE_ALIASES))
+        raise argparse.ArgumentTypeError(f"未知的打码方式: {value} (可选: {choices})")
+    return mosaic_type
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="自动检测并为图像中的敏感区域打码 (无界面模式)，结果以 JSON Lines 输出到标准输出。")
+    parser.add_argument("input", help="输入图片文件或文件夹")
+    parser.add_argument("-o", "--output", required=True,
+                        help="输出文件夹；输入为单张图片时也可以直接指定输出文件路径")
+
+    group = parser.add_argument_group("打码参数 (与图形界面一致)")
+    group.add_argument("--mosaic-type", type=_parse_mosaic_type, default="常规模糊",
+                       help="打码方式: 常规模糊 / 黑色线条 / 白色雾气 / 光效马赛克 / 自定义图像 "
+                            "(或 blur / black_lines / white_mist / light / custom_image)")
+    group.add_argument("--regions", action="append", default=[],
+                       help="需要打码的区域名称，逗号分隔或多次指定；不指定时对全部检测到的区域打码")
+    group.add_argument("--custom-image", default=None, help="自定义贴图路径 (默认使用 assets/head.png)")
+    group.add_argument("--line-direction", choices=("horizontal", "vertical", "diagonal"), default="horizontal")
+    group.add_argument("--conf-threshold", type=float, default=0.25)
+    group.add_argument("--iou-threshold", type=float, default=0.7)
+    group.add_argument("--scale", type=float, default=1.0)
+    group.add_argument("--alpha", type=float, default=1.0, help="透明度 (白色雾气时为雾气强度)")
+    group.add_argument("--blur-kernel-size", type=int, default=31, help="模糊核大小 (偶数会加一)")
+    group.add_argument("--line-thickness", type=int, default=5)
+    group.add_argument("--line-spacing", type=int, default=10)
+    group.add_argument("--mist-color", type=_parse_color, default=(255, 255, 255), help="#RRGGBB 或 R,G,B")
+    group.add_argument("--light-intensity", type=float, default=0.8)
+    group.add_argument("--light-feather", type=int, default=30)
+    group.add_argument("--light-color", type=_parse_color, default=(255, 255, 255), help="#RRGGBB 或 R,G,B")
+
+    group = parser.add_argument_group("批量处理")
+    group.add_argument("--batch-size", type=int, default=1, help="推理批大小")
+    group.add_argument("--processes", type=int, default=1, help="工作进程数")
+    group.add_argument("--torch-threads", type=int, default=None, help="多进程模式下每个进程的 torch 线程数")
+    group.add_argument("--decode-workers", type=int, default=2)
+    group.add_argument("--render-workers", type=int, default=2)
+    group.add_argument("--queue-size", type=int, default=8)
+    group.add_argument("--no-detection-cache", action="store_true", help="不使用持久化检测缓存")
+    group.add_argument("--no-resume", action="store_true", help="忽略批处理日志，重新处理全部文件")
+    group.add_argument("--backend", choices=("pytorch", "onnx", "onnx_int8", "openvino"), default=None,
+                       help="检测推理后端 (默认 pytorch，见 detector_backends.py)")
+
+    group = parser.add_argument_group("视频")
+    group.add_argument("--detect-interval", type=int, default=5,
+                       help="输入为视频时每隔多少帧运行一次检测，其间的帧用光流跟踪 (1 为逐帧检测)")
+
+    group = parser.add_argument_group("分块检测 (超大图像)")
+    group.add_argument("--tiled", action="store_true",
+                       help="对超大图像分块检测，提高小区域的召回 (推理次数随图块数增加)")
+    group.add_argument("--tile-size", type=int, default=1280, help="图块边长 (原图像素)")
+    group.add_argument("--tile-overlap", type=float, default=0.2, help="相邻图块的重叠比例")
+    group.add_argument("--tile-min-size", type=int, default=3000, help="最长边达到该值的图像才分块检测")
+
+    group = parser.add_argument_group("自适应推理尺寸")
+    group.add_argument("--adaptive-imgsz", action="store_true",
+                       help="按每张图像的尺寸与宽高比选择推理尺寸 (小图更快，大图召回更好)")
+    group.add_argument("--min-imgsz", type=int, default=320, help="推理尺寸最长边的下限")
+    group.add_argument("--max-imgsz", type=int, default=1280, help="推理尺寸最长边的上限")
+    return parser
+
+_json_stream = sys.stdout
+
+def _emit(record):
+    _json_stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+    _json_stream.flush()
+
+def _fail(message, **fields):
+    """无法开始或完成处理时，除了写入标准错误的日志外，也在标准输出写出一条错误记录"""
+    print(f"错误：{message}")
+    _emit(dict(type="error", error=message, **fields))
+    return 2
+
+def _render_params_from_args(args):
+    blur_kernel_size = args.blur_kernel_size
+    if blur_kernel_size % 2 == 0:
+        blur_kernel_size += 1
+    selected_regions = [name.strip() for value in args.regions for name in value.split(',') if name.strip()]
+    return {
+        "mosaic_type": args.mosaic_type, "selected_regions": selected_regions,
+        "custom_image_path": args.custom_image, "line_direction": args.line_direction,
+        "conf_threshold": args.conf_threshold, "iou_threshold": args.iou_threshold,
+        "scale": args.scale, "alpha": args.alpha, "blur_kernel_size": (blur_kernel_size, blur_kernel_size),
+        "line_thickness": args.line_thickness, "line_spacing": args.line_spacing, "mist_color": args.mist_color,
+        "light_intensity": args.light_intensity, "light_feather": args.light_feather, "light_color": args.light_color,
+    }
+
+def _run_single(args, render_params):
+    """单张图片直接输出到指定文件：解码与模型加载并行进行"""
+    import image_processor
+    from utils import get_detection_model
+
+    # 模型加载 (导入 ultralytics / torch) 是冷启动的主要耗时，放到后台线程与解码重叠
+    threading.Thread(target=get_detection_model, daemon=True).start()
+    source = image_processor.ImageSource(args.input)
+    original_pil, processed_pil, error, detection_results = image_processor.process_single_image(
+        source, return_detection_results=True, **render_params)
+    result = {"type": "result", "input": args.input, "output": None, "status": "failed", "error": error,
+              "regions": sorted({label for _, label, _ in detection_results or []}),
+              "boxes": len(detection_results or []),
+              "inference_size": list(source.inference_size) if source.inference_size else None}
+    if processed_pil is not None and not error:
+        try:
+            image_processor.save_image_to_path(processed_pil, args.output)
+            result.update(output=args.output, status="done")
+        except Exception as e_save:
+            result["error"] = f"保存失败: {e_save}"
+    result["first_result_seconds"] = round(time.perf_counter() - _CLI_START_TIME, 3)
+    _emit(result)
+    processed = 1 if result["status"] == "done" else 0
+    return {"processed": processed, "failed": 1 - processed, "skipped": 0}
+
+def _run_video(args, render_params):
+    """视频逐帧打码，输出到 -o 指定的视频文件或文件夹 (与输入同名)"""
+    import video_processor
+
+    output_path = args.output
+    if os.path.splitext(output_path)[1].lower() not in VIDEO_EXTENSIONS:
+        output_path = os.path.join(output_path, os.path.basename(args.input))
+    stats = video_processor.process_video(args.input, output_path, detect_interval=args.detect_interval,
+                                          **render_params)
+    result = {"type": "result", "input": args.input, "output": None, "status": "failed", "error": None}
+    if stats is None:
+        result["error"] = "无法处理视频"
+    elif stats.get("error"):
+        result["error"] = stats["error"]
+    else:
+        result.update(output=output_path, status="done")
+    if stats is not None:
+        result.update(frames=stats["frames"], detections=stats["detections"],
+                      redetections=stats["redetections"], fps=round(stats["fps"], 2))
+    _emit(result)
+    processed = 1 if result["status"] == "done" else 0
+    return {"processed": processed, "failed": 1 - processed, "skipped": 0}
+
+def _run_batch(args, render_params):
+    import image_processor
+
+    first_result_seconds = []
+    def _on_result(result):
+        if not first_result_seconds and result["status"] != "skipped":
+            first_result_seconds.append(time.perf_counter() - _CLI_START_TIME)
+        _emit(dict(type="result", **result))
+
+    def _on_status(message):
+        # 逐文件的“正在处理”消息已由 JSON 结果覆盖
+        if not message.startswith("正在处理"):
+            print(message)
+
+    stats = image_processor.batch_process_images(
+        args.input, args.output, status_callback=_on_status, result_callback=_on_result,
+        use_detection_cache=not args.no_detection_cache, inference_batch_size=args.batch_size,
+        decode_workers=args.decode_workers, render_workers=args.render_workers, pipeline_queue_size=args.queue_size,
+        num_processes=args.processes, torch_threads_per_worker=args.torch_threads, resume=not args.no_resume,
+        **render_params)
+    if stats is None:
+        return None
+    if first_result_seconds:
+        stats["first_result_seconds"] = round(first_result_seconds[0], 3)
+    return stats
+
+def main(argv=None):
+    global _json_stream
+    _json_stream = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        return _main(argv)
+
+def _main(argv):
+    args = build_arg_parser().parse_args(argv)
+    if not os.path.exists(args.input):
+        return _fail(f"输入路径不存在: {args.input}", input=args.input)
+    render_params = _render_params_from_args(args)
+    if args.backend:
+        from utils import set_detector_backend
+        set_detector_backend(args.backend)
+    if args.tiled:
+        from utils import set_tiled_detection
+        try:
+            set_tiled_detection(True, args.tile_size, args.tile_overlap, args.tile_min_size)
+        except ValueError as e:
+            return _fail(str(e))
+    if args.adaptive_imgsz:
+        from utils import set_adaptive_inference_size
+        try:
+            set_adaptive_inference_size(True, args.min_imgsz, args.max_imgsz)
+        except ValueError as e:
+            return _fail(str(e))
+
+    if os.path.isfile(args.input) and os.path.splitext(args.input)[1].lower() in VIDEO_EXTENSIONS:
+        stats = _run_video(args, render_params)
+    else:
+        single_output = (os.path.isfile(args.input) and not os.path.isdir(args.output)
+                         and os.path.splitext(args.output)[1].lower() in SINGLE_OUTPUT_EXTENSIONS)
+        stats = _run_single(args, render_params) if single_output else _run_batch(args, render_params)
+    if stats is None:
+        return _fail("批量处理未能完成，详见标准错误中的日志", input=args.input)
+
+    summary = {"type": "summary", "total_seconds": round(time.perf_counter() - _CLI_START_TIME, 3)}
+    summary.update({key: (round(value, 3) if isinstance(value, float) else value) for key, value in stats.items()})
+    from utils import get_model_load_stats
+    load_stats = get_model_load_stats()
+    if load_stats.get("load_seconds") is not None:
+        summary["model_load_seconds"] = round(load_stats["load_seconds"], 3)
+    _emit(summary)
+    return 0 if not stats.get("failed") else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
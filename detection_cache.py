@@ -0,0 +1,82 @@
+# detection_cache.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DETECTION_CACHE_PATH = "cache/detection_cache.sqlite3"
+
+class DetectionCache:
+    """
+    基于 SQLite 的持久化检测结果缓存。
+    以 (图像内容哈希, 模型权重哈希, 置信度阈值, IOU阈值) 为键，
+    同一文件夹换一种打码方式重新处理时无需再次推理。可在多个线程间共享。
+    """
+
+    def __init__(self, db_path=DEFAULT_DETECTION_CACHE_PATH):
+        self.db_path = str(db_path)
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS detections ("
+                " content_hash TEXT NOT NULL,"
+                " model_hash TEXT NOT NULL,"
+                " conf REAL NOT NULL,"
+                " iou REAL NOT NULL,"
+                " results TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (content_hash, model_hash, conf, iou))"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _threshold_key(value):
+        # 滑块产生的浮点数会带有微小误差，统一取 4 位小数作为键
+        return round(float(value), 4)
+
+    def get(self, content_hash, model_hash, conf_threshold, iou_threshold):
+        """查询缓存，命中时返回 detect_censors 格式的结果列表，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results FROM detections WHERE content_hash=? AND model_hash=? AND conf=? AND iou=?",
+                (content_hash, model_hash, self._threshold_key(conf_threshold), self._threshold_key(iou_threshold)),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [(tuple(box), label, confidence) for box, label, confidence in json.loads(row[0])]
+
+    def put(self, content_hash, model_hash, conf_threshold, iou_threshold, detection_results):
+        """写入检测结果 (格式同 detect_censors 的返回值)"""
+        serialized = json.dumps([
+            [[float(v) for v in box], label, float(confidence)]
+            for box, label, confidence in detection_results
+        ])
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO detections (content_hash, model_hash, conf, iou, results, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, model_hash, self._threshold_key(conf_threshold), self._threshold_key(iou_threshold),
+                 serialized, time.time()),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
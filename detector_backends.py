@@ -0,0 +1,364 @@
+# detector_backends.py
+"""
+面向 CPU 的检测推理后端。
+
+PyTorch 权重 (models/model.pt) 只需导出一次，导出结果缓存在权重文件旁，
+并记录导出时的权重哈希，权重更新后会自动重新导出：
+    onnx       静态输入形状的 ONNX 模型，由 ONNX Runtime 在 CPU 上运行 (models/model.onnx)
+    onnx_int8  用样本图像校准的 INT8 静态量化 ONNX 模型 (models/model_int8.onnx)
+    openvino   OpenVINO IR 模型 (models/model_openvino_model/)
+导出的模型仍通过 ultralytics 的 YOLO 接口加载，预处理、后处理以及 detect_censors 的返回格式保持不变。
+
+命令行用法:
+    python detector_backends.py export --backend onnx --backend openvino
+    python detector_backends.py quantize 样本图像文件夹 [--max-images 200]
+    python detector_backends.py benchmark 测试图像文件夹 [--backend onnx --backend onnx_int8]
+"""
+import argparse
+import ast
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils import (
+    MODEL_PATH, DETECTION_INPUT_SIZE, get_weights_fingerprint, detect_censors,
+)
+
+try:
+    from onnxruntime.quantization import CalibrationDataReader
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    CalibrationDataReader = object
+    ONNXRUNTIME_AVAILABLE = False
+
+BACKEND_PYTORCH = "pytorch"
+BACKEND_ONNX = "onnx"
+BACKEND_ONNX_INT8 = "onnx_int8"
+BACKEND_OPENVINO = "openvino"
+AVAILABLE_BACKENDS = (BACKEND_PYTORCH, BACKEND_ONNX, BACKEND_ONNX_INT8, BACKEND_OPENVINO)
+
+# INT8 校准默认使用的最大样本图像数
+DEFAULT_CALIBRATION_IMAGES = 200
+# ultralytics letterbox 的填充颜色
+LETTERBOX_COLOR = (114, 114, 114)
+
+def _fingerprint_path(exported_path):
+    return f"{str(exported_path).rstrip(os.sep)}.fingerprint"
+
+def _export_fingerprint(export_format, imgsz):
+    """导出结果的指纹：权重哈希、导出格式与输入尺寸，任一变化都需要重新导出"""
+    return f"{get_weights_fingerprint()}:{export_format}:{imgsz}"
+
+def _is_export_current(exported_path, export_format, imgsz):
+    """导出文件存在且其记录的指纹与当前权重、格式和输入尺寸一致"""
+    if not os.path.exists(exported_path):
+        return False
+    try:
+        with open(_fingerprint_path(exported_path), "r", encoding="utf-8") as f:
+            return f.read().strip() == _export_fingerprint(export_format, imgsz)
+    except OSError:
+        return False
+
+def _mark_export_current(exported_path, export_format, imgsz):
+    with open(_fingerprint_path(exported_path), "w", encoding="utf-8") as f:
+        f.write(_export_fingerprint(export_format, imgsz))
+
+def exported_input_size(model_path):
+    """
+    从导出模型中读取其静态输入尺寸 (高, 宽)：ONNX 读取输入张量的形状，
+    OpenVINO 读取 ultralytics 随模型写出的 metadata.yaml。无法读取时返回 None。
+    """
+    try:
+        if os.path.isdir(model_path):
+            import yaml
+            with open(os.path.join(model_path, "metadata.yaml"), "r", encoding="utf-8") as f:
+                imgsz = yaml.safe_load(f).get("imgsz")
+        else:
+            import onnx
+            model = onnx.load(model_path, load_external_data=False)
+            dims = [dim.dim_value for dim in model.graph.input[0].type.tensor_type.shape.dim]
+            imgsz = dims[2:4] if len(dims) == 4 and all(dims[2:4]) else None
+            if imgsz is None:
+                metadata = {prop.key: prop.value for prop in model.metadata_props}
+                imgsz = ast.literal_eval(metadata["imgsz"]) if "imgsz" in metadata else None
+    except Exception as e:
+        print(f"无法读取导出模型的输入尺寸 ({model_path}): {e}")
+        return None
+    if imgsz is None:
+        return None
+    if isinstance(imgsz, int):
+        return imgsz, imgsz
+    return int(imgsz[0]), int(imgsz[1])
+
+def _current_export_size(exported_path, export_format):
+    """已有导出文件对当前权重仍然有效时返回其导出时的输入尺寸，否则返回 None"""
+    if not os.path.exists(exported_path):
+        return None
+    size = exported_input_size(exported_path)
+    if size is None or size[0] != size[1] or not _is_export_current(exported_path, export_format, size[0]):
+        return None
+    return size[0]
+
+def _export(pt_path, export_format, imgsz, force):
+    from ultralytics import YOLO
+    expected_path = {
+        BACKEND_ONNX: os.path.splitext(pt_path)[0] + ".onnx",
+        BACKEND_OPENVINO: os.path.splitext(pt_path)[0] + "_openvino_model",
+    }[export_format]
+    if imgsz is None:
+        # 未指定尺寸时沿用已有的有效导出 (可能是用 --imgsz 手动导出的)，都没有时才按默认尺寸导出
+        imgsz = (None if force else _current_export_size(expected_path, export_format)) or DETECTION_INPUT_SIZE
+    if not force and _is_export_current(expected_path, export_format, imgsz):
+        return expected_path
+    print(f"正在将 {pt_path} 导出为 {export_format} (输入尺寸 {imgsz})...")
+    start_time = time.perf_counter()
+    # 静态输入形状：CPU 推理时图优化更充分，也便于 INT8 校准
+    exported_path = YOLO(pt_path).export(format=export_format, imgsz=imgsz, dynamic=False, half=False)
+    exported_path = str(exported_path)
+    _mark_export_current(exported_path, export_format, imgsz)
+    print(f"导出完成: {exported_path} ({time.perf_counter() - start_time:.1f}s)")
+    return exported_path
+
+def export_onnx(pt_path=MODEL_PATH, imgsz=DETECTION_INPUT_SIZE, force=False):
+    """导出静态形状的 ONNX 模型 (已是最新时直接返回缓存的路径；imgsz 为 None 时接受任意尺寸的有效导出)"""
+    return _export(pt_path, BACKEND_ONNX, imgsz, force)
+
+def export_openvino(pt_path=MODEL_PATH, imgsz=DETECTION_INPUT_SIZE, force=False):
+    """导出 OpenVINO IR 模型 (已是最新时直接返回缓存的目录)"""
+    return _export(pt_path, BACKEND_OPENVINO, imgsz, force)
+
+def int8_model_path(pt_path=MODEL_PATH):
+    return os.path.splitext(pt_path)[0] + "_int8.onnx"
+
+def letterbox(rgb, size=DETECTION_INPUT_SIZE):
+    """与 ultralytics 静态形状推理一致的预处理：等比缩放后居中填充到 size x size"""
+    height, width = rgb.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    if (new_width, new_height) != (width, height):
+        rgb = cv2.resize(rgb, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_width) / 2, (size - new_height) / 2
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    return cv2.copyMakeBorder(rgb, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+
+class _CalibrationReader(CalibrationDataReader):
+    """按需读取校准图像并转换为模型输入 (NCHW, float32, 0~1)，避免一次性占用大量内存"""
+
+    def __init__(self, image_paths, input_name, imgsz):
+        self._image_list = list(image_paths)
+        self._image_paths = iter(self._image_list)
+        self._input_name = input_name
+        self._imgsz = imgsz
+        self.used_images = 0
+
+    def get_next(self):
+        from image_processor import ImageSource
+        for image_path in self._image_paths:
+            try:
+                rgb = ImageSource(image_path).rgb
+            except Exception as e:
+                print(f"校准时跳过无法读取的图像 ({image_path}): {e}")
+                continue
+            tensor = letterbox(rgb, self._imgsz).transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+            self.used_images += 1
+            return {self._input_name: tensor}
+        return None
+
+    def rewind(self):
+        """从头重新读取校准图像 (部分校准方法会多次遍历数据)"""
+        self._image_paths = iter(self._image_list)
+        self.used_images = 0
+
+def _detect_head_decode_nodes(model):
+    """
+    返回检测头中解码部分 (DFL、sigmoid、框坐标换算与拼接) 的节点名称。
+    这些节点输出的是置信度与像素坐标，量化为 8 位会丢失低置信度与坐标精度，保留浮点计算。
+    卷积分支 (cv2 / cv3) 仍参与量化。
+    """
+    last_name = model.graph.node[-1].name
+    if not last_name.startswith("/model."):
+        return []
+    head_prefix = "/".join(last_name.split("/")[:2]) + "/"
+    return [node.name for node in model.graph.node
+            if node.name.startswith(head_prefix) and "/cv2." not in node.name and "/cv3." not in node.name]
+
+def quantize_int8(calibration_folder, pt_path=MODEL_PATH, imgsz=DETECTION_INPUT_SIZE,
+                  max_images=DEFAULT_CALIBRATION_IMAGES, force=False):
+    """
+    以 calibration_folder 中的样本图像校准，生成 INT8 静态量化 (QDQ 格式) 的 ONNX 模型。
+    样本应与实际待处理的图像类型相近，数量一般 100~300 张即可。
+
+    Returns:
+        量化模型路径
+    """
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from image_processor import FileDiscovery
+
+    output_path = int8_model_path(pt_path)
+    if not force and _is_export_current(output_path, BACKEND_ONNX_INT8, imgsz):
+        return output_path
+    onnx_path = export_onnx(pt_path, imgsz)
+
+    image_paths = []
+    for image_path in FileDiscovery(calibration_folder):
+        image_paths.append(image_path)
+        if len(image_paths) >= max_images:
+            break
+    if not image_paths:
+        raise ValueError(f"校准文件夹中没有可用的图像: {calibration_folder}")
+
+    session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    del session
+
+    # 量化前先做形状推断与图优化，量化结果更稳定
+    prepared_path = os.path.splitext(output_path)[0] + "_prep.onnx"
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        quant_pre_process(onnx_path, prepared_path)
+        quantize_input = prepared_path
+    except Exception as e_prep:
+        print(f"量化预处理失败，直接量化原模型: {e_prep}")
+        quantize_input = onnx_path
+
+    nodes_to_exclude = _detect_head_decode_nodes(onnx.load(quantize_input, load_external_data=False))
+    print(f"正在使用 {len(image_paths)} 张图像校准 INT8 量化...")
+    start_time = time.perf_counter()
+    reader = _CalibrationReader(image_paths, input_name, imgsz)
+    try:
+        quantize_static(
+            quantize_input, output_path, reader,
+            quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+            per_channel=True, calibrate_method=CalibrationMethod.MinMax, nodes_to_exclude=nodes_to_exclude,
+        )
+    finally:
+        if quantize_input == prepared_path and os.path.exists(prepared_path):
+            os.remove(prepared_path)
+
+    # ultralytics 从 ONNX 元数据读取类别名称、步长与输入尺寸，量化后需要从原模型复制过来
+    source_model = onnx.load(onnx_path, load_external_data=False)
+    quantized_model = onnx.load(output_path)
+    del quantized_model.metadata_props[:]
+    for prop in source_model.metadata_props:
+        quantized_model.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(quantized_model, output_path)
+    _mark_export_current(output_path, BACKEND_ONNX_INT8, imgsz)
+    print(f"INT8 量化完成: {output_path} (校准 {reader.used_images} 张，{time.perf_counter() - start_time:.1f}s)")
+    return output_path
+
+def load_backend_model(backend, pt_path=MODEL_PATH, imgsz=None):
+    """
+    按后端加载检测模型，返回与 PyTorch 模型接口一致的 ultralytics YOLO 对象。
+    ONNX / OpenVINO 模型在缓存缺失或过期 (权重或 imgsz 变化) 时自动导出；INT8 模型需先用 quantize_int8 校准生成。
+    imgsz 为 None 时沿用已导出 / 量化模型自身的输入尺寸 (见 export / quantize 的 --imgsz)，
+    没有可用的导出时按 DETECTION_INPUT_SIZE 导出。
+    """
+    from ultralytics import YOLO
+    if backend == BACKEND_PYTORCH:
+        return YOLO(pt_path)
+    if backend == BACKEND_ONNX:
+        model_path = export_onnx(pt_path, imgsz)
+    elif backend == BACKEND_OPENVINO:
+        model_path = export_openvino(pt_path, imgsz)
+    elif backend == BACKEND_ONNX_INT8:
+        model_path = int8_model_path(pt_path)
+        if imgsz is None:
+            imgsz = _current_export_size(model_path, BACKEND_ONNX_INT8)
+        if imgsz is None or not _is_export_current(model_path, BACKEND_ONNX_INT8, imgsz):
+            raise FileNotFoundError(
+                f"INT8 模型不存在或已过期: {model_path}，请先运行 python detector_backends.py quantize 样本图像文件夹")
+    else:
+        raise ValueError(f"未知的推理后端: {backend} (可选: {', '.join(AVAILABLE_BACKENDS)})")
+    model = YOLO(model_path, task="detect")
+    # 静态输入形状的模型每次只能推理一张图像 (见 utils.detect_censors_batch)，也不能按图像改变推理尺寸
+    model.supports_batch = False
+    model.static_input_size = exported_input_size(model_path) or (imgsz or DETECTION_INPUT_SIZE,) * 2
+    return model
+
+def compare_backends(image_paths, backends=(BACKEND_ONNX, BACKEND_ONNX_INT8, BACKEND_OPENVINO),
+                     conf_threshold=0.25, iou_threshold=0.7, warmup=2, status_callback=None):
+    """
+    在同一组图像上比较各后端与 PyTorch 基线：单张推理延迟 (毫秒) 以及检测框一致性
+    (以 PyTorch 结果为参照的精确率、召回率与匹配框平均 IOU)。无法加载的后端会被跳过并报告原因。
+
+    Returns:
+        {后端: 统计字典}
+    """
+    from image_processor import DetectionBenchmark
+    benchmark = DetectionBenchmark(image_paths, status_callback)
+    if not benchmark.images:
+        return {}
+
+    report = {}
+    for backend in (BACKEND_PYTORCH,) + tuple(b for b in backends if b != BACKEND_PYTORCH):
+        try:
+            model = load_backend_model(backend)
+        except Exception as e:
+            report[backend] = {"error": str(e)}
+            benchmark.report(f"{backend}: 无法加载 ({e})")
+            continue
+        stats = benchmark.run(backend, lambda image: detect_censors(image, model, conf_threshold, iou_threshold,
+                                                                    raise_on_error=True), warmup=warmup)
+        del model
+        if backend != BACKEND_PYTORCH and BACKEND_PYTORCH in benchmark.detections:
+            stats.update(benchmark.agreement(backend, BACKEND_PYTORCH))
+            stats["speedup"] = (report[BACKEND_PYTORCH]["mean_ms"] / stats["mean_ms"]
+                                if stats["mean_ms"] > 0 else None)
+        report[backend] = stats
+
+        message = (f"{backend}: 平均 {stats['mean_ms']:.1f}ms (p50 {stats['p50_ms']:.1f}ms，p90 {stats['p90_ms']:.1f}ms)，"
+                   f"检测框 {stats['boxes']} 个")
+        if "recall" in stats:
+            message += f"，与 PyTorch 一致性: 精确率 {stats['precision']:.3f}，召回率 {stats['recall']:.3f}"
+            if stats["speedup"]:
+                message += f"，加速 {stats['speedup']:.2f}x"
+        benchmark.report(message)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="检测模型的 CPU 推理后端：导出、INT8 量化与基准比较")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="导出 ONNX / OpenVINO 模型")
+    export_parser.add_argument("--backend", action="append", choices=(BACKEND_ONNX, BACKEND_OPENVINO))
+    export_parser.add_argument("--imgsz", type=int, default=DETECTION_INPUT_SIZE)
+    export_parser.add_argument("--force", action="store_true", help="即使已有最新的导出结果也重新导出")
+
+    quantize_parser = subparsers.add_parser("quantize", help="用样本图像校准生成 INT8 ONNX 模型")
+    quantize_parser.add_argument("calibration_folder")
+    quantize_parser.add_argument("--max-images", type=int, default=DEFAULT_CALIBRATION_IMAGES)
+    quantize_parser.add_argument("--imgsz", type=int, default=DETECTION_INPUT_SIZE)
+    quantize_parser.add_argument("--force", action="store_true")
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="比较各后端的延迟与检测框一致性")
+    benchmark_parser.add_argument("image_folder")
+    benchmark_parser.add_argument("--backend", action="append",
+                                  choices=(BACKEND_ONNX, BACKEND_ONNX_INT8, BACKEND_OPENVINO))
+    benchmark_parser.add_argument("--max-images", type=int, default=50)
+    benchmark_parser.add_argument("--conf-threshold", type=float, default=0.25)
+    benchmark_parser.add_argument("--iou-threshold", type=float, default=0.7)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        for backend in args.backend or [BACKEND_ONNX]:
+            _export(MODEL_PATH, backend, args.imgsz, args.force)
+    elif args.command == "quantize":
+        quantize_int8(args.calibration_folder, imgsz=args.imgsz, max_images=args.max_images, force=args.force)
+    elif args.command == "benchmark":
+        from image_processor import FileDiscovery
+        image_paths = []
+        for image_path in FileDiscovery(args.image_folder):
+            image_paths.append(image_path)
+            if len(image_paths) >= args.max_images:
+                break
+        compare_backends(image_paths, backends=tuple(args.backend or (BACKEND_ONNX, BACKEND_ONNX_INT8)),
+                         conf_threshold=args.conf_threshold, iou_threshold=args.iou_threshold)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
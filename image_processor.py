@@ -1,18 +1,43 @@
 # image_processor.py
+import hashlib
+import io
+import itertools
+import json
+import math
+import multiprocessing
 import os
+import queue
 import sys
+import threading
+import time
 from pathlib import Path
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw
 from imagecodecs import imread, imwrite
 
+from batch_journal import BatchJournal
+from detection_cache import DetectionCache, DEFAULT_DETECTION_CACHE_PATH
 from utils import (
-    load_models, detect_censors, to_rgb, to_rgba,
+    get_detection_model, get_tile_grid, detect_censors_tiled, TILE_SIZE, TILE_OVERLAP,
+    ADAPTIVE_MIN_INPUT_SIZE, ADAPTIVE_MAX_INPUT_SIZE, get_model_fingerprint, detect_censors, detect_censor_candidates, detect_censor_candidates_batch,
+    filter_detections, get_tiled_detection_config, should_tile_image, match_detections,
+    get_adaptive_inference_size_config, choose_inference_size,
+    RAW_DETECTION_CONF, RAW_DETECTION_IOU, DETECTION_INPUT_SIZE, MODEL_STRIDE, to_rgb, to_rgba,
     apply_blur_mosaic, apply_black_lines_mosaic, apply_white_mist_mosaic,
-    apply_custom_image_mosaic, apply_light_mosaic, get_available_labels
+    apply_custom_image_mosaic, apply_light_mosaic, composite_mosaic, OverlayTexture, RenderCancelledError,
+    get_available_labels
 )
 
+# 界面中的打码方式 -> 合成引擎中的效果名称
+MOSAIC_EFFECTS = {
+    "常规模糊": "blur",
+    "黑色线条": "black_lines",
+    "白色雾气": "white_mist",
+    "光效马赛克": "light",
+    "自定义图像": "custom_image",
+}
+
 # IS_PACKAGED_APP 如果为 True，则表示作为可执行文件运行 (例如由 PyInstaller 打包)
 # 否则表示作为普通 Python 脚本运行。
 IS_PACKAGED_APP = getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS')
@@ -21,8 +46,6 @@ if IS_PACKAGED_APP:
 else:
     print("INFO: Application is running in script mode.")
 
-classification_model, detection_model = load_models()
-
 DEFAULT_HEAD_PATH = "assets/head.png"
 
 def _load_image_data_rgb(image_path_str: str) -> np.ndarray:
@@ -55,6 +78,188 @@ def _load_image_data_rgb(image_path_str: str) -> np.ndarray:
         else:
             raise ValueError(f"Unsupported image format from imagecodecs for RGB conversion: {image_path_str}, shape: {img_ic.shape}")
 
+def _decode_image_bytes_rgb(image_bytes: bytes, source_desc: str = "<bytes>") -> np.ndarray:
+    """
+    将内存中的图像字节解码为 RGB 格式的 NumPy 数组。
+    与 _load_image_data_rgb 一样，根据程序运行模式选择不同的解码库。
+    """
+    if IS_PACKAGED_APP:
+        # 打包模式：使用 OpenCV
+        img_cv = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img_cv is None:
+            raise IOError(f"OpenCV (cv2.imdecode) failed to decode image: {source_desc}")
+        return cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
+    else:
+        # 脚本模式：使用 imagecodecs
+        img_ic = imread(image_bytes)
+        if img_ic is None:
+            raise IOError(f"imagecodecs.imread failed to decode image: {source_desc}")
+        return _ensure_rgb_array(img_ic, source_desc)
+
+def _ensure_rgb_array(image_np: np.ndarray, source_desc: str = "<array>") -> np.ndarray:
+    """将灰度 / RGBA / RGB 的 NumPy 数组统一为 RGB 格式"""
+    if image_np.ndim == 2:  # Grayscale
+        return cv2.cvtColor(image_np, cv2.COLOR_GRAY2RGB)
+    elif image_np.ndim == 3 and image_np.shape[2] == 1:  # Grayscale
+        return cv2.cvtColor(image_np, cv2.COLOR_GRAY2RGB)
+    elif image_np.ndim == 3 and image_np.shape[2] == 4:  # RGBA
+        return cv2.cvtColor(image_np, cv2.COLOR_RGBA2RGB)
+    elif image_np.ndim == 3 and image_np.shape[2] == 3:  # RGB
+        return image_np
+    else:
+        raise ValueError(f"Unsupported image format for RGB conversion: {source_desc}, shape: {image_np.shape}")
+
+class ImageSource:
+    """
+    统一的图像输入源。
+    可接受文件路径、图像字节、RGB 格式的 NumPy 数组或 PIL 图像，
+    仅在首次访问 rgb 时解码一次，之后检测、打码渲染与预览生成共用同一个 RGB 缓冲区。
+    """
+
+    def __init__(self, source, name=None):
+        self.path = None
+        self._data = None
+        self._rgb = None
+        self._pil = None
+        self._content_hash = None
+        self._proxy = None
+        self._detection_input = None
+        self._lock = threading.Lock()
+        # 最近一次推理使用的输入尺寸 (高, 宽)，使用模型默认尺寸、分块检测或命中检测缓存时为 None
+        self.inference_size = None
+
+        if isinstance(source, (str, os.PathLike)):
+            self.path = str(source)
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self._data = bytes(source)
+        elif isinstance(source, np.ndarray):
+            self._rgb = _ensure_rgb_array(source)
+        elif isinstance(source, Image.Image):
+            self._pil = source
+        else:
+            raise TypeError(f"不支持的图像输入类型: {type(source).__name__}")
+
+        if name:
+            self.name = name
+        elif self.path:
+            self.name = os.path.basename(self.path)
+        else:
+            self.name = f"<{type(source).__name__}>"
+
+    @classmethod
+    def wrap(cls, source):
+        """若 source 已是 ImageSource 则原样返回，否则包装为新的 ImageSource"""
+        return source if isinstance(source, cls) else cls(source)
+
+    @property
+    def data(self):
+        """原始编码字节 (仅路径或字节输入可用，路径输入在首次访问时读取)"""
+        if self._data is None and self.path is not None:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"Image file not found: {self.path}")
+            with open(self.path, "rb") as f:
+                self._data = f.read()
+        return self._data
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """解码后的 RGB 数组 (只解码一次，线程安全)"""
+        if self._rgb is None:
+            with self._lock:
+                if self._rgb is None:
+                    if self._pil is not None:
+                        self._rgb = np.asarray(self._pil.convert("RGB"))
+                    else:
+                        self._rgb = _decode_image_bytes_rgb(self.data, self.path or self.name)
+        return self._rgb
+
+    def to_pil(self) -> Image.Image:
+        """以 PIL 图像形式返回解码结果，用于预览"""
+        return Image.fromarray(self.rgb)
+
+    @property
+    def dimensions(self):
+        """图像尺寸 (宽, 高)；尚未解码时只读取文件头，不触发解码"""
+        if self._rgb is not None:
+            return self._rgb.shape[1], self._rgb.shape[0]
+        if self._pil is not None:
+            return self._pil.size
+        try:
+            with Image.open(io.BytesIO(self.data)) as img:
+                return img.size
+        except Exception:
+            rgb = self.rgb
+            return rgb.shape[1], rgb.shape[0]
+
+    def detection_input(self, min_size=DETECTION_INPUT_SIZE):
+        """
+        返回用于检测的 RGB 数组及其到原图坐标的缩放系数 (scale_x, scale_y)。
+        尚未解码的 JPEG 借助 DCT 缩放 (PIL draft) 按 2 的幂次缩小解码，最长边不低于 min_size，
+        且不会替换全分辨率缓冲区，只有渲染时才完整解码；其余情况直接返回全分辨率图像与 (1.0, 1.0)。
+        """
+        if self._rgb is not None or self._pil is not None:
+            return self.rgb, (1.0, 1.0)
+        cached = self._detection_input
+        if cached is not None and cached[0] == min_size:
+            return cached[1], cached[2]
+        data = self.data
+        if data is None or not data.startswith(b"\xff\xd8"):
+            return self.rgb, (1.0, 1.0)
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                full_width, full_height = img.size
+                ratio = min_size / max(full_width, full_height)
+                if ratio > 0.5:
+                    # 无法至少缩小一半时直接完整解码，供检测与渲染共用
+                    return self.rgb, (1.0, 1.0)
+                # draft 选择不小于请求尺寸的最小 1/2、1/4、1/8 缩放
+                img.draft("RGB", (math.ceil(full_width * ratio), math.ceil(full_height * ratio)))
+                reduced_rgb = np.asarray(img.convert("RGB"))
+        except Exception as e:
+            print(f"缩小解码失败，改为完整解码 ({self.path or self.name}): {e}")
+            return self.rgb, (1.0, 1.0)
+        reduced_height, reduced_width = reduced_rgb.shape[:2]
+        scale = (full_width / reduced_width, full_height / reduced_height)
+        self._detection_input = (min_size, reduced_rgb, scale)
+        return reduced_rgb, scale
+
+    def release_detection_input(self):
+        """释放检测用的缩小解码结果"""
+        self._detection_input = None
+
+    def proxy(self, max_width, max_height):
+        """
+        返回缩小到不超过 (max_width, max_height) 的 RGB 代理图及其相对原图的缩放比例 (<= 1.0)。
+        用于交互预览，结果按尺寸缓存，预览区域尺寸不变时重复调用不会再次缩放。
+        """
+        cached = self._proxy
+        if cached is not None and cached[0] == (max_width, max_height):
+            return cached[1], cached[2]
+        rgb = self.rgb
+        h, w = rgb.shape[:2]
+        ratio = min(max_width / w, max_height / h, 1.0)
+        if ratio < 1.0:
+            proxy_rgb = cv2.resize(rgb, (max(1, int(w * ratio)), max(1, int(h * ratio))), interpolation=cv2.INTER_AREA)
+        else:
+            proxy_rgb = rgb
+        self._proxy = ((max_width, max_height), proxy_rgb, ratio)
+        return proxy_rgb, ratio
+
+    @property
+    def content_hash(self) -> str:
+        """图像内容哈希，文件/字节输入按编码字节计算，内存图像按像素计算"""
+        if self._content_hash is None:
+            hasher = hashlib.blake2b(digest_size=20)
+            data = self.data
+            if data is not None:
+                hasher.update(data)
+            else:
+                rgb = np.ascontiguousarray(self.rgb)
+                hasher.update(str(rgb.shape).encode())
+                hasher.update(rgb.data)
+            self._content_hash = hasher.hexdigest()
+        return self._content_hash
+
 def _load_image_data_rgba(image_path_str: str) -> np.ndarray:
     """
     加载图像文件并确保其为 RGBA 格式的 NumPy 数组。
@@ -105,27 +310,257 @@ def get_default_custom_image():
         print(f"加载默认自定义图像时发生错误 ({DEFAULT_HEAD_PATH}): {e}")
         return np.zeros((50, 50, 4), dtype=np.uint8) # 错误时的占位符
 
+# 贴图纹理缓存：绝对路径 -> ((mtime_ns, size), OverlayTexture)，文件被修改后自动重新解码
+OVERLAY_TEXTURE_CACHE_SIZE = 8
+_overlay_texture_cache = {}
+_overlay_texture_cache_lock = threading.Lock()
+
+def get_overlay_texture(image_path):
+    """
+    获取贴图文件对应的 OverlayTexture。
+    每个文件只解码一次，之后按修改时间与文件大小判断缓存是否仍然有效。
+    """
+    stat = os.stat(image_path)
+    key = os.path.abspath(image_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _overlay_texture_cache_lock:
+        cached = _overlay_texture_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    texture = OverlayTexture(_load_image_data_rgba(image_path))
+    with _overlay_texture_cache_lock:
+        _overlay_texture_cache.pop(key, None)
+        _overlay_texture_cache[key] = (version, texture)
+        while len(_overlay_texture_cache) > OVERLAY_TEXTURE_CACHE_SIZE:
+            _overlay_texture_cache.pop(next(iter(_overlay_texture_cache)))
+    return texture
+
+def get_default_overlay_texture():
+    """获取默认自定义贴图的 OverlayTexture，加载失败时返回透明占位纹理"""
+    try:
+        if not os.path.exists(DEFAULT_HEAD_PATH):
+            print(f"错误: 默认自定义贴图路径不存在: {DEFAULT_HEAD_PATH}")
+            return OverlayTexture(np.zeros((50, 50, 4), dtype=np.uint8))
+        
+        return get_overlay_texture(DEFAULT_HEAD_PATH)
+    except Exception as e:
+        print(f"加载默认自定义图像时发生错误 ({DEFAULT_HEAD_PATH}): {e}")
+        return OverlayTexture(np.zeros((50, 50, 4), dtype=np.uint8)) # 错误时的占位符
+
+def scale_detections(detections, scale_x, scale_y):
+    """将检测结果的边界框坐标按 (scale_x, scale_y) 缩放，例如从缩小解码的坐标映射回原图"""
+    if scale_x == 1.0 and scale_y == 1.0:
+        return detections
+    return [((x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y), class_name, confidence)
+            for (x1, y1, x2, y2), class_name, confidence in detections]
+
+def detection_input_for(source):
+    """
+    返回检测用的 RGB 数组及其到原图坐标的缩放系数。
+    需要分块检测的超大图像 (见 utils.set_tiled_detection) 使用全分辨率，其余图像使用缩小解码的检测输入。
+    """
+    if get_tiled_detection_config() is not None and should_tile_image(*source.dimensions):
+        return source.rgb, (1.0, 1.0)
+    adaptive = get_adaptive_inference_size_config()
+    if adaptive is not None:
+        # 缩小解码不低于自适应推理尺寸的上限，大图才能以更高的分辨率推理
+        return source.detection_input(max(DETECTION_INPUT_SIZE, adaptive["max_size"]))
+    return source.detection_input()
+
+def inference_size_for(detection_rgb, detection_model):
+    """
+    按自适应推理尺寸设置 (见 utils.set_adaptive_inference_size) 为检测输入选择推理尺寸 (高, 宽)。
+    未启用、图像将分块检测或模型为静态输入形状 (ONNX / OpenVINO 导出) 时返回 None，即使用模型默认尺寸。
+    """
+    adaptive = get_adaptive_inference_size_config()
+    if adaptive is None or getattr(detection_model, "static_input_size", None):
+        return None
+    height, width = detection_rgb.shape[:2]
+    if should_tile_image(width, height):
+        return None
+    return choose_inference_size(width, height, **adaptive)
+
+def _detect_candidates_reduced(source, detection_model, raise_on_error=False):
+    """在缩小解码的检测输入上获取原始候选框，并映射回原图坐标"""
+    detection_rgb, (scale_x, scale_y) = detection_input_for(source)
+    source.inference_size = inference_size_for(detection_rgb, detection_model)
+    candidates = detect_censor_candidates(detection_rgb, detection_model, raise_on_error=raise_on_error,
+                                          imgsz=source.inference_size)
+    return scale_detections(candidates, scale_x, scale_y)
+
+def detect_image_candidates(source, detection_model, detection_cache=None, raise_on_error=False):
+    """
+    获取图像源与阈值无关的原始候选框，若提供了 DetectionCache 则先按内容哈希查询持久化缓存。
+    检测在缩小解码的图像上进行 (见 ImageSource.detection_input)，返回原图坐标。
+    检测失败时返回空列表且不写入缓存 (raise_on_error 为 True 时直接抛出)。
+    """
+    if detection_cache is None:
+        return _detect_candidates_reduced(source, detection_model, raise_on_error=raise_on_error)
+
+    cache_key = (source.content_hash, get_model_fingerprint(), RAW_DETECTION_CONF, RAW_DETECTION_IOU)
+    cached = detection_cache.get(*cache_key)
+    if cached is not None:
+        return cached
+    try:
+        candidates = _detect_candidates_reduced(source, detection_model, raise_on_error=True)
+    except Exception as e:
+        if raise_on_error:
+            raise
+        print(f"Error detecting censors: {e}")
+        return []
+    detection_cache.put(*cache_key, candidates)
+    return candidates
+
+def detect_image_candidates_batch(sources, detection_model, detection_cache=None):
+    """
+    detect_image_candidates 的批量版本：命中缓存的图像直接返回，其余图像以缩小解码的检测输入合并为一个批次推理。
+    返回与 sources 一一对应的候选框列表 (原图坐标)，无法解码或批量推理失败的图像对应 None
+    (调用方可回退到单张检测，以便报告具体错误)。
+    """
+    candidates_list = [None] * len(sources)
+    model_hash = get_model_fingerprint() if detection_cache is not None else None
+    pending = []
+    detection_inputs = []
+    for idx, source in enumerate(sources):
+        try:
+            if detection_cache is not None:
+                cached = detection_cache.get(source.content_hash, model_hash, RAW_DETECTION_CONF, RAW_DETECTION_IOU)
+                if cached is not None:
+                    candidates_list[idx] = cached
+                    continue
+            # 触发解码，解码失败的图像不进入批次
+            detection_inputs.append(detection_input_for(source))
+            pending.append(idx)
+        except Exception as e:
+            print(f"批量检测时无法读取图像 ({source.path or source.name}): {e}")
+
+    if pending:
+        # 自适应推理尺寸下，同一批次只能合并推理尺寸相同的图像
+        size_groups = {}
+        for position, (detection_rgb, _) in enumerate(detection_inputs):
+            imgsz = inference_size_for(detection_rgb, detection_model)
+            sources[pending[position]].inference_size = imgsz
+            size_groups.setdefault(imgsz, []).append(position)
+        batch_results = [None] * len(pending)
+        try:
+            for imgsz, positions in size_groups.items():
+                group_results = detect_censor_candidates_batch([detection_inputs[p][0] for p in positions],
+                                                               detection_model, raise_on_error=True, imgsz=imgsz)
+                for position, candidates in zip(positions, group_results):
+                    batch_results[position] = candidates
+        except Exception as e:
+            print(f"批量检测失败，将逐张检测: {e}")
+            return candidates_list
+        for idx, (_, (scale_x, scale_y)), candidates in zip(pending, detection_inputs, batch_results):
+            candidates = scale_detections(candidates, scale_x, scale_y)
+            candidates_list[idx] = candidates
+            if detection_cache is not None:
+                detection_cache.put(sources[idx].content_hash, model_hash, RAW_DETECTION_CONF, RAW_DETECTION_IOU,
+                                    candidates)
+    return candidates_list
+
+def detect_image_source(source, detection_model, conf_threshold=0.25, iou_threshold=0.7, detection_cache=None,
+                        raise_on_error=False):
+    """
+    对图像源进行检测：先获取原始候选框 (可命中持久化缓存)，再按阈值在 NumPy 中筛选。
+    置信度阈值低于 RAW_DETECTION_CONF 时无法由候选框推导，直接按该阈值检测。
+    raise_on_error 为 True 时检测异常直接抛出，否则打印错误并返回空结果。
+    """
+    if conf_threshold < RAW_DETECTION_CONF:
+        detection_rgb, (scale_x, scale_y) = detection_input_for(source)
+        source.inference_size = inference_size_for(detection_rgb, detection_model)
+        return scale_detections(detect_censors(detection_rgb, detection_model, conf_threshold, iou_threshold,
+                                               raise_on_error=raise_on_error, imgsz=source.inference_size),
+                                scale_x, scale_y)
+    candidates = detect_image_candidates(source, detection_model, detection_cache, raise_on_error=raise_on_error)
+    return filter_detections(candidates, conf_threshold, iou_threshold)
+
+def build_effect_params(mosaic_type, custom_image_path=None, line_direction='horizontal', alpha=1.0,
+                        blur_kernel_size=(31, 31), line_thickness=5, line_spacing=10, mist_color=(255, 255, 255),
+                        light_intensity=0.8, light_feather=30, light_color=(255, 255, 255)):
+    """
+    将界面/命令行的打码参数转换为合成引擎的 (效果名称, 效果参数)，供 composite_mosaic 使用。
+    未知的打码方式返回 (None, {})。
+    """
+    effect_params = {}
+    effect = MOSAIC_EFFECTS.get(mosaic_type)
+    if effect == "blur":
+        effect_params = {"kernel_size": blur_kernel_size, "alpha": alpha}
+    elif effect == "black_lines":
+        effect_params = {"line_thickness": line_thickness, "spacing": line_spacing,
+                         "direction": line_direction, "alpha": alpha}
+    elif effect == "white_mist":
+        effect_params = {"strength": alpha, "color": mist_color} # alpha作雾气强度
+    elif effect == "light":
+        effect_params = {"intensity": light_intensity, "feather": light_feather, "color": light_color}
+    elif effect == "custom_image":
+        # 贴图按路径缓存解码结果与分辨率金字塔，批量处理时无需重复读取和解码
+        if custom_image_path and os.path.exists(custom_image_path):
+            try:
+                overlay = get_overlay_texture(custom_image_path)
+            except Exception as e_custom:
+                print(f"加载自定义图像 '{custom_image_path}' 失败: {e_custom}。将使用默认图像。")
+                overlay = get_default_overlay_texture()
+        else:
+            if custom_image_path: # 提供了路径但文件不存在
+                print(f"警告: 自定义图像路径 '{custom_image_path}' 不存在。将使用默认图像。")
+            overlay = get_default_overlay_texture()
+        effect_params = {"overlay": overlay, "alpha": alpha if alpha is not None else 1.0}
+    return effect, effect_params
+
 def process_single_image(image_path, mosaic_type, selected_regions, custom_image_path=None, 
                          line_direction='horizontal', conf_threshold=0.25, iou_threshold=0.7,
                          scale=1.0, alpha=1.0, blur_kernel_size=(31, 31), 
                          line_thickness=5, line_spacing=10, 
                          mist_color=(255, 255, 255), # RGB
                          light_intensity=0.8, light_feather=30, light_color=(255, 255, 255), # RGB
-                         cached_detection_results=None):
+                         cached_detection_results=None, detection_cache=None, return_detection_results=False,
+                         cancel_check=None, timings=None):
     """
     处理单张图片。
-    现在使用条件逻辑加载主图像和自定义图像。
+    image_path 可以是文件路径，也可以是 ImageSource / 图像字节 / RGB 数组 / PIL 图像，
+    图像只解码一次，检测与打码共用同一个 RGB 缓冲区。
+    detection_cache 为可选的 DetectionCache 持久化缓存；
+    return_detection_results 为 True 时额外返回本次使用的检测结果 (第四个返回值)。
+    cancel_check 为可选的无参回调，在解码、检测之后及每个区域渲染前调用，
+    返回 True 时抛出 RenderCancelledError (不会被转换为错误信息)，用于放弃已过期的预览渲染。
+    timings 为可选的字典，用于记录各阶段耗时 (秒)：decode / detect / render。
     """
+    original_image = None
+    source = None
+    detection_results = None
+
+    def _finish(original_pil, processed_pil, error):
+        if return_detection_results:
+            return original_pil, processed_pil, error, detection_results
+        return original_pil, processed_pil, error
+
     try:
-        original_image = _load_image_data_rgb(image_path)
+        stage_start = time.perf_counter()
+        source = ImageSource.wrap(image_path)
+        original_image = source.rgb
+        if timings is not None:
+            timings["decode"] = time.perf_counter() - stage_start
+            stage_start = time.perf_counter()
         
-        if not detection_model:
-            return Image.fromarray(original_image), None, "错误：检测模型未能成功加载。"
+        if cancel_check is not None and cancel_check():
+            raise RenderCancelledError()
         
         if cached_detection_results is not None:
+            # 调用方已提供检测结果 (例如推理服务的微批次结果)，不需要加载模型
             detection_results = cached_detection_results
         else:
-            detection_results = detect_censors(image_path, detection_model, conf_threshold, iou_threshold)
+            detection_model = get_detection_model()
+            if not detection_model:
+                return _finish(Image.fromarray(original_image), None, "错误：检测模型未能成功加载。")
+            detection_results = detect_image_source(source, detection_model, conf_threshold, iou_threshold,
+                                                    detection_cache=detection_cache)
+        if timings is not None:
+            timings["detect"] = time.perf_counter() - stage_start
+            stage_start = time.perf_counter()
+        if cancel_check is not None and cancel_check():
+            raise RenderCancelledError()
         
         filtered_boxes = []
         if detection_results:
@@ -135,90 +570,114 @@ def process_single_image(image_path, mosaic_type, selected_regions, custom_image
                     filtered_boxes.append(bbox)
         
         if not filtered_boxes:
-            return Image.fromarray(original_image), Image.fromarray(original_image), "未检测到需要打码的区域。"
-        
-        processed_image_np = original_image.copy() # 对 NumPy 数组进行操作
+            return _finish(Image.fromarray(original_image), Image.fromarray(original_image), "未检测到需要打码的区域。")
         
-        custom_img_to_apply_np = None
-        if mosaic_type == "自定义图像":
-            if custom_image_path and os.path.exists(custom_image_path):
-                try:
-                    custom_img_to_apply_np = _load_image_data_rgba(custom_image_path)
-                except Exception as e_custom:
-                    print(f"加载自定义图像 '{custom_image_path}' 失败: {e_custom}。将使用默认图像。")
-                    custom_img_to_apply_np = get_default_custom_image()
-            else:
-                if custom_image_path: # 提供了路径但文件不存在
-                    print(f"警告: 自定义图像路径 '{custom_image_path}' 不存在。将使用默认图像。")
-                custom_img_to_apply_np = get_default_custom_image()
-
-        for box in filtered_boxes:
-            processed_image_bgr = cv2.cvtColor(processed_image_np, cv2.COLOR_RGB2BGR)
-
-            if mosaic_type == "常规模糊":
-                processed_image_bgr = apply_blur_mosaic(processed_image_bgr, box, 
-                                                       kernel_size=blur_kernel_size, 
-                                                       scale=scale, alpha=alpha)
-            elif mosaic_type == "黑色线条":
-                processed_image_bgr = apply_black_lines_mosaic(processed_image_bgr, box, 
-                                                              line_thickness=line_thickness, 
-                                                              spacing=line_spacing,
-                                                              scale=scale, 
-                                                              direction=line_direction,
-                                                              alpha=alpha)
-            elif mosaic_type == "白色雾气":
-                bgr_mist_color = (mist_color[2], mist_color[1], mist_color[0]) # RGB to BGR
-                processed_image_bgr = apply_white_mist_mosaic(processed_image_bgr, box, 
-                                                             strength=alpha, # alpha作雾气强度
-                                                             scale=scale,
-                                                             color=bgr_mist_color)
-            elif mosaic_type == "光效马赛克":
-                bgr_light_color = (light_color[2], light_color[1], light_color[0]) # RGB to BGR
-                processed_image_bgr = apply_light_mosaic(processed_image_bgr, box, 
-                                                        intensity=light_intensity,
-                                                        feather=light_feather,
-                                                        color=bgr_light_color,
-                                                        scale=scale)
-            elif mosaic_type == "自定义图像":
-                if custom_img_to_apply_np is not None:
-                    processed_image_np = apply_custom_image_mosaic(processed_image_np, box, custom_img_to_apply_np,
-                                                               scale=scale, alpha=alpha if alpha is not None else 1.0)
-                    continue # 跳过最后的 BGR to RGB 转换，因为 processed_image_np 已被更新
-                else:
-                    print("警告：自定义图像未能加载，此区域未应用自定义图像。")
+        effect, effect_params = build_effect_params(
+            mosaic_type, custom_image_path=custom_image_path, line_direction=line_direction, alpha=alpha,
+            blur_kernel_size=blur_kernel_size, line_thickness=line_thickness, line_spacing=line_spacing,
+            mist_color=mist_color, light_intensity=light_intensity, light_feather=light_feather, light_color=light_color)
 
-
-            if mosaic_type != "自定义图像":
-                 processed_image_np = cv2.cvtColor(processed_image_bgr, cv2.COLOR_BGR2RGB)
+        # 所有区域在同一个 RGB 工作缓冲区上就地合成，颜色参数直接使用 RGB
+        processed_image_np = original_image.copy()
+        if effect is not None:
+            composite_mosaic(processed_image_np, filtered_boxes, effect, scale=scale, cancel_check=cancel_check,
+                             **effect_params)
+        if timings is not None:
+            timings["render"] = time.perf_counter() - stage_start
         
-        return Image.fromarray(original_image), Image.fromarray(processed_image_np), None
+        return _finish(Image.fromarray(original_image), Image.fromarray(processed_image_np), None)
 
+    except RenderCancelledError:
+        raise
     except FileNotFoundError as e_fnf: # 特定处理文件未找到错误
-        print(f"处理图像时发生文件未找到错误 ({image_path}): {e_fnf}")
-        return None, None, f"文件未找到: {e_fnf}"
+        print(f"处理图像时发生文件未找到错误 ({_describe_source(source, image_path)}): {e_fnf}")
+        return _finish(None, None, f"文件未找到: {e_fnf}")
     except IOError as e_io: # 特定处理图像读写错误
-        print(f"处理图像时发生IO错误 ({image_path}): {e_io}")
-        return None, None, f"图像读取错误: {e_io}"
+        print(f"处理图像时发生IO错误 ({_describe_source(source, image_path)}): {e_io}")
+        return _finish(None, None, f"图像读取错误: {e_io}")
     except Exception as e:
         import traceback
-        print(f"处理图像时发生未知错误 ({image_path}): {e}")
+        print(f"处理图像时发生未知错误 ({_describe_source(source, image_path)}): {e}")
         traceback.print_exc()
         try:
             if isinstance(original_image, np.ndarray):
                 pil_original = Image.fromarray(original_image)
             else:
                 pil_original = original_image if original_image is not None else Image.new("RGB", (100,100), "pink") # 最后的备用
-            return pil_original, None, f"处理图像时发生错误: {e}"
+            return _finish(pil_original, None, f"处理图像时发生错误: {e}")
         except: # 如果连原始图像都无法返回
-             return None, None, f"处理图像时发生严重错误: {e}"
+             return _finish(None, None, f"处理图像时发生严重错误: {e}")
+
+
+def _scale_pixel_params(render_params, ratio):
+    """将以像素为单位的打码参数 (模糊核、线条粗细与间距) 按比例换算到代理图分辨率"""
+    if ratio >= 1.0:
+        return render_params
+    scaled = dict(render_params)
+    if "blur_kernel_size" in scaled:
+        # 高斯模糊核必须为正奇数
+        scaled["blur_kernel_size"] = tuple(max(1, int(k * ratio)) | 1 for k in scaled["blur_kernel_size"])
+    if "line_thickness" in scaled:
+        scaled["line_thickness"] = max(1, round(scaled["line_thickness"] * ratio))
+    if "line_spacing" in scaled:
+        scaled["line_spacing"] = max(1, round(scaled["line_spacing"] * ratio))
+    return scaled
+
+def render_preview(image_source, max_width, max_height, mosaic_type, selected_regions,
+                   cached_detection_results=None, **render_params):
+    """
+    在缩小的代理图上渲染打码预览，用于界面交互。
+    代理图只生成一次，检测框与像素参数按缩放比例换算后直接在代理图上渲染，
+    全分辨率渲染仅在处理/保存时进行。返回值与 process_single_image 相同。
+    """
+    source = ImageSource.wrap(image_source)
+    try:
+        proxy_rgb, ratio = source.proxy(max_width, max_height)
+    except Exception as e:
+        print(f"生成预览代理图失败 ({source.name}): {e}")
+        return None, None, f"图像读取错误: {e}"
+
+    scaled_detections = cached_detection_results
+    if cached_detection_results is not None:
+        scaled_detections = scale_detections(cached_detection_results, ratio, ratio)
+    return process_single_image(proxy_rgb, mosaic_type, selected_regions,
+                                cached_detection_results=scaled_detections,
+                                **_scale_pixel_params(render_params, ratio))
 
+def _describe_source(source, image_path):
+    """用于日志输出的图像来源描述"""
+    if source is not None:
+        return source.path or source.name
+    return image_path if isinstance(image_path, (str, os.PathLike)) else type(image_path).__name__
 
-def get_image_object_names(image_path, conf_threshold=0.25, iou_threshold=0.7):
-    """获取图像中可识别的目标类型列表，并返回检测结果"""
+def get_detection_candidates(image_path, detection_cache=None):
+    """
+    获取图像与阈值无关的原始候选框 (以最低置信度只检测一次)。
+    之后可用 utils.filter_detections 按任意置信度/IOU阈值即时重新筛选。
+    返回 (候选框列表, 错误信息)。
+    """
+    detection_model = get_detection_model()
+    if not detection_model:
+        return None, "错误：检测模型未加载。"
+    try:
+        source = ImageSource.wrap(image_path)
+        return detect_image_candidates(source, detection_model, detection_cache), None
+    except Exception as e:
+        return None, f"分析图像时出错: {e}"
+
+def get_image_object_names(image_path, conf_threshold=0.25, iou_threshold=0.7, detection_candidates=None):
+    """
+    获取图像中可识别的目标类型列表，并返回检测结果 (image_path 同样接受 ImageSource 等内存图像)。
+    若提供了 detection_candidates (原始候选框)，则直接按阈值筛选而不重新检测。
+    """
+    detection_model = get_detection_model()
     if not detection_model:
         return [], None, "错误：检测模型未加载。"
     try:
-        results = detect_censors(image_path, detection_model, conf_threshold, iou_threshold)
+        if detection_candidates is not None:
+            results = filter_detections(detection_candidates, conf_threshold, iou_threshold)
+        else:
+            results = detect_image_source(ImageSource.wrap(image_path), detection_model, conf_threshold, iou_threshold)
         detected_names = set()
         
         if results:
@@ -231,6 +690,506 @@ def get_image_object_names(image_path, conf_threshold=0.25, iou_threshold=0.7):
     except Exception as e:
         return [], None, f"分析图像时出错: {e}"
 
+def _resolve_output_path(file_path, input_root, output_folder_obj):
+    """计算输出文件路径：输入为文件夹时保持相对目录结构，输入为单个文件时直接放在输出文件夹下"""
+    if input_root is not None:
+        return output_folder_obj / file_path.relative_to(input_root)
+    return output_folder_obj / file_path.name
+
+def encode_image_for_path(pil_image, output_file_path):
+    """按输出文件扩展名 (output_file_path 为字符串或 Path) 将 PIL 图像编码为字节"""
+    suffix = Path(output_file_path).suffix.lower()
+    if suffix in ['.jpg', '.jpeg'] and pil_image.mode in ('RGBA', 'P'):
+        # 对于JPEG，转换为RGB（去除Alpha / 调色板）
+        pil_image = pil_image.convert('RGB')
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format=Image.registered_extensions().get(suffix, 'PNG'))
+    return buffer.getvalue()
+
+def save_image_to_path(pil_image, output_file_path):
+    """按输出文件扩展名编码 PIL 图像并写入文件，输出文件夹不存在时自动创建"""
+    output_file_path = Path(output_file_path)
+    encoded = encode_image_for_path(pil_image, output_file_path)
+    output_file_path.parent.mkdir(parents=True, exist_ok=True)
+    output_file_path.write_bytes(encoded)
+
+def _send_error_placeholder(image_preview_callback, file_name):
+    """图像无法加载时向预览回调发送一个占位图"""
+    error_placeholder = Image.new("RGB", (200, 200), "pink")
+    try:
+        draw = ImageDraw.Draw(error_placeholder)
+        draw.text((10, 10), f"无法加载:\n{file_name[:20]}...", fill="black")
+    except ImportError:
+        pass
+    image_preview_callback(error_placeholder, None)
+
+SUPPORTED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')
+
+class FileDiscovery:
+    """
+    以 os.scandir 流式遍历输入文件夹，边遍历边产出支持的图像文件路径，
+    批处理无需等待整个目录树遍历结束即可开始。扩展名与文件类型只用 DirEntry 自带的信息判断，
+    不会为每个文件额外调用 stat (符号链接除外)。
+    found 为目前已发现的图像数 (遍历过程中可作为近似总数)，finished 为 True 后即为准确总数。
+    """
+
+    def __init__(self, root, extensions=SUPPORTED_IMAGE_EXTENSIONS, exclude_dirs=()):
+        self.root = str(root)
+        self.extensions = frozenset(ext.lower() for ext in extensions)
+        # 输出文件夹位于输入文件夹内时需要排除，否则会把刚写出的结果再处理一遍
+        self._exclude_dirs = {os.path.normcase(os.path.abspath(str(d))) for d in exclude_dirs}
+        self.found = 0
+        self.finished = False
+
+    def __iter__(self):
+        pending_dirs = [self.root]
+        while pending_dirs:
+            directory = pending_dirs.pop()
+            subdirs = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            # 与 rglob 一致：不进入指向目录的符号链接，避免循环
+                            if entry.is_dir(follow_symlinks=False):
+                                if os.path.normcase(os.path.abspath(entry.path)) not in self._exclude_dirs:
+                                    subdirs.append(entry.path)
+                                continue
+                            if os.path.splitext(entry.name)[1].lower() not in self.extensions or not entry.is_file():
+                                continue
+                        except OSError:
+                            continue
+                        self.found += 1
+                        yield Path(entry.path)
+            except OSError as e:
+                print(f"无法读取文件夹 ({directory}): {e}")
+            # 逆序入栈，保持子目录按遍历顺序处理
+            pending_dirs.extend(reversed(subdirs))
+        self.finished = True
+
+class _BatchItem:
+    """在批处理流水线各阶段之间传递的单个文件的处理状态"""
+    __slots__ = ("index", "file_path", "file_stat", "content_hash", "source", "detections", "detection_error",
+                 "inference_size", "encoded", "output_path", "error")
+
+    def __init__(self, index, file_path):
+        self.index = index
+        self.file_path = file_path
+        self.file_stat = None
+        self.content_hash = None
+        self.source = None
+        self.detections = None
+        self.detection_error = None
+        self.inference_size = None
+        self.encoded = None
+        self.output_path = None
+        self.error = None
+
+_PIPELINE_END = object()
+
+def _run_batch_pipeline(files_to_process, total_files, input_root, output_folder_obj, render_params,
+                        detection_cache=None, inference_batch_size=1, decode_workers=2, render_workers=2,
+                        queue_size=8, progress_callback=None, status_callback=None, image_preview_callback=None,
+                        journal=None, result_callback=None):
+    """
+    分阶段的批处理流水线：
+    解码线程池 -> 单一推理阶段 (按批合并) -> 打码/编码线程池 -> 后台写盘。
+    各阶段之间通过有界队列连接，同一时刻驻留内存的图像数量受 queue_size 限制。
+    files_to_process 可以是边遍历边产出的迭代器 (见 FileDiscovery)，由输入阶段逐个读取；
+    total_files 为总数或返回当前近似总数的可调用对象，仅用于进度与状态显示。
+    提供 BatchJournal 时，每个文件写盘 (或失败) 后记录其处理结果，供中断后续跑时跳过。
+    result_callback 为可选回调，每个文件结束后以结果字典 (input / output / status / error / inference_size) 调用。
+
+    Returns:
+        统计信息字典 (processed / failed / inference_seconds / inferred_images)
+    """
+    decode_workers = max(1, int(decode_workers))
+    render_workers = max(1, int(render_workers))
+    inference_batch_size = max(1, int(inference_batch_size))
+    queue_size = max(1, int(queue_size))
+
+    path_queue = queue.Queue(maxsize=queue_size)
+    decoded_queue = queue.Queue(maxsize=queue_size)
+    render_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+
+    conf_threshold = render_params["conf_threshold"]
+    iou_threshold = render_params["iou_threshold"]
+    # 置信度低于原始候选框阈值时无法由候选框筛选，只能逐张按该阈值检测 (同样在推理阶段进行)
+    use_batched_inference = conf_threshold >= RAW_DETECTION_CONF
+    stats = {"processed": 0, "failed": 0, "inference_seconds": 0.0, "inferred_images": 0}
+
+    def _current_total():
+        if callable(total_files):
+            return total_files()
+        return total_files or 0
+
+    def _feed_stage():
+        try:
+            for index, file_path in enumerate(files_to_process):
+                item = _BatchItem(index, Path(file_path))
+                if journal is not None:
+                    # 在读取文件之前记录大小与修改时间，处理期间被修改的文件下次会重新处理
+                    try:
+                        item.file_stat = os.stat(file_path)
+                    except OSError:
+                        item.file_stat = None
+                path_queue.put(item)
+        finally:
+            for _ in range(decode_workers):
+                path_queue.put(_PIPELINE_END)
+
+    def _decode_stage():
+        try:
+            while True:
+                item = path_queue.get()
+                if item is _PIPELINE_END:
+                    break
+                # 此阶段只做检测所需的缩小解码 (JPEG)，全分辨率解码留到打码阶段进行 (需分块检测的超大图像除外)
+                item.source = ImageSource(item.file_path)
+                try:
+                    detection_input_for(item.source)
+                except Exception as e_decode:
+                    # 解码失败的文件不参与推理，由打码阶段统一报告错误
+                    print(f"批量处理中图像解码失败 ({item.file_path.name}): {e_decode}")
+                    item.error = e_decode
+                decoded_queue.put(item)
+        finally:
+            decoded_queue.put(_PIPELINE_END)
+
+    def _flush_inference_batch(batch, detection_model):
+        # 检测模型 (ultralytics 预测器) 不是线程安全的，所有推理 (包括逐张回退检测) 都只在推理阶段的单一线程中进行
+        detectable = [item for item in batch if item.error is None]
+        if not detection_model:
+            for item in detectable:
+                item.detection_error = "错误：检测模型未能成功加载。"
+            detectable = []
+        inference_start = time.perf_counter()
+        if use_batched_inference and detectable:
+            candidates_list = detect_image_candidates_batch([item.source for item in detectable],
+                                                            detection_model, detection_cache)
+            for item, candidates in zip(detectable, candidates_list):
+                if candidates is not None:
+                    item.detections = filter_detections(candidates, conf_threshold, iou_threshold)
+        for item in detectable:
+            if item.detections is not None:
+                continue
+            # 低置信度阈值或批量检测失败的图像逐张检测
+            try:
+                item.detections = detect_image_source(item.source, detection_model, conf_threshold, iou_threshold,
+                                                      detection_cache=detection_cache)
+            except Exception as e_detect:
+                print(f"批量处理中图像检测失败 ({item.file_path.name}): {e_detect}")
+                item.detection_error = f"检测失败: {e_detect}"
+        if detectable:
+            stats["inference_seconds"] += time.perf_counter() - inference_start
+            stats["inferred_images"] += len(detectable)
+        for item in batch:
+            render_queue.put(item)
+
+    def _inference_stage():
+        finished_decoders = 0
+        batch = []
+        try:
+            # 模型在推理线程中加载，解码阶段同时开始工作，缩短冷启动到第一张图像的时间
+            detection_model = get_detection_model()
+            while finished_decoders < decode_workers:
+                item = decoded_queue.get()
+                if item is _PIPELINE_END:
+                    finished_decoders += 1
+                else:
+                    batch.append(item)
+                # 批次已满、解码全部结束或暂时没有更多已解码图像时立即推理，避免空等
+                if batch and (len(batch) >= inference_batch_size or finished_decoders == decode_workers
+                              or decoded_queue.empty()):
+                    _flush_inference_batch(batch, detection_model)
+                    batch = []
+        finally:
+            if batch:
+                # 推理阶段异常退出时剩余的图像没有检测结果，按失败处理
+                for item in batch:
+                    if item.error is None and item.detections is None and item.detection_error is None:
+                        item.detection_error = "检测失败: 推理阶段异常退出"
+                    render_queue.put(item)
+            for _ in range(render_workers):
+                render_queue.put(_PIPELINE_END)
+
+    def _render_stage():
+        try:
+            while True:
+                item = render_queue.get()
+                if item is _PIPELINE_END:
+                    break
+                if status_callback:
+                    status_callback(f"正在处理: {item.file_path.name} ({item.index + 1}/{max(_current_total(), item.index + 1)})")
+                try:
+                    if item.detection_error is not None:
+                        # 推理阶段检测失败的图像不输出 (未打码的图像不能写入输出文件夹)
+                        item.error = f"处理失败 {item.file_path.name}: {item.detection_error}"
+                        if image_preview_callback:
+                            _send_error_placeholder(image_preview_callback, item.file_path.name)
+                    else:
+                        # 检测结果全部来自推理阶段，此处不再调用模型；解码失败的图像没有检测结果，由解码报告具体错误
+                        item.source.release_detection_input()
+                        original_pil, processed_pil_image, error = process_single_image(
+                            item.source, **render_params,
+                            cached_detection_results=item.detections if item.detections is not None else []
+                        )
+                        if image_preview_callback:
+                            if original_pil is None:
+                                _send_error_placeholder(image_preview_callback, item.file_path.name)
+                            else:
+                                image_preview_callback(original_pil, processed_pil_image)
+                        if processed_pil_image and not error:
+                            item.output_path = _resolve_output_path(item.file_path, input_root, output_folder_obj)
+                            try:
+                                item.encoded = encode_image_for_path(processed_pil_image, item.output_path)
+                            except Exception as e_encode:
+                                item.error = f"保存失败 {item.file_path.name}: {e_encode}"
+                        elif error:
+                            item.error = f"处理失败 {item.file_path.name}: {error}"
+                except Exception as e_render:
+                    item.error = f"处理失败 {item.file_path.name}: {e_render}"
+                if item.source is not None:
+                    item.inference_size = item.source.inference_size
+                if journal is not None and item.source is not None and item.error is None:
+                    try:
+                        item.content_hash = item.source.content_hash
+                    except Exception:
+                        item.content_hash = None
+                # 释放解码缓冲区，控制流水线中的内存占用
+                item.source = None
+                item.detections = None
+                write_queue.put(item)
+        finally:
+            write_queue.put(_PIPELINE_END)
+
+    def _write_stage():
+        finished_renderers = 0
+        completed = 0
+        while finished_renderers < render_workers:
+            item = write_queue.get()
+            if item is _PIPELINE_END:
+                finished_renderers += 1
+                continue
+            if item.encoded is not None:
+                try:
+                    item.output_path.parent.mkdir(parents=True, exist_ok=True)
+                    item.output_path.write_bytes(item.encoded)
+                except Exception as e_save:
+                    item.error = f"保存失败 {item.file_path.name}: {e_save}"
+                item.encoded = None
+            if item.error:
+                stats["failed"] += 1
+                if status_callback:
+                    status_callback(str(item.error))
+            else:
+                stats["processed"] += 1
+            if journal is not None:
+                try:
+                    journal.record(item.file_path, item.file_stat, item.output_path, item.error, item.content_hash)
+                except Exception as e_journal:
+                    print(f"写入批处理日志失败 ({item.file_path.name}): {e_journal}")
+            if result_callback:
+                result_callback({
+                    "input": str(item.file_path),
+                    "output": str(item.output_path) if item.output_path and not item.error else None,
+                    "status": "failed" if item.error else "done",
+                    "error": str(item.error) if item.error else None,
+                    "inference_size": list(item.inference_size) if item.inference_size else None,
+                })
+            completed += 1
+            if progress_callback:
+                progress_callback(completed, max(_current_total(), completed))
+
+    stage_threads = [threading.Thread(target=_feed_stage, daemon=True)]
+    stage_threads += [threading.Thread(target=_decode_stage, daemon=True) for _ in range(decode_workers)]
+    stage_threads.append(threading.Thread(target=_inference_stage, daemon=True))
+    stage_threads += [threading.Thread(target=_render_stage, daemon=True) for _ in range(render_workers)]
+    for thread in stage_threads:
+        thread.start()
+    _write_stage()
+    for thread in stage_threads:
+        thread.join()
+    if journal is not None:
+        journal.flush()
+    return stats
+
+class _JournalForwarder:
+    """
+    工作进程中代替 BatchJournal 的记录器：把每个文件的处理结果通过 message_queue 发回主进程，
+    由主进程唯一的日志连接写入，避免多个进程同时写同一个 SQLite 文件而相互等待写锁。
+    """
+
+    def __init__(self, worker_id, message_queue):
+        self.worker_id = worker_id
+        self.message_queue = message_queue
+
+    def record(self, file_path, file_stat, output_path=None, error=None, content_hash=None):
+        self.message_queue.put(("journal", self.worker_id, (
+            str(file_path), file_stat, str(output_path) if output_path else None,
+            str(error) if error else None, content_hash)))
+
+    def flush(self):
+        pass
+
+def _batch_worker_main(worker_id, path_queue, input_root, output_folder_path, render_params, pipeline_options,
+                       use_detection_cache, detection_cache_path, torch_threads, message_queue,
+                       use_journal=False, report_results=False):
+    """
+    多进程批处理的工作进程入口：设置 torch 线程数，加载一次检测模型，
+    以单进程流水线处理从共享的 path_queue 中取得的文件 (None 表示结束)，
+    并通过 message_queue 向主进程汇报进度与状态 (report_results 为 True 时还汇报逐文件结果，
+    use_journal 为 True 时还汇报需要写入批处理日志的处理结果)。
+    """
+    stats = {"processed": 0, "failed": 0, "inference_seconds": 0.0, "inferred_images": 0}
+    detection_cache = None
+    journal = _JournalForwarder(worker_id, message_queue) if use_journal else None
+    try:
+        if torch_threads:
+            try:
+                import torch
+                torch.set_num_threads(int(torch_threads))
+            except ImportError:
+                pass
+        get_detection_model()
+        if use_detection_cache:
+            try:
+                detection_cache = DetectionCache(detection_cache_path)
+            except Exception as e_cache_open:
+                print(f"[进程 {worker_id}] 无法打开检测缓存 ({detection_cache_path}): {e_cache_open}，将不使用缓存。")
+
+        last_completed = [0]
+        def _progress(completed, _total):
+            message_queue.put(("progress", worker_id, completed - last_completed[0]))
+            last_completed[0] = completed
+
+        def _status(message):
+            # 逐文件的“正在处理”消息过于频繁，只转发错误等其余状态
+            if not message.startswith("正在处理"):
+                message_queue.put(("status", worker_id, message))
+
+        def _result(result):
+            message_queue.put(("result", worker_id, result))
+
+        stats = _run_batch_pipeline(
+            (Path(p) for p in iter(path_queue.get, None)), None, Path(input_root) if input_root else None,
+            Path(output_folder_path), render_params, detection_cache=detection_cache,
+            progress_callback=_progress, status_callback=_status, journal=journal,
+            result_callback=_result if report_results else None, **pipeline_options)
+    except Exception as e:
+        message_queue.put(("status", worker_id, f"工作进程 {worker_id} 出错: {e}"))
+    finally:
+        if detection_cache is not None:
+            detection_cache.close()
+        message_queue.put(("finished", worker_id, stats))
+
+def _run_multiprocess_batch(files_to_process, total_files, input_root, output_folder_obj, render_params,
+                            num_processes, torch_threads_per_worker, use_detection_cache, detection_cache_path,
+                            pipeline_options, progress_callback=None, status_callback=None, journal=None,
+                            result_callback=None):
+    """
+    启动 num_processes 个工作进程 (spawn 方式)，主进程边遍历边把文件路径放入共享的有界队列，
+    各进程按自身处理速度从中领取文件，每个进程各自加载检测模型并运行单进程流水线，
+    主进程汇总进度与状态回调。total_files 含义同 _run_batch_pipeline。
+    提供 BatchJournal 时，各工作进程的处理结果汇总到主进程，只由主进程写入日志。
+    """
+    num_processes = max(1, int(num_processes))
+    if not torch_threads_per_worker:
+        torch_threads_per_worker = max(1, (os.cpu_count() or 1) // num_processes)
+
+    context = multiprocessing.get_context("spawn")
+    message_queue = context.Queue()
+    path_queue = context.Queue(maxsize=num_processes * max(1, int(pipeline_options.get("queue_size", 8))) * 2)
+
+    def _feed_paths():
+        try:
+            for file_path in files_to_process:
+                path_queue.put(str(file_path))
+        except Exception as e:
+            print(f"遍历输入文件时出错: {e}")
+        finally:
+            for _ in range(num_processes):
+                path_queue.put(None)
+
+    workers = []
+    for worker_id in range(num_processes):
+        worker = context.Process(
+            target=_batch_worker_main,
+            args=(worker_id, path_queue, str(input_root) if input_root else None, str(output_folder_obj), render_params,
+                  pipeline_options, use_detection_cache, detection_cache_path, torch_threads_per_worker,
+                  message_queue, journal is not None, result_callback is not None),
+            daemon=True)
+        worker.start()
+        workers.append(worker)
+    threading.Thread(target=_feed_paths, daemon=True).start()
+    if status_callback:
+        status_callback(f"已启动 {num_processes} 个工作进程 (每个进程 {torch_threads_per_worker} 个推理线程)...")
+
+    stats = {"processed": 0, "failed": 0, "inference_seconds": 0.0, "inferred_images": 0}
+    completed = 0
+    finished_workers = set()
+    while len(finished_workers) < num_processes:
+        try:
+            kind, worker_id, payload = message_queue.get(timeout=1.0)
+        except queue.Empty:
+            # 工作进程异常退出 (未发送 finished 消息) 时不再等待它
+            for worker_id, worker in enumerate(workers):
+                if worker_id not in finished_workers and not worker.is_alive() and message_queue.empty():
+                    finished_workers.add(worker_id)
+                    if status_callback:
+                        status_callback(f"工作进程 {worker_id} 意外退出 (退出码 {worker.exitcode})")
+            continue
+        if kind == "progress":
+            completed += payload
+            if progress_callback:
+                current_total = total_files() if callable(total_files) else total_files
+                progress_callback(completed, max(current_total, completed))
+        elif kind == "status":
+            if status_callback:
+                status_callback(payload)
+        elif kind == "result":
+            if result_callback:
+                result_callback(payload)
+        elif kind == "journal":
+            try:
+                journal.record(*payload)
+            except Exception as e_journal:
+                print(f"写入批处理日志失败 ({payload[0]}): {e_journal}")
+        elif kind == "finished":
+            finished_workers.add(worker_id)
+            for key in stats:
+                stats[key] += payload.get(key, 0)
+
+    for worker in workers:
+        worker.join(timeout=5)
+    if journal is not None:
+        journal.flush()
+    # 各进程的推理并行进行，以平均推理耗时估算整体检测阶段吞吐
+    stats["inference_seconds"] /= num_processes
+    return stats
+
+def _batch_params_fingerprint(render_params):
+    """
+    批处理参数指纹：打码参数、检测模型权重或自定义贴图文件任一变化时，
+    之前生成的输出都不再是最新的，需要重新处理。
+    """
+    normalized_params = dict(render_params)
+    normalized_params["selected_regions"] = sorted(render_params.get("selected_regions") or [])
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(json.dumps(normalized_params, sort_keys=True, default=str).encode("utf-8"))
+    hasher.update(str(get_model_fingerprint()).encode("utf-8"))
+    if render_params.get("mosaic_type") == "自定义图像":
+        overlay_path = render_params.get("custom_image_path")
+        if not overlay_path or not os.path.exists(overlay_path):
+            overlay_path = DEFAULT_HEAD_PATH
+        try:
+            overlay_stat = os.stat(overlay_path)
+            hasher.update(f"{os.path.abspath(overlay_path)}:{overlay_stat.st_size}:{overlay_stat.st_mtime_ns}".encode("utf-8"))
+        except OSError:
+            pass
+    return hasher.hexdigest()
+
 def batch_process_images(input_path, output_folder_path, mosaic_type, selected_regions, 
                          custom_image_path=None, line_direction='horizontal',
                          conf_threshold=0.25, iou_threshold=0.7,
@@ -238,100 +1197,330 @@ def batch_process_images(input_path, output_folder_path, mosaic_type, selected_r
                          line_thickness=5, line_spacing=10, 
                          mist_color=(255, 255, 255), # RGB
                          light_intensity=0.8, light_feather=30, light_color=(255, 255, 255), # RGB
-                         progress_callback=None, status_callback=None, image_preview_callback=None):
-    """批量处理图像"""
+                         progress_callback=None, status_callback=None, image_preview_callback=None,
+                         use_detection_cache=True, detection_cache_path=DEFAULT_DETECTION_CACHE_PATH,
+                         inference_batch_size=1, decode_workers=2, render_workers=2, pipeline_queue_size=8,
+                         num_processes=1, torch_threads_per_worker=None, resume=True, result_callback=None):
+    """
+    批量处理图像。
+    处理以流水线方式进行：解码线程池、单一推理阶段、打码/编码线程池与后台写盘相互重叠，
+    各阶段之间由容量为 pipeline_queue_size 的有界队列连接，以限制内存占用。
+    use_detection_cache 为 True 时使用按文件内容哈希索引的持久化检测缓存，
+    同一文件夹换用其他打码方式重新处理时无需再次推理。
+    inference_batch_size 为每次送入模型的最大图像数量，大于 1 时多张图像合并为一个批次推理，
+    结束时会报告整体与检测阶段的吞吐 (张/秒)，可借助 benchmark_inference_batch_sizes 选择合适的值。
+    输入为文件夹时以 os.scandir 流式遍历 (见 FileDiscovery)，边遍历边处理，进度总数为随遍历增长的近似值。
+    num_processes 大于 1 时启用多进程模式：各工作进程从共享队列领取文件，每个进程只加载一次检测模型，
+    torch_threads_per_worker 为每个进程的 torch 推理线程数 (默认按 CPU 核数平分)；
+    该模式下进度与状态回调照常工作，但不会调用 image_preview_callback。
+    resume 为 True 时在输出文件夹中维护批处理日志 (BatchJournal)：重新运行时跳过
+    大小、修改时间 (或内容哈希) 与打码参数均未变化且输出仍存在的文件，失败及中断的文件会重新处理。
+    result_callback 为可选回调，每个文件结束 (或被跳过) 时以结果字典调用，
+    字典包含 input / output / status ("done"、"failed" 或 "skipped") / error。
+
+    Returns:
+        统计信息字典 (processed / failed / skipped / elapsed_seconds 等)，输入路径无效时返回 None
+    """
     input_path_obj = Path(input_path)
     output_folder_obj = Path(output_folder_path)
     output_folder_obj.mkdir(parents=True, exist_ok=True)
 
+    discovery = None
     if input_path_obj.is_file():
         files_to_process = [input_path_obj]
+        input_root = None
     elif input_path_obj.is_dir():
-        supported_extensions = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp']
-        files_to_process = [p for p in input_path_obj.rglob('*') if p.suffix.lower() in supported_extensions and p.is_file()]
+        # 流式遍历：流水线在目录遍历完成之前就开始处理已发现的文件
+        discovery = FileDiscovery(input_path_obj, exclude_dirs=(output_folder_obj,))
+        files_to_process = discovery
+        input_root = input_path_obj
     else:
         if status_callback:
             status_callback(f"错误：输入路径无效: {input_path}")
         return
 
-    total_files = len(files_to_process)
+    render_params = {
+        "mosaic_type": mosaic_type, "selected_regions": selected_regions,
+        "custom_image_path": custom_image_path, "line_direction": line_direction,
+        "conf_threshold": conf_threshold, "iou_threshold": iou_threshold,
+        "scale": scale, "alpha": alpha, "blur_kernel_size": blur_kernel_size,
+        "line_thickness": line_thickness, "line_spacing": line_spacing, "mist_color": mist_color,
+        "light_intensity": light_intensity, "light_feather": light_feather, "light_color": light_color,
+    }
+
+    journal = None
+    pending_files = iter(files_to_process)
+    if resume:
+        try:
+            journal = BatchJournal(output_folder_obj, _batch_params_fingerprint(render_params))
+            on_skip = None
+            if result_callback:
+                def on_skip(file_path, output_path):
+                    result_callback({"input": str(file_path), "output": output_path, "status": "skipped", "error": None})
+            pending_files = journal.iter_pending(
+                files_to_process, content_hash_func=lambda path: ImageSource(path).content_hash, on_skip=on_skip)
+        except Exception as e_journal:
+            print(f"无法使用批处理日志 ({output_folder_obj}): {e_journal}，将处理全部文件。")
+            if journal is not None:
+                journal.close()
+            journal = None
+
+    def _approximate_total():
+        """遍历过程中需要处理的文件数的近似值 (已发现数减去已跳过数)，遍历结束后为准确值"""
+        found = discovery.found if discovery is not None else len(files_to_process)
+        return max(0, found - (journal.skipped if journal is not None else 0))
+
     if status_callback:
-        status_callback(f"开始处理 {total_files} 个文件...")
+        status_callback("开始扫描并处理文件...")
 
-    detection_cache = {}
+    # 先取出第一个需要处理的文件：全部文件均已是最新时无需加载检测模型
+    first_file = next(pending_files, None)
+    use_multiprocess = bool(num_processes and num_processes > 1 and discovery is not None)
 
-    for i, file_path in enumerate(files_to_process):
-        if status_callback:
-            status_callback(f"正在处理: {file_path.name} ({i+1}/{total_files})")
-        
-        current_original_pil = None
+    detection_cache = None
+    # 多进程模式下由各工作进程自行打开缓存
+    if first_file is not None and use_detection_cache and not use_multiprocess:
         try:
-            current_original_pil = Image.fromarray(_load_image_data_rgb(str(file_path)))
-            if image_preview_callback:
-                image_preview_callback(current_original_pil, None)
-        except Exception as e_load_preview:
-            print(f"批量处理中预览图像加载失败 ({file_path.name}): {e_load_preview}")
-            if image_preview_callback: # 发送一个占位符
-                error_placeholder = Image.new("RGB", (200, 200), "pink")
-                try:
-                    draw = ImageDraw.Draw(error_placeholder)
-                    draw.text((10, 10), f"无法加载:\n{file_path.name[:20]}...", fill="black")
-                except ImportError:
-                    pass
-                image_preview_callback(error_placeholder, None)
-
-
-        file_path_str = str(file_path)
-        cached_results = detection_cache.get(file_path_str)
-
-        original_pil, processed_pil_image, error = process_single_image(
-            file_path_str, mosaic_type, selected_regions, custom_image_path, line_direction,
-            conf_threshold, iou_threshold, scale, alpha, blur_kernel_size,
-            line_thickness, line_spacing, mist_color, light_intensity, light_feather, light_color,
-            cached_detection_results=cached_results
-        )
-        
-        if cached_results is None and not error : # 仅当处理成功且未使用缓存时才缓存结果
-            try:
-                _, new_detection_results, _ = get_image_object_names(file_path_str, conf_threshold, iou_threshold)
-                if new_detection_results is not None:
-                     detection_cache[file_path_str] = new_detection_results
-            except Exception as e_cache_detect:
-                print(f"为缓存重新检测时出错 ({file_path_str}): {e_cache_detect}")
+            detection_cache = DetectionCache(detection_cache_path)
+        except Exception as e_cache_open:
+            print(f"无法打开检测缓存 ({detection_cache_path}): {e_cache_open}，将不使用缓存。")
 
-        if image_preview_callback:
-            image_preview_callback(original_pil if original_pil else current_original_pil, processed_pil_image)
+    pipeline_options = {
+        "inference_batch_size": inference_batch_size, "decode_workers": decode_workers,
+        "render_workers": render_workers, "queue_size": pipeline_queue_size,
+    }
 
+    start_time = time.perf_counter()
+    if first_file is None:
+        stats = {"processed": 0, "failed": 0, "inference_seconds": 0.0, "inferred_images": 0}
+    else:
+        pending_files = itertools.chain((first_file,), pending_files)
+        if use_multiprocess:
+            stats = _run_multiprocess_batch(
+                pending_files, _approximate_total, input_root, output_folder_obj, render_params,
+                num_processes, torch_threads_per_worker, use_detection_cache, detection_cache_path,
+                pipeline_options, progress_callback=progress_callback, status_callback=status_callback,
+                journal=journal, result_callback=result_callback)
+        else:
+            stats = _run_batch_pipeline(
+                pending_files, _approximate_total, input_root, output_folder_obj, render_params,
+                detection_cache=detection_cache, progress_callback=progress_callback,
+                status_callback=status_callback, image_preview_callback=image_preview_callback,
+                journal=journal, result_callback=result_callback, **pipeline_options)
 
-        if processed_pil_image and not error:
-            try:
-                if input_path_obj.is_dir():
-                    relative_path = file_path.relative_to(input_path_obj)
-                    output_file_path = output_folder_obj / relative_path
-                else:
-                    output_file_path = output_folder_obj / file_path.name
-                
-                output_file_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # processed_pil_image 是 PIL Image 对象
-                save_format = output_file_path.suffix.lower()[1:]
-                if save_format in ['jpg', 'jpeg'] and processed_pil_image.mode == 'RGBA':
-                    # 对于JPEG，转换为RGB（去除Alpha）
-                    processed_pil_image.convert('RGB').save(str(output_file_path))
-                elif processed_pil_image.mode == 'P' and save_format in ['jpg', 'jpeg']: #调色板模式转RGB
-                    processed_pil_image.convert('RGB').save(str(output_file_path))
-                else:
-                    processed_pil_image.save(str(output_file_path))
+    elapsed_seconds = time.perf_counter() - start_time
+    total_files = stats["processed"] + stats["failed"]
+    skipped_files = journal.skipped if journal is not None else 0
+    if total_files and elapsed_seconds > 0:
+        throughput_text = f"批量处理吞吐: {total_files / elapsed_seconds:.2f} 张/秒 (推理批大小 {inference_batch_size}"
+        if stats["inferred_images"] and stats["inference_seconds"] > 0:
+            throughput_text += f"，检测阶段 {stats['inferred_images'] / stats['inference_seconds']:.2f} 张/秒"
+        throughput_text += ")"
+        print(throughput_text)
+        if status_callback:
+            status_callback(throughput_text)
 
-            except Exception as e_save:
-                if status_callback:
-                    status_callback(f"保存失败 {file_path.name}: {e_save}")
-        elif error:
-            if status_callback:
-                status_callback(f"处理失败 {file_path.name}: {error}")
-        
-        if progress_callback:
-            progress_callback(i + 1, total_files)
+    if detection_cache is not None:
+        print(f"检测缓存: 命中 {detection_cache.hits} 次，未命中 {detection_cache.misses} 次")
+        detection_cache.close()
+
+    if journal is not None:
+        journal.close()
 
     if status_callback:
-        status_callback(f"批量处理完成！已处理 {total_files} 个文件。")
\ No newline at end of file
+        completion_text = f"批量处理完成！已处理 {total_files} 个文件"
+        if skipped_files:
+            completion_text += f"，跳过 {skipped_files} 个未变化的文件"
+        if stats["failed"]:
+            completion_text += f"，其中 {stats['failed']} 个失败 (下次运行时会重试)"
+        status_callback(completion_text + "。")
+
+    stats["skipped"] = skipped_files
+    stats["elapsed_seconds"] = elapsed_seconds
+    return stats
+
+def benchmark_reporter(status_callback=None):
+    """基准测试的消息输出：提供 status_callback 时交给回调，否则打印"""
+    return status_callback if status_callback else print
+
+class DetectionBenchmark:
+    """
+    检测基准测试的公共部分：预先解码一组图像 (无法读取的跳过并报告)，对不同的检测方式逐一计时，
+    并以某一方式的检测框为参照计算一致性 (同类别 IOU 不低于 BOX_AGREEMENT_IOU 视为一致)。
+    各基准测试只需提供检测函数并整理自己的报告消息。
+    """
+
+    def __init__(self, image_paths, status_callback=None):
+        self.report = benchmark_reporter(status_callback)
+        self.paths = []
+        self.images = []
+        for image_path in image_paths:
+            try:
+                self.images.append(ImageSource(image_path).rgb)
+                self.paths.append(str(image_path))
+            except Exception as e:
+                self.report(f"基准测试跳过无法读取的图像 ({image_path}): {e}")
+        self.detections = {}
+
+    def run(self, name, detect, warmup=1, batch_size=None):
+        """
+        对全部图像计时运行一种检测方式。detect 默认以单张 RGB 图像调用并返回检测结果；
+        指定 batch_size 时改为以至多 batch_size 张图像的列表调用，返回与之一一对应的结果列表。
+        前 warmup 张 (批) 图像先运行一次且不计时，避免推理器初始化计入耗时。
+
+        Returns:
+            统计字典: seconds / mean_ms / p50_ms / p90_ms (单张平均延迟) / images_per_second / boxes
+        """
+        chunk_size = batch_size or 1
+        chunks = [self.images[start:start + chunk_size] for start in range(0, len(self.images), chunk_size)]
+        call = detect if batch_size else (lambda chunk: [detect(chunk[0])])
+        for chunk in chunks[:warmup]:
+            call(chunk)
+        latencies = []
+        detections = []
+        for chunk in chunks:
+            start_time = time.perf_counter()
+            detections.extend(call(chunk))
+            latencies.extend([(time.perf_counter() - start_time) * 1000.0 / len(chunk)] * len(chunk))
+        self.detections[name] = detections
+        seconds = sum(latencies) / 1000.0
+        return {
+            "seconds": seconds,
+            "mean_ms": float(np.mean(latencies)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p90_ms": float(np.percentile(latencies, 90)),
+            "images_per_second": len(self.images) / seconds if seconds > 0 else float("inf"),
+            "boxes": sum(len(d) for d in detections),
+        }
+
+    def agreement(self, name, reference):
+        """以 reference 方式的检测框为参照，返回 name 方式的 precision / recall / mean_iou"""
+        matched, ious = 0, []
+        for reference_detections, candidate in zip(self.detections[reference], self.detections[name]):
+            image_matched, image_ious = match_detections(reference_detections, candidate)
+            matched += image_matched
+            ious += image_ious
+        boxes = sum(len(d) for d in self.detections[name])
+        reference_boxes = sum(len(d) for d in self.detections[reference])
+        return {
+            "precision": matched / boxes if boxes else 1.0,
+            "recall": matched / reference_boxes if reference_boxes else 1.0,
+            "mean_iou": float(np.mean(ious)) if ious else None,
+        }
+
+def benchmark_inference_batch_sizes(image_paths, batch_sizes=(1, 2, 4, 8, 16), status_callback=None):
+    """
+    测量不同推理批大小下检测阶段的吞吐 (张/秒)，用于为当前机器选择 inference_batch_size。
+    图像预先解码且不使用检测缓存，只统计模型推理耗时。
+
+    Returns:
+        {批大小: 张/秒} 字典，模型未加载或没有可用图像时返回空字典
+    """
+    detection_model = get_detection_model()
+    if not detection_model:
+        return {}
+    benchmark = DetectionBenchmark(image_paths, status_callback)
+    if not benchmark.images:
+        return {}
+
+    throughput = {}
+    for index, batch_size in enumerate(batch_sizes):
+        # 只在第一个批大小前预热一次，避免首次推理的初始化开销计入
+        stats = benchmark.run(batch_size, lambda images: detect_censor_candidates_batch(images, detection_model),
+                              warmup=1 if index == 0 else 0, batch_size=batch_size)
+        throughput[batch_size] = stats["images_per_second"]
+        benchmark.report(f"推理批大小 {batch_size}: {throughput[batch_size]:.2f} 张/秒")
+    return throughput
+
+def benchmark_tiled_detection(image_paths, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, conf_threshold=0.25,
+                              iou_threshold=0.7, status_callback=None):
+    """
+    比较超大图像上分块检测与整图检测的耗时和检测结果：
+    整图检测分别使用默认推理尺寸，以及与分块检测 (全部图块加一张整图) 推理像素总数相同的推理尺寸。
+    没有人工标注时，召回率以另一种方式的检测框为参照计算 (同类别 IOU 不低于 0.5 视为找到)。
+
+    Returns:
+        {"single": {...}, "single_equal_pixels": {...}, "tiled": {...}} 统计字典，
+        模型未加载或没有可用图像时返回空字典
+    """
+    detection_model = get_detection_model()
+    if not detection_model:
+        return {}
+    benchmark = DetectionBenchmark(image_paths, status_callback)
+    if not benchmark.images:
+        return {}
+
+    def _equal_pixels_size(image):
+        # 分块检测的推理像素总数为 (图块数 + 1) 张推理尺寸的图像，按模型步长取整
+        height, width = image.shape[:2]
+        jobs = len(get_tile_grid(width, height, tile_size, overlap)) + 1
+        return max(MODEL_STRIDE, int(round(DETECTION_INPUT_SIZE * math.sqrt(jobs) / MODEL_STRIDE)) * MODEL_STRIDE)
+
+    detectors = {
+        "single": lambda image: detect_censors(image, detection_model, conf_threshold, iou_threshold,
+                                               raise_on_error=True, tiling=False),
+        "single_equal_pixels": lambda image: detect_censors(image, detection_model, conf_threshold, iou_threshold,
+                                                            raise_on_error=True, tiling=False,
+                                                            imgsz=_equal_pixels_size(image)),
+        "tiled": lambda image: detect_censors_tiled(image, detection_model, conf_threshold, iou_threshold,
+                                                    raise_on_error=True, tile_size=tile_size, overlap=overlap),
+    }
+    modes = {}
+    for index, (mode, detect) in enumerate(detectors.items()):
+        modes[mode] = benchmark.run(mode, detect, warmup=1 if index == 0 else 0)
+    modes["single_equal_pixels"]["imgsz"] = max(_equal_pixels_size(image) for image in benchmark.images)
+
+    for mode, stats in modes.items():
+        for reference_mode in modes:
+            if reference_mode != mode:
+                stats[f"recall_vs_{reference_mode}"] = benchmark.agreement(mode, reference_mode)["recall"]
+    for mode, stats in modes.items():
+        message = f"{mode}: {stats['images_per_second']:.2f} 张/秒，检测框 {stats['boxes']} 个"
+        if "imgsz" in stats:
+            message += f"，推理尺寸 {stats['imgsz']}"
+        message += "，" + "，".join(f"相对 {key[len('recall_vs_'):]} 的召回率 {value:.3f}"
+                                   for key, value in stats.items() if key.startswith("recall_vs_"))
+        benchmark.report(message)
+    return modes
+
+def benchmark_adaptive_inference_size(image_paths, min_size=None, max_size=None, conf_threshold=0.25,
+                                      iou_threshold=0.7, status_callback=None):
+    """
+    比较模型默认推理尺寸与自适应推理尺寸 (见 utils.choose_inference_size) 的耗时和检测结果。
+    以默认尺寸的检测框为参照计算自适应尺寸的召回率，并返回每张图像实际使用的推理尺寸。
+
+    Returns:
+        {"default": {...}, "adaptive": {...}, "sizes": {图像路径: (高, 宽)}}，
+        模型未加载或没有可用图像时返回空字典
+    """
+    detection_model = get_detection_model()
+    if not detection_model:
+        return {}
+    adaptive = get_adaptive_inference_size_config() or {}
+    min_size = min_size or adaptive.get("min_size", ADAPTIVE_MIN_INPUT_SIZE)
+    max_size = max_size or adaptive.get("max_size", ADAPTIVE_MAX_INPUT_SIZE)
+    benchmark = DetectionBenchmark(image_paths, status_callback)
+    if not benchmark.images:
+        return {}
+
+    def _adaptive_size(image):
+        return choose_inference_size(image.shape[1], image.shape[0], min_size, max_size)
+
+    sizes = {path: _adaptive_size(image) for path, image in zip(benchmark.paths, benchmark.images)}
+    # 预热各自适应尺寸，避免推理器初始化计入耗时 (默认尺寸由 run 的预热覆盖)
+    for imgsz in set(sizes.values()):
+        detect_censors(np.zeros((imgsz[0], imgsz[1], 3), dtype=np.uint8), detection_model, tiling=False, imgsz=imgsz)
+
+    report = {"sizes": sizes}
+    report["default"] = benchmark.run("default", lambda image: detect_censors(
+        image, detection_model, conf_threshold, iou_threshold, raise_on_error=True, tiling=False))
+    report["adaptive"] = benchmark.run("adaptive", lambda image: detect_censors(
+        image, detection_model, conf_threshold, iou_threshold, raise_on_error=True, tiling=False,
+        imgsz=_adaptive_size(image)), warmup=0)
+    report["adaptive"]["recall_vs_default"] = benchmark.agreement("adaptive", "default")["recall"]
+
+    benchmark.report(f"默认推理尺寸: 平均 {report['default']['mean_ms']:.1f}ms，检测框 {report['default']['boxes']} 个")
+    benchmark.report(f"自适应推理尺寸 ({min_size}~{max_size}): 平均 {report['adaptive']['mean_ms']:.1f}ms，"
+                     f"检测框 {report['adaptive']['boxes']} 个，"
+                     f"相对默认尺寸的召回率 {report['adaptive']['recall_vs_default']:.3f}")
+    return report
@@ -8,8 +8,12 @@ import os
 from pathlib import Path
 import threading
 import io
+import multiprocessing
 import platform
 import re # For URL detection
+import time
+import weakref
+from collections import OrderedDict
 
 try:
     import tkinterdnd2
@@ -29,11 +33,8 @@ except ImportError:
     print("警告: 'pyperclip' 库未找到。复制文件路径到剪贴板功能将不可用。")
     print("请通过 'pip install pyperclip' 安装。")
 
-try:
-    import requests
-    REQUESTS_AVAILABLE = True
-except ImportError:
-    REQUESTS_AVAILABLE = False
+from net_ingest import REQUESTS_AVAILABLE, ImageDownloadError, fetch_first_image, image_source_from_bytes
+if not REQUESTS_AVAILABLE:
     print("警告: 'requests' 库未找到。从URL拖放图片功能将受限。")
     print("请通过 'pip install requests' 安装。")
 
@@ -48,26 +49,32 @@ except ImportError:
 
 from image_processor import (
     process_single_image,
+    render_preview,
     batch_process_images,
     get_image_object_names,
     get_default_custom_image,
     get_available_labels,
+    get_detection_candidates,
+    ImageSource,
     DEFAULT_HEAD_PATH
 )
-from utils import detect_censors, load_models
+from utils import filter_detections, get_detection_model, get_model_load_stats, RenderCancelledError
 
 # 全局变量
 current_image_path = None
+current_image_source = None
 original_pil_image = None
 processed_pil_image = None
 custom_mosaic_image_path = None
 
 PREVIEW_WIDTH = 900
 PREVIEW_HEIGHT = 1250
-
-classification_model, detection_model = load_models()
-if not detection_model:
-    print("警告：检测模型加载失败，应用功能将受限。")
+# 预览防抖窗口：窗口内连续到达的预览请求只渲染最后一次；
+# 持续拖动滑块时最多等待 PREVIEW_MAX_DELAY_SECONDS 就渲染一次最新参数
+PREVIEW_DEBOUNCE_SECONDS = 0.08
+PREVIEW_MAX_DELAY_SECONDS = 0.3
+# 已缩放到预览区域大小的图像缓存条数
+DISPLAY_CACHE_SIZE = 8
 
 base_window_class = tkinterdnd2.Tk if TKINTERDND2_AVAILABLE else tb.Window
 
@@ -95,9 +102,25 @@ class ImageMosaicApp(base_window_class):
              messagebox.showwarning("缺少库", "TkinterDnD2 未安装，拖放功能不可用。\n请运行: pip install tkinterdnd2", parent=self)
 
 
+        # 与阈值无关的原始候选框，阈值变化时只在 NumPy 中重新筛选，不重新推理
         self.cached_detection_results = None
-        self.last_detection_conf = None
-        self.last_detection_iou = None
+        self._detection_lock = threading.Lock()
+        # 预览调度：只有一个后台预览线程，按防抖窗口合并请求，并放弃已过期的渲染
+        self._preview_condition = threading.Condition()
+        self._preview_request = None
+        self._preview_requested_at = 0.0
+        self._preview_first_requested_at = 0.0
+        self._preview_generation = 0
+        self.preview_stats = {"rendered": 0, "skipped": 0}
+        threading.Thread(target=self._preview_worker, daemon=True).start()
+        # 显示管线：缩放在后台线程完成，Tk 线程只负责创建 PhotoImage
+        self._display_condition = threading.Condition()
+        self._display_requests = {}
+        self._display_generation = {}
+        self._display_cache = OrderedDict()
+        self._frame_sizes = {}
+        self._label_images = {}
+        threading.Thread(target=self._display_worker, daemon=True).start()
         self.input_path = tk.StringVar()
         self.output_folder = tk.StringVar(value=str(Path.home() / "图像打码输出"))
         self.mosaic_type_var = tk.StringVar(value="常规模糊")
@@ -148,6 +171,21 @@ class ImageMosaicApp(base_window_class):
 
         self.after_idle(self.update_color_preview)
         self.after_idle(self._initial_check_maximized_state)
+        # 窗口显示后在后台预热共享检测模型，避免阻塞启动
+        threading.Thread(target=self._warm_up_detection_model, daemon=True).start()
+
+    def _warm_up_detection_model(self):
+        """在后台线程中加载共享检测模型，并在状态栏显示加载耗时与内存占用"""
+        if not get_detection_model():
+            print("警告：检测模型加载失败，应用功能将受限。")
+            self.after(0, lambda: self.status_label.config(text="警告：检测模型加载失败，应用功能将受限。"))
+            return
+        stats = get_model_load_stats()
+        status_text = f"模型已加载 ({stats.get('load_seconds', 0):.2f}s"
+        if stats.get("rss_after_mb") is not None:
+            status_text += f", 内存 {stats['rss_after_mb']:.0f} MB"
+        status_text += ")"
+        self.after(0, lambda: self.status_label.config(text=status_text))
 
     def _get_current_actual_maximized_state(self):
         """Helper to get current maximized state, handling -zoomed issues."""
@@ -391,6 +429,8 @@ class ImageMosaicApp(base_window_class):
         self.original_image_label.pack(fill=BOTH, expand=YES)
         self.processed_image_label = tb.Label(self.processed_frame, text="效果预览区域", relief="solid", anchor=CENTER)
         self.processed_image_label.pack(fill=BOTH, expand=YES)
+        for frame in (self.original_frame, self.processed_frame):
+            frame.bind("<Configure>", self._on_preview_frame_configure, add="+")
         status_bar_frame = tb.Frame(self, padding=(5,2))
         status_bar_frame.pack(side=BOTTOM, fill=X)
         self.status_label = tb.Label(status_bar_frame, text="准备就绪", anchor=W)
@@ -559,19 +599,21 @@ class ImageMosaicApp(base_window_class):
         if BS4_AVAILABLE and dropped_data.strip().lower().startswith("<img") and "src=" in dropped_data.lower():
             try:
                 soup = BeautifulSoup(dropped_data, 'html.parser')
-                img_tag = soup.find('img')
-                if img_tag and img_tag.get('src'):
-                    src = img_tag.get('src')
+                img_srcs = [img_tag.get('src') for img_tag in soup.find_all('img') if img_tag.get('src')]
+                if img_srcs:
+                    src = img_srcs[0]
+                    # 拖放的 HTML 可能包含多张图片，所有网络链接并发下载，使用第一张成功下载的图片
+                    url_srcs = [img_src for img_src in img_srcs if self._is_url(img_src)]
                     if src.startswith('data:image'):
                         self.drop_target_label_mini.config(text="处理HTML内嵌图片...", bootstyle="info")
                         self.update_idletasks()
                         threading.Thread(target=self._process_dropped_base64_image, args=(src,), daemon=True).start()
                         return
-                    elif self._is_url(src):
+                    elif url_srcs:
                         if REQUESTS_AVAILABLE:
                             self.drop_target_label_mini.config(text=f"下载HTML图片链接...", bootstyle="info")
                             self.update_idletasks()
-                            threading.Thread(target=self._process_dropped_url_image, args=(src,), daemon=True).start()
+                            threading.Thread(target=self._process_dropped_url_image, args=(url_srcs,), daemon=True).start()
                             return
                         else:
                             messagebox.showwarning("缺少库", "处理网络图片链接需要 'requests' 库。\n请运行: pip install requests", parent=self)
@@ -599,99 +641,48 @@ class ImageMosaicApp(base_window_class):
 
 
     def _process_dropped_base64_image(self, base64_src):
+        """拖放的 data URI 图片在内存中解码 -> 检测 -> 打码 -> 复制到剪贴板，不写临时文件"""
         try:
             import base64
+            stage_start = time.perf_counter()
             match = re.match(r'data:(image/(?P<format>\w+));base64,(?P<data>.+)', base64_src, re.DOTALL)
             if not match:
                 raise ValueError("无效的Base64数据URI格式")
 
             img_format = match.group('format').lower()
-            encoded_data = match.group('data')
-
             if img_format not in ['png', 'jpeg', 'jpg', 'gif', 'bmp', 'webp']:
-                print(f"不支持的Base64图片格式: {img_format}, 将尝试保存为png")
+                print(f"不支持的Base64图片格式: {img_format}, 将尝试按png处理")
                 img_format = 'png'
 
-            image_data = base64.b64decode(encoded_data)
-            image_pil = Image.open(io.BytesIO(image_data))
-
-            temp_dir = Path(self.output_folder.get()) / "temp_dropped"
-            temp_dir.mkdir(parents=True, exist_ok=True)
-            temp_image_path = temp_dir / f"dropped_base64_image.{img_format}"
-
-            if image_pil.mode == 'P' and img_format in ['jpeg', 'jpg']:
-                image_pil = image_pil.convert('RGB')
-            elif image_pil.mode == 'RGBA' and img_format in ['jpeg', 'jpg', 'bmp']:
-                 image_pil = image_pil.convert('RGB')
-
-            image_pil.save(temp_image_path)
-            self.after(0, lambda: self.drop_target_label_mini.config(text=f"处理内嵌图片...", bootstyle="info") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
-            self._process_dropped_image_for_mini_mode(str(temp_image_path))
+            image_data = base64.b64decode(match.group('data'))
+            image_source = image_source_from_bytes(image_data, f"dropped_base64_image.{img_format}")
+            timings = {"base64": time.perf_counter() - stage_start}
+            self._process_dropped_image_for_mini_mode(image_source, timings)
         except Exception as e:
             print(f"处理Base64图片错误: {e}")
             messagebox.showerror("处理错误", f"处理内嵌图片时发生错误: {e}", parent=self)
             self.after(0, lambda: self.drop_target_label_mini.config(text="内嵌图片处理失败!", bootstyle="danger") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
 
-    def _process_dropped_url_image(self, image_url):
+    def _process_dropped_url_image(self, image_urls):
+        """下载拖放的图片链接 (单个链接或候选链接列表)，在内存中解码后直接打码，不写临时文件"""
         if not REQUESTS_AVAILABLE:
             messagebox.showerror("功能缺失", "下载网络图片需要 'requests' 库。", parent=self)
             self.after(0, lambda: self.drop_target_label_mini.config(text="无法下载 (缺requests)", bootstyle="danger") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
             return
+        if isinstance(image_urls, str):
+            image_urls = [image_urls]
 
         try:
             self.after(0, lambda: self.drop_target_label_mini.config(text=f"下载中...", bootstyle="info") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-            response = requests.get(image_url, stream=True, timeout=10, headers=headers)
-            response.raise_for_status()
-
-            content_type = response.headers.get('content-type')
-            if not content_type or not content_type.startswith('image/'):
-                messagebox.showerror("下载错误", f"链接内容似乎不是图片: {content_type}", parent=self)
-                self.after(0, lambda: self.drop_target_label_mini.config(text="非图片链接!", bootstyle="danger") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
-                return
-
-            image_data = response.content
-            image_pil = Image.open(io.BytesIO(image_data))
-
-            img_format = content_type.split('/')[-1].lower().split(';')[0]
-            if img_format == 'jpeg': img_format = 'jpg'
-            valid_formats = ['png', 'jpg', 'gif', 'bmp', 'webp']
-            if img_format not in valid_formats:
-                url_path = Path(image_url)
-                extracted_format = url_path.suffix[1:].lower() if url_path.suffix else ''
-                if extracted_format in valid_formats:
-                    img_format = extracted_format
-                else:
-                    img_format = 'png'
-
-            temp_dir = Path(self.output_folder.get()) / "temp_downloaded"
-            temp_dir.mkdir(parents=True, exist_ok=True)
-
-            base_filename = Path(image_url).name.split('?')[0]
-            if not base_filename or len(base_filename) > 100 or '.' not in base_filename :
-                base_filename = f"downloaded_image"
-
-            temp_image_filename = f"{Path(base_filename).stem}.{img_format}"
-            temp_image_filename = "".join([c for c in temp_image_filename if c.isalnum() or c in ('.', '_')]).rstrip()
-            if not Path(temp_image_filename).stem:
-                 temp_image_filename = f"downloaded_image.{img_format}"
-
-
-            temp_image_path = temp_dir / temp_image_filename
-
-            if image_pil.mode == 'P' and img_format in ['jpeg', 'jpg']:
-                image_pil = image_pil.convert('RGB')
-            elif image_pil.mode == 'RGBA' and img_format in ['jpeg', 'jpg', 'bmp']:
-                 image_pil = image_pil.convert('RGB')
-
-            image_pil.save(temp_image_path)
-
+            download_start = time.perf_counter()
+            image_source = fetch_first_image(image_urls)
+            timings = {"download": time.perf_counter() - download_start}
             self.after(0, lambda: self.drop_target_label_mini.config(text=f"处理下载图片...", bootstyle="info") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
-            self._process_dropped_image_for_mini_mode(str(temp_image_path))
+            self._process_dropped_image_for_mini_mode(image_source, timings)
 
-        except requests.exceptions.RequestException as e:
-            print(f"下载图片错误 ({image_url}): {e}")
-            messagebox.showerror("下载失败", f"无法下载图片链接: {e}", parent=self)
+        except ImageDownloadError as e:
+            print(f"下载图片错误 ({', '.join(image_urls)}): {e}")
+            messagebox.showerror("下载失败", str(e), parent=self)
             self.after(0, lambda: self.drop_target_label_mini.config(text="下载失败!", bootstyle="danger") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
         except Exception as e:
             print(f"处理下载的图片时发生错误: {e}")
@@ -705,7 +696,7 @@ class ImageMosaicApp(base_window_class):
         try:
             if platform.system() == "Windows":
                 output = io.BytesIO()
-                pil_image.convert("RGB").save(output, "BMP")
+                (pil_image if pil_image.mode == "RGB" else pil_image.convert("RGB")).save(output, "BMP")
                 data = output.getvalue()[14:]
                 output.close()
                 import win32clipboard
@@ -720,8 +711,14 @@ class ImageMosaicApp(base_window_class):
             print(f"复制图片到剪贴板时发生错误: {e}")
         return False
 
-    def _process_dropped_image_for_mini_mode(self, image_path_str):
-        image_path = Path(image_path_str)
+    def _process_dropped_image_for_mini_mode(self, image_input, timings=None):
+        """
+        image_input 为图片路径或内存中的 ImageSource (例如下载或 data URI 拖放的图片)。
+        timings 为此前阶段 (下载 / base64 解码) 已记录的耗时，处理结束后连同解码、检测、打码、
+        剪贴板各阶段耗时一起输出，便于发现迷你模式延迟的回退。
+        """
+        timings = dict(timings or {})
+        image_path = Path(image_input.name if isinstance(image_input, ImageSource) else image_input)
         mosaic_type = self._mini_mosaic_type_var.get()
         selected_regions = get_available_labels()
         default_conf = self.conf_threshold_var.get()
@@ -734,9 +731,9 @@ class ImageMosaicApp(base_window_class):
         try:
             self.after(0, lambda: self.drop_target_label_mini.config(text="正在打码...", bootstyle="info") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
             _, processed_img_pil, error_msg = process_single_image(
-                str(image_path), mosaic_type, selected_regions,
+                image_input if isinstance(image_input, ImageSource) else str(image_path), mosaic_type, selected_regions,
                 custom_image_path=custom_img_actual_path,
-                conf_threshold=default_conf, iou_threshold=default_iou,
+                conf_threshold=default_conf, iou_threshold=default_iou, timings=timings,
             )
 
             if error_msg:
@@ -745,7 +742,10 @@ class ImageMosaicApp(base_window_class):
                 return
 
             if processed_img_pil:
+                clipboard_start = time.perf_counter()
                 copied_to_clipboard = self._copy_image_to_clipboard(processed_img_pil)
+                timings["clipboard"] = time.perf_counter() - clipboard_start
+                self._report_mini_mode_timings(image_path.name, timings)
                 if copied_to_clipboard:
                     self._show_timed_message("成功", "已打码并复制到剪贴板!", success=True)
                     self.after(0, lambda: self.drop_target_label_mini.config(text="已复制!", bootstyle="success") if self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
@@ -779,6 +779,14 @@ class ImageMosaicApp(base_window_class):
         finally:
              self.after(3000, lambda: self.drop_target_label_mini.config(text="拖放图片到此处", bootstyle="secondary") if self.in_mini_mode and self.drop_target_label_mini and self.drop_target_label_mini.winfo_exists() else None)
 
+    def _report_mini_mode_timings(self, image_name, timings):
+        """输出迷你模式一次拖放处理的各阶段耗时 (毫秒)"""
+        stage_names = {"download": "下载", "base64": "Base64解码", "decode": "图像解码", "detect": "检测",
+                       "render": "打码", "clipboard": "剪贴板"}
+        parts = [f"{stage_names.get(stage, stage)} {seconds * 1000:.1f}ms" for stage, seconds in timings.items()]
+        total_ms = sum(timings.values()) * 1000
+        print(f"迷你模式处理耗时 ({image_name}): " + "，".join(parts) + f"，合计 {total_ms:.1f}ms")
+
     def update_conf_label(self, value):
         self.conf_value_label.config(text=f"{float(value):.2f}")
         self.on_param_change()
@@ -878,18 +886,20 @@ class ImageMosaicApp(base_window_class):
                 available_labels = get_available_labels()
                 self.update_region_selection_ui(available_labels)
     def load_and_display_original_image(self, image_path):
-        global original_pil_image
+        global original_pil_image, current_image_source
         try:
-            original_pil_image = Image.open(image_path)
+            # 只解码一次，之后的检测、预览与处理都复用该图像源
+            self._invalidate_previews()
+            current_image_source = ImageSource(image_path)
+            original_pil_image = current_image_source.to_pil()
             self.display_image_on_label(original_pil_image, self.original_image_label)
             self.display_image_on_label(None, self.processed_image_label, "效果预览区域")
             self.status_label.config(text=f"已加载: {Path(image_path).name}")
             self.cached_detection_results = None
-            self.last_detection_conf = None
-            self.last_detection_iou = None
         except Exception as e:
             messagebox.showerror("加载失败", f"无法加载图片: {e}", parent=self)
             original_pil_image = None
+            current_image_source = None
             self.clear_previews()
     def update_available_regions(self):
         if current_image_path and Path(current_image_path).is_file():
@@ -898,11 +908,16 @@ class ImageMosaicApp(base_window_class):
             def _analyze():
                 conf = self.conf_threshold_var.get()
                 iou = self.iou_threshold_var.get()
-                img_path_str = str(current_image_path)
-                names, results, err = get_image_object_names(img_path_str, conf, iou)
-                self.last_detection_conf = conf
-                self.last_detection_iou = iou
-                self.cached_detection_results = results
+                image_source = current_image_source
+                candidates, err = get_detection_candidates(image_source)
+                names = []
+                if not err:
+                    with self._detection_lock:
+                        # 分析期间已切换到其他图片时不写入缓存
+                        if image_source is current_image_source:
+                            self.cached_detection_results = candidates
+                    names, _, err = get_image_object_names(image_source, conf, iou,
+                                                           detection_candidates=candidates)
                 final_names = names
                 status_text = "目标分析完成。请选择打码区域。"
                 if err:
@@ -980,27 +995,7 @@ class ImageMosaicApp(base_window_class):
         selected_regions = self.get_selected_regions()
         def _process():
             global processed_pil_image
-            img_path_str = str(current_image_path)
-            custom_path = custom_mosaic_image_path if params["mosaic_type"] == "自定义图像" and custom_mosaic_image_path and os.path.exists(custom_mosaic_image_path) else DEFAULT_HEAD_PATH
-            current_conf = params["conf_threshold"]
-            current_iou = params["iou_threshold"]
-            cached_results = self.cached_detection_results
-            if self.last_detection_conf != current_conf or self.last_detection_iou != current_iou:
-                cached_results = None
-                self.after(0, lambda: self.status_label.config(text="检测参数已变更，正在重新检测..."))
-            _, proc_img, error = process_single_image(
-                img_path_str, params["mosaic_type"], selected_regions, custom_path,
-                params["line_direction"], current_conf, current_iou, params["scale"],
-                params["alpha"], params["blur_kernel_size"], params["line_thickness"],
-                params["line_spacing"], params["mist_color"], params["light_intensity"],
-                params["light_feather"], params["light_color"], cached_detection_results=cached_results)
-            if cached_results is None:
-                if detection_model:
-                    self.cached_detection_results = detect_censors(img_path_str, detection_model, current_conf, current_iou)
-                else:
-                    self.cached_detection_results = []
-                self.last_detection_conf = current_conf
-                self.last_detection_iou = current_iou
+            proc_img, error = self._render_full_resolution(params, selected_regions)
 
             self.after(0, lambda: self.progress_bar.stop())
             if error:
@@ -1014,11 +1009,76 @@ class ImageMosaicApp(base_window_class):
                 self.after(0, lambda: self.status_label.config(text="图片处理完成。预览已更新。"))
                 self.after(0, self.prompt_save_processed_image)
         threading.Thread(target=_process, daemon=True).start()
+    def _custom_image_path_for(self, params):
+        return custom_mosaic_image_path if params["mosaic_type"] == "自定义图像" and custom_mosaic_image_path and os.path.exists(custom_mosaic_image_path) else DEFAULT_HEAD_PATH
+    def _render_full_resolution(self, params, selected_regions, image_source=None):
+        """以全分辨率渲染当前图片 (或指定的 image_source)，返回 (处理后的PIL图像, 错误信息)"""
+        if image_source is None:
+            image_source = current_image_source
+        current_conf = params["conf_threshold"]
+        current_iou = params["iou_threshold"]
+        _, proc_img, error = process_single_image(
+            image_source, params["mosaic_type"], selected_regions, self._custom_image_path_for(params),
+            params["line_direction"], current_conf, current_iou, params["scale"],
+            params["alpha"], params["blur_kernel_size"], params["line_thickness"],
+            params["line_spacing"], params["mist_color"], params["light_intensity"],
+            params["light_feather"], params["light_color"],
+            cached_detection_results=self._filtered_detection_results(image_source, current_conf, current_iou))
+        return proc_img, error
+    def _preview_target_size(self):
+        """预览代理图的目标尺寸，与效果预览区域的大小一致"""
+        frame_width = self.processed_frame.winfo_width()
+        frame_height = self.processed_frame.winfo_height()
+        if frame_width <= 1 or frame_height <= 1:
+            return PREVIEW_WIDTH // 2 - 20, PREVIEW_HEIGHT - 50
+        return frame_width, frame_height
+    def _filtered_detection_results(self, image_source, conf_threshold, iou_threshold):
+        """按当前阈值筛选缓存的原始候选框，首次调用时才对图像检测一次"""
+        with self._detection_lock:
+            candidates = self.cached_detection_results
+            if candidates is None:
+                self.after(0, lambda: self.status_label.config(text="正在检测图像..."))
+                candidates, err = get_detection_candidates(image_source)
+                if err:
+                    # 返回 None 交由 process_single_image 自行检测并报告错误
+                    return None
+                # 检测期间已切换到其他图片时不写入缓存
+                if image_source is current_image_source:
+                    self.cached_detection_results = candidates
+        return filter_detections(candidates, conf_threshold, iou_threshold)
     def prompt_save_processed_image(self):
         if processed_pil_image:
             if messagebox.askyesno("保存图片", "处理完成，是否保存打码后的图片？", parent=self):
                 self.save_processed_image()
     def save_processed_image(self):
+        if not processed_pil_image and current_image_source is not None:
+            # 预览只在代理图上渲染，保存前按当前参数补做一次全分辨率渲染；
+            # 渲染 (可能需等待检测锁) 在后台线程进行，完成后回到 Tk 线程再打开保存对话框
+            self.status_label.config(text="正在以全分辨率处理图片...")
+            self.progress_bar.start()
+            params = self.get_current_parameters()
+            selected_regions = self.get_selected_regions()
+            image_source = current_image_source
+            def _render():
+                proc_img, error = self._render_full_resolution(params, selected_regions, image_source)
+                self.after(0, lambda: self._on_full_resolution_rendered(image_source, proc_img, error))
+            threading.Thread(target=_render, daemon=True).start()
+            return
+        self._ask_save_processed_image()
+    def _on_full_resolution_rendered(self, image_source, proc_img, error):
+        """全分辨率渲染完成后在 Tk 线程中调用：更新结果并打开保存对话框"""
+        global processed_pil_image
+        self.progress_bar.stop()
+        if image_source is not current_image_source:
+            # 渲染期间已切换到其他图片，丢弃结果
+            return
+        if error:
+            messagebox.showerror("处理失败", error, parent=self)
+            self.status_label.config(text=f"处理失败: {error}")
+            return
+        processed_pil_image = proc_img
+        self._ask_save_processed_image()
+    def _ask_save_processed_image(self):
         if not processed_pil_image:
             messagebox.showwarning("无法保存", "没有已处理的图片可供保存。", parent=self)
             return
@@ -1048,44 +1108,81 @@ class ImageMosaicApp(base_window_class):
             except Exception as e:
                 messagebox.showerror("保存失败", f"保存图片时出错: {e}", parent=self)
     def update_preview(self):
+        """提交一次预览请求 (在 Tk 线程中读取参数快照)，由后台预览线程合并后渲染"""
         if self.in_mini_mode: return
         if not current_image_path or not original_pil_image: return
-        selected_regions = self.get_selected_regions()
         params = self.get_current_parameters()
-        self.status_label.config(text="正在更新预览...")
-        self.update_idletasks()
-        img_path_str = str(current_image_path)
-        custom_path = custom_mosaic_image_path if params["mosaic_type"] == "自定义图像" and custom_mosaic_image_path and os.path.exists(custom_mosaic_image_path) else DEFAULT_HEAD_PATH
-        def _update_preview_thread():
-            global processed_pil_image
-            current_conf = params["conf_threshold"]
-            current_iou = params["iou_threshold"]
-            cached_results = self.cached_detection_results
-            if self.last_detection_conf != current_conf or self.last_detection_iou != current_iou:
-                cached_results = None
-                self.after(0, lambda: self.status_label.config(text="检测参数已变更，正在重新检测..."))
-            _, temp_processed_pil, error = process_single_image(
-                img_path_str, params["mosaic_type"], selected_regions, custom_path,
-                params["line_direction"], current_conf, current_iou, params["scale"],
-                params["alpha"], params["blur_kernel_size"], params["line_thickness"],
-                params["line_spacing"], params["mist_color"], params["light_intensity"],
-                params["light_feather"], params["light_color"], cached_detection_results=cached_results)
-            if cached_results is None:
-                if detection_model:
-                    self.cached_detection_results = detect_censors(img_path_str, detection_model, current_conf, current_iou)
-                else:
-                    self.cached_detection_results = []
-                self.last_detection_conf = current_conf
-                self.last_detection_iou = current_iou
-            if error:
-                self.after(0, lambda: self.status_label.config(text=f"预览更新错误: {error[:100]}..."))
-                self.after(0, lambda: self.display_image_on_label(original_pil_image, self.processed_image_label, "预览生成错误"))
-                processed_pil_image = None
+        request = {
+            "image_source": current_image_source,
+            "params": params,
+            "selected_regions": self.get_selected_regions(),
+            "custom_path": self._custom_image_path_for(params),
+            "target_size": self._preview_target_size(),
+        }
+        with self._preview_condition:
+            if self._preview_request is not None:
+                # 尚未开始渲染的旧请求直接被新请求取代
+                self.preview_stats["skipped"] += 1
             else:
-                processed_pil_image = temp_processed_pil
-                self.after(0, lambda: self.display_image_on_label(processed_pil_image, self.processed_image_label))
-                self.after(0, lambda: self.status_label.config(text="预览已更新。"))
-        threading.Thread(target=_update_preview_thread, daemon=True).start()
+                self._preview_first_requested_at = time.monotonic()
+            self._preview_generation += 1
+            request["generation"] = self._preview_generation
+            self._preview_request = request
+            self._preview_requested_at = time.monotonic()
+            self._preview_condition.notify()
+        self.status_label.config(text="正在更新预览...")
+    def _invalidate_previews(self):
+        """丢弃排队中的预览请求，并使正在进行的预览渲染过期"""
+        with self._preview_condition:
+            self._preview_generation += 1
+            self._preview_request = None
+    def _preview_worker(self):
+        """唯一的预览线程：等待请求，防抖窗口内持续有新请求时继续等待 (不超过最大延迟)，只渲染最新的参数快照"""
+        while True:
+            with self._preview_condition:
+                while self._preview_request is None:
+                    self._preview_condition.wait()
+                while True:
+                    remaining = min(self._preview_requested_at + PREVIEW_DEBOUNCE_SECONDS,
+                                    self._preview_first_requested_at + PREVIEW_MAX_DELAY_SECONDS) - time.monotonic()
+                    if remaining <= 0 or self._preview_request is None:
+                        break
+                    self._preview_condition.wait(remaining)
+                request = self._preview_request
+                self._preview_request = None
+            if request is not None:
+                self._render_preview_request(request)
+    def _render_preview_request(self, request):
+        global processed_pil_image
+        generation = request["generation"]
+        is_stale = lambda: generation != self._preview_generation
+        params = request["params"]
+        image_source = request["image_source"]
+        max_width, max_height = request["target_size"]
+        render_params = {key: value for key, value in params.items() if key != "mosaic_type"}
+        try:
+            detection_results = self._filtered_detection_results(image_source, params["conf_threshold"], params["iou_threshold"])
+            # 预览只在与预览区域等大的代理图上渲染，全分辨率结果留到处理/保存时生成
+            _, preview_pil, error = render_preview(
+                image_source, max_width, max_height, params["mosaic_type"], request["selected_regions"],
+                cached_detection_results=detection_results, custom_image_path=request["custom_path"],
+                cancel_check=is_stale, **render_params)
+        except RenderCancelledError:
+            preview_pil, error = None, None
+        with self._preview_condition:
+            if is_stale():
+                self.preview_stats["skipped"] += 1
+                return
+            self.preview_stats["rendered"] += 1
+            skipped = self.preview_stats["skipped"]
+        processed_pil_image = None
+        if error:
+            self.after(0, lambda: self.status_label.config(text=f"预览更新错误: {error[:100]}..."))
+            self.after(0, lambda: self.display_image_on_label(original_pil_image, self.processed_image_label, "预览生成错误"))
+        else:
+            status_text = "预览已更新。" + (f" (已跳过 {skipped} 次过期渲染)" if skipped else "")
+            self.after(0, lambda: self.display_image_on_label(preview_pil, self.processed_image_label))
+            self.after(0, lambda: self.status_label.config(text=status_text))
     def start_batch_process(self):
         input_val_str = self.input_path.get()
         if not input_val_str:
@@ -1130,51 +1227,111 @@ class ImageMosaicApp(base_window_class):
             self.after(0, lambda: self.status_label.config(text="准备就绪"))
         threading.Thread(target=_batch_thread, daemon=True).start()
     def display_image_on_label(self, pil_image, label_widget, placeholder_text="图像区域"):
+        """在 Tk 线程中调用：提交显示请求，缩放交由后台显示线程完成"""
         if not label_widget or not label_widget.winfo_exists() or not label_widget.master.winfo_exists():
             return
         try:
-            if pil_image:
-                label_widget.master.update_idletasks()
-                frame_width = label_widget.master.winfo_width()
-                frame_height = label_widget.master.winfo_height()
-
-                if frame_width <= 1 or frame_height <= 1:
-                    label_widget.after(100, lambda: self.display_image_on_label(pil_image, label_widget, placeholder_text))
-                    return
-
-                img_copy = pil_image.copy()
-                original_width, original_height = img_copy.size
-                if original_width == 0 or original_height == 0:
-                    label_widget.image = None
-                    label_widget.config(image="", text=placeholder_text + "\n(图像尺寸为0)")
-                    return
-
-                ratio_w = frame_width / original_width
-                ratio_h = frame_height / original_height
-                scale_ratio = min(ratio_w, ratio_h, 1.0)
-
-                new_width = int(original_width * scale_ratio)
-                new_height = int(original_height * scale_ratio)
-
-                if new_width > 0 and new_height > 0:
-                    img_copy = img_copy.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    photo = ImageTk.PhotoImage(img_copy)
-                    label_widget.image = photo
-                    label_widget.config(image=photo, text="")
-                else:
-                    label_widget.image = None
-                    label_widget.config(image="", text=placeholder_text + "\n(缩放后尺寸无效)")
-            else:
+            self._label_images[label_widget] = (pil_image, placeholder_text)
+            with self._display_condition:
+                generation = self._display_generation.get(label_widget, 0) + 1
+                self._display_generation[label_widget] = generation
+                self._display_requests.pop(label_widget, None)
+            if not pil_image:
                 label_widget.image = None
                 label_widget.config(image="", text=placeholder_text)
+                return
+
+            frame_size = self._frame_sizes.get(label_widget.master)
+            if not frame_size:
+                frame_size = (label_widget.master.winfo_width(), label_widget.master.winfo_height())
+            if frame_size[0] <= 1 or frame_size[1] <= 1:
+                label_widget.after(100, lambda: self.display_image_on_label(pil_image, label_widget, placeholder_text))
+                return
+
+            with self._display_condition:
+                # 同一标签只保留最新的请求
+                self._display_requests[label_widget] = (generation, pil_image, frame_size, placeholder_text)
+                self._display_condition.notify()
         except Exception as e:
             print(f"显示图像错误: {e}")
             if label_widget and label_widget.winfo_exists():
                 label_widget.image = None
                 label_widget.config(image="", text=f"{placeholder_text}\n(显示错误: {str(e)[:30]})")
+    def _on_preview_frame_configure(self, event):
+        """记录预览区域尺寸，尺寸变化时按新尺寸重新显示其中的图像"""
+        frame_size = (event.width, event.height)
+        if self._frame_sizes.get(event.widget) == frame_size:
+            return
+        self._frame_sizes[event.widget] = frame_size
+        for label_widget, (pil_image, placeholder_text) in list(self._label_images.items()):
+            if pil_image is not None and label_widget.master is event.widget:
+                self.display_image_on_label(pil_image, label_widget, placeholder_text)
+    def _display_worker(self):
+        """后台显示线程：把图像缩放到预览区域大小，再交给 Tk 线程创建 PhotoImage"""
+        while True:
+            with self._display_condition:
+                while not self._display_requests:
+                    self._display_condition.wait()
+                label_widget, request = self._display_requests.popitem()
+            generation, pil_image, (frame_width, frame_height), placeholder_text = request
+            try:
+                fitted_image, error = self._fitted_image(pil_image, frame_width, frame_height), None
+            except Exception as e:
+                fitted_image, error = None, e
+            # 循环变量会在下一轮被覆盖，因此以参数形式传给 Tk 线程
+            self.after(0, self._show_fitted_image, label_widget, generation, fitted_image, placeholder_text, error)
+    def _fitted_image(self, pil_image, frame_width, frame_height):
+        """
+        返回按比例缩放到预览区域内的图像 (不放大)，尺寸无效时返回 None。
+        先用 reduce 做整数倍缩小再重采样，结果按 (图像 id, 区域尺寸) 缓存，并用弱引用确认图像未被替换。
+        """
+        key = (id(pil_image), frame_width, frame_height)
+        with self._display_condition:
+            cached = self._display_cache.get(key)
+            if cached is not None and cached[0]() is pil_image:
+                self._display_cache.move_to_end(key)
+                return cached[1]
+
+        original_width, original_height = pil_image.size
+        if original_width == 0 or original_height == 0:
+            return None
+        scale_ratio = min(frame_width / original_width, frame_height / original_height, 1.0)
+        new_width = int(original_width * scale_ratio)
+        new_height = int(original_height * scale_ratio)
+        if new_width <= 0 or new_height <= 0:
+            return None
+        if (new_width, new_height) == (original_width, original_height):
+            fitted_image = pil_image
+        else:
+            fitted_image = pil_image.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        with self._display_condition:
+            self._display_cache[key] = (weakref.ref(pil_image), fitted_image)
+            while len(self._display_cache) > DISPLAY_CACHE_SIZE:
+                self._display_cache.popitem(last=False)
+        return fitted_image
+    def _show_fitted_image(self, label_widget, generation, fitted_image, placeholder_text, error):
+        """在 Tk 线程中创建 PhotoImage 并显示，已被更新的请求取代时直接丢弃"""
+        if self._display_generation.get(label_widget) != generation:
+            return
+        if not label_widget.winfo_exists():
+            return
+        if error is not None:
+            print(f"显示图像错误: {error}")
+            label_widget.image = None
+            label_widget.config(image="", text=f"{placeholder_text}\n(显示错误: {str(error)[:30]})")
+        elif fitted_image is None:
+            label_widget.image = None
+            label_widget.config(image="", text=placeholder_text + "\n(图像尺寸无效)")
+        else:
+            photo = ImageTk.PhotoImage(fitted_image)
+            label_widget.image = photo
+            label_widget.config(image=photo, text="")
 
     def clear_previews(self):
-        global original_pil_image, processed_pil_image
+        global original_pil_image, processed_pil_image, current_image_source
+        self._invalidate_previews()
+        current_image_source = None
         original_pil_image = None
         processed_pil_image = None
         if hasattr(self, 'original_image_label') and self.original_image_label.winfo_exists():
@@ -1185,6 +1342,8 @@ class ImageMosaicApp(base_window_class):
             self.process_single_button.config(state=DISABLED)
 
 if __name__ == "__main__":
+    # 打包为可执行文件后，多进程批处理的工作进程需要此调用才能正确启动
+    multiprocessing.freeze_support()
     Path("assets").mkdir(exist_ok=True)
     Path("models").mkdir(exist_ok=True)
     if not Path(DEFAULT_HEAD_PATH).exists():
@@ -0,0 +1,159 @@
+# net_ingest.py
+"""
+网络图片获取：迷你模式拖放的图片链接在内存中下载并解码，直接送入处理流程，不写临时文件。
+下载复用带连接池的 keep-alive 会话，响应体流式读取并限制大小，
+HTML 中提取出的多个 <img> 链接可以并发下载。
+"""
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+
+from PIL import Image
+
+from image_processor import ImageSource
+
+# 单张图片的下载大小上限
+MAX_DOWNLOAD_BYTES = 50 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# (连接超时, 读取超时) 秒
+DOWNLOAD_TIMEOUT = (5, 10)
+# 并发下载的最大线程数 (同时也是每个主机的连接池大小)
+MAX_CONCURRENT_DOWNLOADS = 4
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8',
+}
+
+class ImageDownloadError(Exception):
+    """下载失败、内容不是图片、超过大小上限或无法解码"""
+
+# 进程内共享的会话与下载线程池 (首次使用时创建)
+_session = None
+_executor = None
+_ingest_lock = threading.Lock()
+
+def get_session():
+    """返回共享的 requests 会话，同一主机的后续请求复用已建立的 keep-alive 连接"""
+    global _session
+    if not REQUESTS_AVAILABLE:
+        raise ImageDownloadError("下载网络图片需要 'requests' 库。")
+    if _session is None:
+        with _ingest_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=MAX_CONCURRENT_DOWNLOADS, pool_maxsize=MAX_CONCURRENT_DOWNLOADS)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(DEFAULT_HEADERS)
+                _session = session
+    return _session
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _ingest_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="net-ingest")
+    return _executor
+
+def _name_from_url(url, content_type):
+    """根据链接与 Content-Type 生成用于显示和回退保存的文件名"""
+    base_name = os.path.basename(unquote(urlparse(url).path))
+    stem, suffix = os.path.splitext(base_name)
+    stem = "".join(c for c in stem if c.isalnum() or c in ('.', '_', '-'))[:100] or "downloaded_image"
+    if not suffix or len(suffix) > 6:
+        image_format = content_type.split('/')[-1].split(';')[0].strip().lower() if content_type else ""
+        suffix = {"jpeg": ".jpg", "svg+xml": ".svg"}.get(image_format, f".{image_format}" if image_format else ".png")
+    return stem + suffix.lower()
+
+def fetch_image(url, max_bytes=MAX_DOWNLOAD_BYTES, timeout=DOWNLOAD_TIMEOUT):
+    """
+    下载单张图片并返回内存中的 ImageSource (尚未解码，由处理流程按需解码)。
+    响应体分块流式读取，Content-Length 或实际读取量超过 max_bytes 时立即中止。
+
+    Raises:
+        ImageDownloadError: 请求失败、内容不是图片或超过大小上限
+    """
+    session = get_session()
+    try:
+        with session.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('content-type')
+            if not content_type or not content_type.startswith('image/'):
+                raise ImageDownloadError(f"链接内容似乎不是图片: {content_type}")
+            declared_length = response.headers.get('content-length')
+            if declared_length and declared_length.isdigit() and int(declared_length) > max_bytes:
+                raise ImageDownloadError(f"图片过大 ({int(declared_length)} 字节，上限 {max_bytes} 字节)")
+            buffer = bytearray()
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                buffer += chunk
+                if len(buffer) > max_bytes:
+                    raise ImageDownloadError(f"图片超过大小上限 ({max_bytes} 字节)")
+    except requests.exceptions.RequestException as e:
+        raise ImageDownloadError(f"无法下载图片链接: {e}") from e
+    if not buffer:
+        raise ImageDownloadError("下载的图片内容为空")
+    return image_source_from_bytes(bytes(buffer), _name_from_url(url, content_type))
+
+def image_source_from_bytes(image_data, name):
+    """
+    将内存中的图像字节 (下载或拖放得到) 包装为 ImageSource，不写临时文件。
+    GIF 动图只取第一帧，由 PIL 在内存中解码。
+    """
+    if image_data.startswith(b"GIF8"):
+        try:
+            with Image.open(io.BytesIO(image_data)) as gif_image:
+                return ImageSource(gif_image.convert("RGB"), name=name)
+        except Exception as e:
+            raise ImageDownloadError(f"无法解码 GIF 图片: {e}") from e
+    return ImageSource(image_data, name=name)
+
+def fetch_images(urls, max_bytes=MAX_DOWNLOAD_BYTES, timeout=DOWNLOAD_TIMEOUT):
+    """
+    并发下载多张图片，返回与 urls 一一对应的结果列表，
+    每项为 ImageSource 或下载失败时的 ImageDownloadError。
+    """
+    futures = [_get_executor().submit(fetch_image, url, max_bytes, timeout) for url in urls]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except ImageDownloadError as e:
+            results.append(e)
+        except Exception as e:
+            results.append(ImageDownloadError(str(e)))
+    return results
+
+def fetch_first_image(urls, max_bytes=MAX_DOWNLOAD_BYTES, timeout=DOWNLOAD_TIMEOUT):
+    """
+    并发下载多个候选链接 (例如从拖放的 HTML 中提取的全部 <img>)，按原顺序返回第一张成功下载的图片，
+    尚未开始的其余下载会被取消。全部失败时抛出第一个链接的错误。
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        raise ImageDownloadError("没有可下载的图片链接")
+    if len(urls) == 1:
+        return fetch_image(urls[0], max_bytes, timeout)
+    futures = [_get_executor().submit(fetch_image, url, max_bytes, timeout) for url in urls]
+    first_error = None
+    for index, future in enumerate(futures):
+        try:
+            source = future.result()
+        except Exception as e:
+            if first_error is None:
+                first_error = e if isinstance(e, ImageDownloadError) else ImageDownloadError(str(e))
+            continue
+        for pending in futures[index + 1:]:
+            pending.cancel()
+        return source
+    raise first_error
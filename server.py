@@ -0,0 +1,373 @@
+# server.py
+"""
+本地 HTTP 推理服务：启动时加载一次检测模型并常驻，供其他工具通过 HTTP 调用，无需每次付出模型加载时间。
+
+接口 (图像以原始字节作为 POST 请求体，参数放在查询字符串中):
+    POST /detect?conf_threshold=0.25&iou_threshold=0.7
+        返回 {"detections": [[[x1, y1, x2, y2], 标签, 置信度], ...], "width": 宽, "height": 高}
+        (与 detect_censors 的元组格式一致)
+    POST /render?mosaic_type=黑色线条&regions=nipple_f,pussy&format=png&line_thickness=5 ...
+        返回编码后的图像字节，参数名与 process_single_image 相同
+        (custom_image_path 除外，自定义图像打码固定使用默认贴图)
+    GET  /stats
+        返回各接口的延迟分位数、推理队列深度与微批次统计
+
+并发请求的检测在一个短暂的等待窗口内合并为微批次送入模型 (所有推理都在同一个线程中进行)，
+打码与编码在各请求线程中并行完成。
+"""
+import argparse
+import io
+import json
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+from detection_cache import DetectionCache, DEFAULT_DETECTION_CACHE_PATH
+from image_processor import (
+    ImageSource, MOSAIC_EFFECTS, process_single_image, detect_image_candidates_batch, detect_image_source,
+    detection_input_for,
+)
+from utils import (
+    RAW_DETECTION_CONF, filter_detections, get_detection_model, get_model_load_stats, set_detector_backend,
+)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# 请求体大小上限，防止异常请求耗尽内存
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+# 每个接口保留最近多少次请求的耗时用于计算分位数
+LATENCY_WINDOW = 2000
+
+OUTPUT_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+class MicroBatcher:
+    """
+    把并发到达的检测请求在 max_wait_seconds 的窗口内合并为最多 max_batch_size 张的批次推理。
+    第一个请求到达后开始计时，批次满或窗口结束即送入模型；空闲时不引入额外延迟以外的等待。
+    """
+
+    def __init__(self, detection_model, max_batch_size=8, max_wait_seconds=0.01, detection_cache=None):
+        self.detection_model = detection_model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_seconds = max(0.0, float(max_wait_seconds))
+        self.detection_cache = detection_cache
+        self._condition = threading.Condition()
+        self._pending = deque()
+        self._batch_sizes = Counter()
+        self._inference_seconds = 0.0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, source, conf_threshold, iou_threshold):
+        """提交一张图像，返回 Future，结果为按阈值筛选后的检测结果 (原图坐标)"""
+        future = Future()
+        with self._condition:
+            self._pending.append((source, conf_threshold, iou_threshold, future))
+            self._condition.notify()
+        return future
+
+    def stats(self):
+        with self._condition:
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+            inference_seconds = self._inference_seconds
+            queue_depth = len(self._pending)
+        batches = sum(batch_sizes.values())
+        images = sum(size * count for size, count in batch_sizes.items())
+        return {
+            "queue_depth": queue_depth,
+            "batches": batches,
+            "images": images,
+            "mean_batch_size": round(images / batches, 3) if batches else 0.0,
+            "batch_size_histogram": batch_sizes,
+            "inference_seconds": round(inference_seconds, 3),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_seconds * 1000.0,
+        }
+
+    def _collect_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.perf_counter() + self.max_wait_seconds
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return [self._pending.popleft() for _ in range(min(self.max_batch_size, len(self._pending)))]
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            start_time = time.perf_counter()
+            # 置信度低于原始候选框阈值的请求无法由候选框筛选，单独按其阈值检测
+            batched = [job for job in batch if job[1] >= RAW_DETECTION_CONF]
+            single = [job for job in batch if job[1] < RAW_DETECTION_CONF]
+            if batched:
+                try:
+                    candidates_list = detect_image_candidates_batch(
+                        [job[0] for job in batched], self.detection_model, self.detection_cache)
+                except Exception as e:
+                    candidates_list = [e] * len(batched)
+                for (source, conf_threshold, iou_threshold, future), candidates in zip(batched, candidates_list):
+                    if candidates is None:
+                        # 无法解码或批量推理失败的图像单独重试，以便向调用方报告具体错误
+                        single.append((source, conf_threshold, iou_threshold, future))
+                    elif isinstance(candidates, Exception):
+                        future.set_exception(candidates)
+                    else:
+                        future.set_result(filter_detections(candidates, conf_threshold, iou_threshold))
+            for source, conf_threshold, iou_threshold, future in single:
+                try:
+                    # 单张检测的异常 (例如模型推理失败) 交给等待该结果的请求，而不是当作没有检测到目标
+                    future.set_result(detect_image_source(source, self.detection_model, conf_threshold, iou_threshold,
+                                                          detection_cache=self.detection_cache, raise_on_error=True))
+                except Exception as e:
+                    future.set_exception(e)
+            with self._condition:
+                self._batch_sizes[len(batch)] += 1
+                self._inference_seconds += time.perf_counter() - start_time
+
+class LatencyRecorder:
+    """按接口记录最近 LATENCY_WINDOW 次请求的耗时，提供分位数统计"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._latencies = {}
+        self._counts = Counter()
+        self._errors = Counter()
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            self._latencies.setdefault(endpoint, deque(maxlen=self._window)).append(seconds)
+            self._counts[endpoint] += 1
+            if error:
+                self._errors[endpoint] += 1
+
+    def stats(self):
+        with self._lock:
+            snapshot = {endpoint: np.array(latencies) for endpoint, latencies in self._latencies.items()}
+            counts = dict(self._counts)
+            errors = dict(self._errors)
+        result = {}
+        for endpoint, latencies in snapshot.items():
+            p50, p90, p99 = np.percentile(latencies, (50, 90, 99)) * 1000.0
+            result[endpoint] = {
+                "requests": counts.get(endpoint, 0), "errors": errors.get(endpoint, 0),
+                "p50_ms": round(float(p50), 2), "p90_ms": round(float(p90), 2), "p99_ms": round(float(p99), 2),
+                "max_ms": round(float(latencies.max()) * 1000.0, 2),
+            }
+        return result
+
+def _parse_color(text):
+    text = text.strip()
+    if text.startswith('#') and len(text) == 7:
+        return tuple(int(text[i:i + 2], 16) for i in (1, 3, 5))
+    parts = tuple(int(part) for part in text.split(','))
+    if len(parts) != 3:
+        raise ValueError(f"无效的颜色: {text}")
+    return parts
+
+def _parse_kernel_size(text):
+    size = int(text)
+    if size % 2 == 0:
+        size += 1
+    return (size, size)
+
+# 查询参数 (与 process_single_image 的参数同名) -> 转换函数。
+# 不接受 custom_image_path：服务端不按客户端提供的路径读取本地文件，自定义图像打码使用默认贴图
+_RENDER_QUERY_PARAMS = {
+    "line_direction": str,
+    "conf_threshold": float, "iou_threshold": float, "scale": float, "alpha": float,
+    "blur_kernel_size": _parse_kernel_size, "line_thickness": int, "line_spacing": int,
+    "mist_color": _parse_color, "light_intensity": float, "light_feather": int, "light_color": _parse_color,
+}
+_MOSAIC_TYPE_BY_EFFECT = {effect: mosaic_type for mosaic_type, effect in MOSAIC_EFFECTS.items()}
+
+def _render_params_from_query(query):
+    """将查询字符串转换为 process_single_image 的参数，未提供的参数使用其默认值"""
+    mosaic_type = query.get("mosaic_type", "常规模糊")
+    mosaic_type = _MOSAIC_TYPE_BY_EFFECT.get(mosaic_type, mosaic_type)
+    if mosaic_type not in MOSAIC_EFFECTS:
+        raise ValueError(f"未知的打码方式: {mosaic_type}")
+    regions = [name.strip() for name in query.get("regions", "").split(',') if name.strip()]
+    params = {"mosaic_type": mosaic_type, "selected_regions": regions}
+    for name, convert in _RENDER_QUERY_PARAMS.items():
+        if name in query:
+            params[name] = convert(query[name])
+    return params
+
+class CensorRequestHandler(BaseHTTPRequestHandler):
+    server_version = "AutomaticCodingServer/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 默认逐请求写访问日志，高并发时开销明显，只保留错误日志
+        pass
+
+    def _send(self, status, body, content_type, extra_headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            raise ValueError("请求体为空，应为图像字节")
+        if length > MAX_REQUEST_BYTES:
+            raise OverflowError(f"请求体过大 ({length} 字节，上限 {MAX_REQUEST_BYTES} 字节)")
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._send_json(200, self.server.stats())
+        elif url.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"未知的接口: {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        handlers = {"/detect": self._handle_detect, "/render": self._handle_render}
+        handler = handlers.get(url.path)
+        if handler is None:
+            self._send_json(404, {"error": f"未知的接口: {url.path}"})
+            return
+        start_time = time.perf_counter()
+        failed = True
+        try:
+            handler(query, self._read_body())
+            failed = False
+        except OverflowError as e:
+            self.close_connection = True
+            self._send_json(413, {"error": str(e)})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            print(f"处理请求 {url.path} 时出错: {e}")
+            self._send_json(500, {"error": str(e)})
+        finally:
+            self.server.latency.record(url.path, time.perf_counter() - start_time, error=failed)
+
+    def _detect(self, source, conf_threshold, iou_threshold):
+        """在请求线程中完成检测输入的解码，只把推理交给微批次线程；返回 (检测结果, 原图尺寸)"""
+        try:
+            with Image.open(io.BytesIO(source.data)) as img:
+                image_size = img.size
+            detection_input_for(source)
+        except Exception as e:
+            raise ValueError(f"无法识别的图像: {e}")
+        return self.server.batcher.submit(source, conf_threshold, iou_threshold).result(), image_size
+
+    def _handle_detect(self, query, body):
+        source = ImageSource(body, name="<detect>")
+        conf_threshold = float(query.get("conf_threshold", 0.25))
+        iou_threshold = float(query.get("iou_threshold", 0.7))
+        detections, (width, height) = self._detect(source, conf_threshold, iou_threshold)
+        self._send_json(200, {
+            "detections": [[[float(v) for v in bbox], label, float(confidence)] for bbox, label, confidence in detections],
+            "width": width, "height": height,
+            "inference_size": list(source.inference_size) if source.inference_size else None,
+        })
+
+    def _handle_render(self, query, body):
+        params = _render_params_from_query(query)
+        output_format = query.get("format", "png").lower()
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {output_format}")
+        source = ImageSource(body, name="<render>")
+        detections, _ = self._detect(source, params.get("conf_threshold", 0.25), params.get("iou_threshold", 0.7))
+        # 检测输入只在推理时需要，打码前释放
+        source.release_detection_input()
+        _, processed_pil, error = process_single_image(source, cached_detection_results=detections, **params)
+        if processed_pil is None:
+            raise RuntimeError(error or "打码失败")
+        regions = params["selected_regions"]
+        rendered_boxes = sum(1 for _, label, _ in detections if not regions or label in regions)
+
+        pil_format, content_type = OUTPUT_FORMATS[output_format]
+        if pil_format == "JPEG" and processed_pil.mode != "RGB":
+            processed_pil = processed_pil.convert("RGB")
+        buffer = io.BytesIO()
+        save_options = {"quality": int(query.get("quality", 90))} if pil_format in ("JPEG", "WEBP") else {}
+        processed_pil.save(buffer, format=pil_format, **save_options)
+        self._send(200, buffer.getvalue(), content_type, {"X-Rendered-Boxes": str(rendered_boxes)})
+
+class CensorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, detection_model, max_batch_size=8, max_wait_seconds=0.01,
+                 detection_cache=None):
+        super().__init__(server_address, CensorRequestHandler)
+        self.started_at = time.time()
+        self.batcher = MicroBatcher(detection_model, max_batch_size, max_wait_seconds, detection_cache)
+        self.latency = LatencyRecorder()
+
+    def stats(self):
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "endpoints": self.latency.stats(),
+            "inference": self.batcher.stats(),
+            "model": {key: value for key, value in get_model_load_stats().items() if key != "model_path"},
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 HTTP 打码推理服务 (模型常驻，并发请求合并为微批次推理)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=8, help="每个微批次最多的图像数")
+    parser.add_argument("--batch-wait-ms", type=float, default=10.0,
+                        help="第一个请求到达后等待更多请求加入批次的最长时间 (毫秒)")
+    parser.add_argument("--detection-cache", action="store_true",
+                        help="使用持久化检测缓存 (同一图像重复请求时无需再次推理)")
+    parser.add_argument("--backend", choices=("pytorch", "onnx", "onnx_int8", "openvino"), default=None,
+                        help="检测推理后端 (默认 pytorch，见 detector_backends.py)")
+    args = parser.parse_args(argv)
+
+    if args.backend:
+        set_detector_backend(args.backend)
+
+    detection_model = get_detection_model()
+    if detection_model is None:
+        print("错误：检测模型未能成功加载，服务无法启动。")
+        return 1
+    # 预热一次推理，避免第一个请求承担推理器初始化的开销
+    detect_image_candidates_batch([ImageSource(np.zeros((64, 64, 3), dtype=np.uint8))], detection_model)
+
+    detection_cache = DetectionCache(DEFAULT_DETECTION_CACHE_PATH) if args.detection_cache else None
+    server = CensorServer((args.host, args.port), detection_model, args.max_batch_size,
+                          args.batch_wait_ms / 1000.0, detection_cache)
+    print(f"打码推理服务已启动: http://{args.host}:{server.server_port} (接口: /detect, /render, /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if detection_cache is not None:
+            detection_cache.close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,66 @@
+"""
+测试用的检测模型替身：调用方式与结果结构同 ultralytics YOLO (utils._result_to_detections 只读取
+boxes.xyxy / conf / cls 与 names)，不加载任何权重，并记录每次推理的批次大小与推理尺寸。
+"""
+import threading
+import time
+
+import numpy as np
+
+LABEL_NAMES = {0: "nipple_f", 1: "penis", 2: "pussy"}
+
+class _Array:
+    def __init__(self, values):
+        self._values = values
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._values
+
+class _Boxes:
+    def __init__(self, rows):
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        self.xyxy = _Array(rows[:, :4])
+        self.conf = _Array(rows[:, 4])
+        self.cls = _Array(rows[:, 5])
+
+class _Result:
+    def __init__(self, rows):
+        self.boxes = _Boxes(rows)
+        self.names = LABEL_NAMES
+
+class StubDetectionModel:
+    """
+    detect(BGR 图像) 返回 [(x1, y1, x2, y2, 置信度, 类别编号), ...]，按 conf 阈值过滤后包装为 YOLO 结果。
+    error 不为 None 时每次推理都抛出该异常；delay 为每次推理的模拟耗时 (秒)。
+    """
+
+    def __init__(self, detect=None, supports_batch=True, error=None, delay=0.0):
+        self.detect = detect or (lambda image: [])
+        self.supports_batch = supports_batch
+        self.error = error
+        self.delay = delay
+        self.batch_sizes = []
+        self.imgsz = []
+        self._lock = threading.Lock()
+
+    def __call__(self, images, conf=0.25, iou=0.7, max_det=300, verbose=False, imgsz=None):
+        batch = images if isinstance(images, list) else [images]
+        with self._lock:
+            self.batch_sizes.append(len(batch))
+            self.imgsz.append(imgsz)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [_Result([row for row in self.detect(image) if row[4] >= conf][:max_det]) for image in batch]
+
+def centered_box(fraction=0.5, confidence=0.9, class_id=0):
+    """返回一个 detect 函数：在每张图像中心检测到一个边长为图像 fraction 比例的框"""
+    def detect(image):
+        height, width = image.shape[:2]
+        margin_x, margin_y = width * (1 - fraction) / 2, height * (1 - fraction) / 2
+        return [(margin_x, margin_y, width - margin_x, height - margin_y, confidence, class_id)]
+    return detect
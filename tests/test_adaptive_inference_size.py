@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import utils
+from image_processor import ImageSource, detect_image_source, inference_size_for
+from utils import (
+    ADAPTIVE_MAX_INPUT_SIZE, ADAPTIVE_MIN_INPUT_SIZE, MODEL_STRIDE, choose_inference_size,
+    get_adaptive_inference_size_config, set_adaptive_inference_size,
+)
+from stub_model import StubDetectionModel
+
+@pytest.fixture
+def adaptive(monkeypatch):
+    """在测试内启用自适应推理尺寸，结束后恢复原来的全局设置与环境变量"""
+    monkeypatch.setattr(utils, "_adaptive_input_size", None)
+    monkeypatch.setattr(utils, "_tiled_detection", None)
+    monkeypatch.delenv("AUTOMATIC_CODING_ADAPTIVE_IMGSZ", raising=False)
+    yield set_adaptive_inference_size
+    set_adaptive_inference_size(False)
+
+@pytest.mark.parametrize("width, height", [
+    (1, 1), (100, 80), (320, 320), (640, 480), (719, 1281), (1281, 719), (4000, 3000), (5000, 100), (100, 5000),
+])
+@pytest.mark.parametrize("min_size, max_size", [
+    (ADAPTIVE_MIN_INPUT_SIZE, ADAPTIVE_MAX_INPUT_SIZE), (256, 640), (640, 640),
+])
+def test_choose_inference_size_is_stride_aligned_and_clamped(width, height, min_size, max_size):
+    size_h, size_w = choose_inference_size(width, height, min_size, max_size)
+    assert size_h % MODEL_STRIDE == 0 and size_w % MODEL_STRIDE == 0
+    assert size_h >= MODEL_STRIDE and size_w >= MODEL_STRIDE
+    assert min_size <= max(size_h, size_w) <= max_size
+    # 输入保持图像的朝向与大致比例 (短边向上取整到步长)
+    assert (size_w >= size_h) == (width >= height) or size_w == size_h
+    assert max(size_h, size_w) / min(size_h, size_w) <= max(width, height) / min(width, height) + 1e-9
+
+def test_choose_inference_size_examples():
+    assert choose_inference_size(200, 150) == (256, 320)
+    assert choose_inference_size(1000, 750) == (768, 1024)
+    assert choose_inference_size(6000, 4000) == (864, 1280)
+
+def test_adaptive_config_roundtrip(adaptive):
+    assert get_adaptive_inference_size_config() is None
+    adaptive(min_size=256, max_size=960)
+    config = get_adaptive_inference_size_config()
+    assert config == {"min_size": 256, "max_size": 960}
+    # 设置同步到环境变量，供 spawn 启动的批处理工作进程恢复
+    assert utils._parse_adaptive_env(utils.os.environ["AUTOMATIC_CODING_ADAPTIVE_IMGSZ"]) == config
+    config["max_size"] = 64
+    assert get_adaptive_inference_size_config()["max_size"] == 960
+    adaptive(False)
+    assert get_adaptive_inference_size_config() is None
+    assert "AUTOMATIC_CODING_ADAPTIVE_IMGSZ" not in utils.os.environ
+
+def test_adaptive_config_rejects_invalid_ranges(adaptive):
+    with pytest.raises(ValueError):
+        adaptive(min_size=16, max_size=640)
+    with pytest.raises(ValueError):
+        adaptive(min_size=640, max_size=320)
+    assert utils._parse_adaptive_env("640,320") is None
+    assert utils._parse_adaptive_env("abc") is None
+    assert utils._parse_adaptive_env(",") == {"min_size": ADAPTIVE_MIN_INPUT_SIZE, "max_size": ADAPTIVE_MAX_INPUT_SIZE}
+
+def test_inference_size_for_follows_setting(adaptive):
+    rgb = np.zeros((150, 200, 3), dtype=np.uint8)
+    model = StubDetectionModel()
+    assert inference_size_for(rgb, model) is None
+    adaptive()
+    assert inference_size_for(rgb, model) == (256, 320)
+
+def test_static_input_backends_ignore_adaptive_size(adaptive):
+    adaptive()
+    model = StubDetectionModel()
+    # 导出为静态输入形状的后端 (见 detector_backends.load_backend_model)
+    model.static_input_size = (640, 640)
+    assert inference_size_for(np.zeros((150, 200, 3), dtype=np.uint8), model) is None
+
+    source = ImageSource(np.zeros((150, 200, 3), dtype=np.uint8))
+    detect_image_source(source, model)
+    assert source.inference_size is None
+    assert model.imgsz == [None]
+
+def test_detection_uses_adaptive_size(adaptive):
+    adaptive()
+    model = StubDetectionModel()
+    source = ImageSource(np.zeros((150, 200, 3), dtype=np.uint8))
+    detect_image_source(source, model)
+    assert source.inference_size == (256, 320)
+    assert model.imgsz == [(256, 320)]
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from batch_journal import BATCH_JOURNAL_FILENAME, BatchJournal
+
+def _make_inputs(folder, count):
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = folder / f"{index}.jpg"
+        path.write_bytes(f"image-{index}".encode())
+        paths.append(path)
+    return paths
+
+def _content_hash(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+def _record_done(journal, path, output_folder):
+    output_path = output_folder / path.name
+    output_path.write_bytes(b"output")
+    journal.record(path, os.stat(path), output_path, content_hash=_content_hash(path))
+    return output_path
+
+def test_skips_completed_files_and_retries_failed_ones(tmp_path):
+    inputs = _make_inputs(tmp_path / "in", 4)
+    output_folder = tmp_path / "out"
+    with BatchJournal(output_folder, "params") as journal:
+        _record_done(journal, inputs[0], output_folder)
+        _record_done(journal, inputs[1], output_folder)
+        journal.record(inputs[2], os.stat(inputs[2]), error="处理失败")
+        assert journal.summary() == {"done": 2, "failed": 1}
+
+    assert (output_folder / BATCH_JOURNAL_FILENAME).exists()
+    skipped = []
+    with BatchJournal(output_folder, "params") as journal:
+        pending = list(journal.iter_pending(inputs, on_skip=lambda path, output: skipped.append(path)))
+        assert pending == [inputs[2], inputs[3]]
+        assert journal.skipped == 2
+    assert skipped == inputs[:2]
+
+def test_resumes_an_interrupted_run(tmp_path):
+    inputs = _make_inputs(tmp_path / "in", 6)
+    output_folder = tmp_path / "out"
+    journal = BatchJournal(output_folder, "params")
+    for path in journal.iter_pending(inputs):
+        _record_done(journal, path, output_folder)
+        if path == inputs[2]:
+            break
+    # 模拟中断：不调用 close，只提交已记录的结果 (批处理流水线结束时同样调用 flush)
+    journal.flush()
+
+    with BatchJournal(output_folder, "params") as resumed:
+        assert list(resumed.iter_pending(inputs)) == inputs[3:]
+
+def test_reprocesses_changed_inputs_missing_outputs_and_new_parameters(tmp_path):
+    inputs = _make_inputs(tmp_path / "in", 3)
+    output_folder = tmp_path / "out"
+    with BatchJournal(output_folder, "params") as journal:
+        outputs = [_record_done(journal, path, output_folder) for path in inputs]
+
+    inputs[0].write_bytes(b"changed content with a different size")
+    outputs[1].unlink()
+    with BatchJournal(output_folder, "params") as journal:
+        assert list(journal.iter_pending(inputs)) == inputs[:2]
+    with BatchJournal(output_folder, "other-params") as journal:
+        assert list(journal.iter_pending(inputs)) == inputs
+
+def test_touched_file_with_same_content_is_skipped_by_hash(tmp_path):
+    inputs = _make_inputs(tmp_path / "in", 1)
+    output_folder = tmp_path / "out"
+    with BatchJournal(output_folder, "params") as journal:
+        _record_done(journal, inputs[0], output_folder)
+
+    stat = os.stat(inputs[0])
+    os.utime(inputs[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+    with BatchJournal(output_folder, "params") as journal:
+        # 没有内容哈希函数时只能按修改时间判断
+        assert list(journal.iter_pending(inputs)) == inputs
+        assert list(journal.iter_pending(inputs, content_hash_func=_content_hash)) == []
+    # 确认后记录的修改时间已更新，之后无需再计算哈希
+    with BatchJournal(output_folder, "params") as journal:
+        assert list(journal.iter_pending(inputs)) == []
+
+    inputs[0].write_bytes(b"image-X")  # 大小相同，内容不同
+    with BatchJournal(output_folder, "params") as journal:
+        assert list(journal.iter_pending(inputs, content_hash_func=_content_hash)) == inputs
+
+def test_two_journals_on_one_output_folder_do_not_block(tmp_path, monkeypatch):
+    inputs = _make_inputs(tmp_path / "in", 60)
+    output_folder = tmp_path / "out"
+    # 缩短等待时间：任一连接长时间持有写锁时测试会很快失败，而不是等待 30 秒
+    real_connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *args, **kwargs: real_connect(*args, **{**kwargs, "timeout": 1}))
+    monkeypatch.setattr(BatchJournal, "COMMIT_INTERVAL", 7)
+
+    first = BatchJournal(output_folder, "params")
+    second = BatchJournal(output_folder, "params")
+    errors = []
+
+    def _record(journal, paths):
+        try:
+            for path in paths:
+                _record_done(journal, path, output_folder)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_record, args=(first, inputs[0::2])),
+               threading.Thread(target=_record, args=(second, inputs[1::2]))]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    first.close()
+    second.close()
+
+    assert errors == []
+    assert time.perf_counter() - start_time < 5
+    with BatchJournal(output_folder, "params") as journal:
+        assert journal.summary() == {"done": 60}
+        assert list(journal.iter_pending(inputs)) == []
@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from utils import composite_mosaic
+
+def _pil_black_lines(roi, line_thickness, spacing, direction, alpha):
+    """逐条用 PIL 绘制线条的参考实现 (矢量化之前的渲染方式)"""
+    h, w = roi.shape[:2]
+    lines_layer = Image.fromarray(roi)
+    draw = ImageDraw.Draw(lines_layer)
+    if direction == 'horizontal':
+        for y in range(0, h, spacing):
+            draw.line([(0, y), (w, y)], fill="black", width=line_thickness)
+    else:
+        for x in range(0, w, spacing):
+            draw.line([(x, 0), (x, h)], fill="black", width=line_thickness)
+    lines_roi = np.asarray(lines_layer)
+    if 0.0 < alpha < 1.0:
+        return cv2.addWeighted(roi, 1.0 - alpha, lines_roi, alpha, 0)
+    return lines_roi
+
+@pytest.mark.parametrize("direction", ["horizontal", "vertical"])
+@pytest.mark.parametrize("line_thickness, spacing", [(1, 3), (2, 7), (5, 10), (6, 6), (9, 4)])
+@pytest.mark.parametrize("alpha", [1.0, 0.6])
+def test_black_lines_match_pil_reference(direction, line_thickness, spacing, alpha):
+    rng = np.random.default_rng(line_thickness * 100 + spacing)
+    image = rng.integers(0, 256, size=(90, 130, 3), dtype=np.uint8)
+    box = (17, 11, 117, 83)
+    expected = image.copy()
+    expected[11:83, 17:117] = _pil_black_lines(image[11:83, 17:117].copy(), line_thickness, spacing, direction, alpha)
+
+    result = composite_mosaic(image.copy(), [box], "black_lines", line_thickness=line_thickness, spacing=spacing,
+                              direction=direction, alpha=alpha)
+    np.testing.assert_array_equal(result, expected)
+
+def test_diagonal_lines_stay_inside_box_and_follow_45_degrees():
+    image = np.full((60, 80, 3), 200, dtype=np.uint8)
+    result = composite_mosaic(image.copy(), [(10, 5, 70, 55)], "black_lines", line_thickness=3, spacing=12,
+                              direction='diagonal')
+    changed = (result != image).any(axis=2)
+    assert not changed[:5].any() and not changed[55:].any()
+    assert not changed[:, :10].any() and not changed[:, 70:].any()
+    roi = changed[5:55, 10:70]
+    # 条纹只取决于 x - y：沿 45° 方向平移一格后掩码不变
+    np.testing.assert_array_equal(roi[1:, 1:], roi[:-1, :-1])
+    assert 0.1 < roi.mean() < 0.6
@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import cli
+import image_processor
+import utils
+from stub_model import StubDetectionModel, centered_box
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    model = StubDetectionModel(centered_box())
+    monkeypatch.setattr(utils, "get_detection_model", lambda: model)
+    monkeypatch.setattr(image_processor, "get_detection_model", lambda: model)
+    return model
+
+def _write_image(path, seed=0, size=(120, 90)):
+    rgb = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(rgb).save(path)
+    return path
+
+def _json_records(stdout):
+    """标准输出必须只包含 JSON Lines"""
+    lines = stdout.splitlines()
+    assert lines, "标准输出为空"
+    return [json.loads(line) for line in lines]
+
+def test_single_image_writes_only_json_to_stdout(tmp_path, stub_model, capsys):
+    input_path = _write_image(tmp_path / "photo.png")
+    output_path = tmp_path / "out" / "photo_censored.png"
+    exit_code = cli.main([str(input_path), "-o", str(output_path), "--mosaic-type", "black_lines",
+                          "--regions", "nipple_f"])
+    captured = capsys.readouterr()
+    records = _json_records(captured.out)
+    assert exit_code == 0
+    assert [record["type"] for record in records] == ["result", "summary"]
+    assert records[0]["status"] == "done"
+    assert records[0]["regions"] == ["nipple_f"] and records[0]["boxes"] == 1
+    assert records[1]["processed"] == 1 and records[1]["failed"] == 0
+    assert output_path.exists()
+
+def test_batch_writes_only_json_to_stdout(tmp_path, stub_model, capsys):
+    input_folder = tmp_path / "in"
+    input_folder.mkdir()
+    for seed in range(3):
+        _write_image(input_folder / f"image_{seed}.jpg", seed)
+    output_folder = tmp_path / "out"
+    exit_code = cli.main([str(input_folder), "-o", str(output_folder), "--no-detection-cache"])
+    captured = capsys.readouterr()
+    records = _json_records(captured.out)
+    assert exit_code == 0
+    results = [record for record in records if record["type"] == "result"]
+    assert len(results) == 3 and all(result["status"] == "done" for result in results)
+    assert records[-1]["type"] == "summary" and records[-1]["processed"] == 3
+    # 进度与模型日志写入标准错误
+    assert captured.err
+    assert len(list(output_folder.glob("image_*"))) == 3
+
+def test_missing_input_emits_error_record(tmp_path, stub_model, capsys):
+    missing = tmp_path / "missing.png"
+    exit_code = cli.main([str(missing), "-o", str(tmp_path / "out")])
+    captured = capsys.readouterr()
+    assert exit_code != 0
+    [record] = _json_records(captured.out)
+    assert record["type"] == "error"
+    assert record["input"] == str(missing)
+    assert "输入路径不存在" in record["error"]
+    assert stub_model.batch_sizes == []
+
+def test_invalid_tiling_emits_error_record(tmp_path, stub_model, capsys):
+    input_path = _write_image(tmp_path / "photo.png")
+    exit_code = cli.main([str(input_path), "-o", str(tmp_path / "out.png"), "--tiled", "--tile-size", "10"])
+    captured = capsys.readouterr()
+    assert exit_code != 0
+    [record] = _json_records(captured.out)
+    assert record["type"] == "error"
+    assert utils.get_tiled_detection_config() is None
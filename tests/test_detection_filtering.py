@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import torch
+from ultralytics.utils.nms import non_max_suppression as yolo_non_max_suppression
+
+from detection_cache import DetectionCache
+from utils import RAW_DETECTION_CONF, RAW_DETECTION_IOU, RAW_DETECTION_MAX_DET, filter_detections, non_max_suppression
+
+LABELS = ["nipple_f", "penis", "pussy"]
+
+def _raw_predictions(seed, count=200):
+    """生成 YOLO 检测头格式的原始输出 (1, 4 + 类别数, N)：中心点 xywh 与各类别得分，框之间大量重叠"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(50, 350, size=(count, 2))
+    # 一部分框围绕少数几个中心聚集，保证 NMS 有实际的抑制
+    centers[: count // 2] = rng.choice(centers[:8], size=count // 2) + rng.normal(0, 4, size=(count // 2, 2))
+    sizes = rng.uniform(20, 80, size=(count, 2))
+    scores = rng.uniform(0, 1, size=(count, len(LABELS))) ** 3
+    prediction = np.concatenate([centers, sizes, scores], axis=1).T[np.newaxis].astype(np.float32)
+    return torch.from_numpy(prediction)
+
+def _yolo_detections(prediction, conf_threshold, iou_threshold, max_det=300):
+    """与 ultralytics 推理后处理一致的直接阈值检测结果，格式同 detect_censors"""
+    output = yolo_non_max_suppression(prediction.clone(), conf_threshold, iou_threshold, max_det=max_det)[0].numpy()
+    return [(tuple(row[:4]), LABELS[int(row[5])], float(row[4])) for row in output]
+
+def _as_set(detections):
+    return {(tuple(np.round(np.asarray(box, dtype=np.float64), 3)), label, round(float(confidence), 5))
+            for box, label, confidence in detections}
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("conf_threshold, iou_threshold", [(0.05, 0.7), (0.25, 0.7), (0.25, 0.45), (0.5, 0.3),
+                                                           (0.1, 0.9)])
+def test_refiltered_candidates_match_direct_thresholded_run(seed, conf_threshold, iou_threshold):
+    prediction = _raw_predictions(seed)
+    candidates = _yolo_detections(prediction, RAW_DETECTION_CONF, RAW_DETECTION_IOU, RAW_DETECTION_MAX_DET)
+    direct = _yolo_detections(prediction, conf_threshold, iou_threshold)
+    assert direct, "测试数据应在该阈值下产生检测框"
+    assert _as_set(filter_detections(candidates, conf_threshold, iou_threshold)) == _as_set(direct)
+
+def test_filter_detections_sorted_by_confidence_and_limited_by_max_det():
+    candidates = _yolo_detections(_raw_predictions(7), RAW_DETECTION_CONF, RAW_DETECTION_IOU, RAW_DETECTION_MAX_DET)
+    filtered = filter_detections(candidates, 0.05, 0.7, max_det=5)
+    assert len(filtered) == 5
+    confidences = [confidence for _, _, confidence in filtered]
+    assert confidences == sorted(confidences, reverse=True)
+
+def test_filter_detections_uses_strict_confidence_threshold():
+    candidates = [((0, 0, 10, 10), "penis", 0.25), ((20, 20, 30, 30), "penis", 0.26)]
+    assert filter_detections(candidates, 0.25, 0.7) == [candidates[1]]
+    assert filter_detections([], 0.25, 0.7) == []
+
+def test_non_max_suppression_suppresses_overlaps_above_threshold():
+    boxes = np.array([[0, 0, 10, 10], [1, 0, 11, 10], [20, 20, 30, 30], [0, 0, 10, 5]], dtype=np.float32)
+    scores = np.array([0.9, 0.8, 0.7, 0.6], dtype=np.float32)
+    # 框 1 与框 0 的 IOU 约为 0.82，框 3 与框 0 的 IOU 为 0.5
+    assert list(non_max_suppression(boxes, scores, 0.7)) == [0, 2, 3]
+    assert list(non_max_suppression(boxes, scores, 0.5)) == [0, 2, 3]
+    assert list(non_max_suppression(boxes, scores, 0.4)) == [0, 2]
+
+def test_non_max_suppression_keeps_everything_at_iou_one():
+    boxes = np.array([[0, 0, 10, 10], [0, 0, 10, 10], [0, 0, 10, 10]], dtype=np.float32)
+    scores = np.array([0.2, 0.9, 0.5], dtype=np.float32)
+    assert list(non_max_suppression(boxes, scores, 1.0)) == [1, 2, 0]
+
+def test_non_max_suppression_matches_torchvision():
+    torchvision = pytest.importorskip("torchvision")
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 200, size=(300, 2))
+    boxes = np.concatenate([xy, xy + rng.uniform(5, 60, size=(300, 2))], axis=1).astype(np.float32)
+    scores = rng.uniform(0, 1, size=300).astype(np.float32)
+    expected = torchvision.ops.nms(torch.from_numpy(boxes), torch.from_numpy(scores), 0.5).numpy()
+    assert list(non_max_suppression(boxes, scores, 0.5)) == list(expected)
+
+def test_detection_cache_hit_and_miss_on_full_key(tmp_path):
+    results = [((1.5, 2.0, 30.0, 40.25), "pussy", 0.75), ((5.0, 5.0, 9.0, 9.0), "nipple_f", 0.06)]
+    with DetectionCache(tmp_path / "cache.sqlite3") as cache:
+        assert cache.get("content", "model", RAW_DETECTION_CONF, RAW_DETECTION_IOU) is None
+        cache.put("content", "model", RAW_DETECTION_CONF, RAW_DETECTION_IOU, results)
+        assert cache.get("content", "model", RAW_DETECTION_CONF, RAW_DETECTION_IOU) == results
+        # 滑块产生的浮点误差不影响命中
+        assert cache.get("content", "model", RAW_DETECTION_CONF + 1e-9, RAW_DETECTION_IOU) == results
+        # 键的任一部分不同都不命中
+        assert cache.get("other-content", "model", RAW_DETECTION_CONF, RAW_DETECTION_IOU) is None
+        assert cache.get("content", "other-model", RAW_DETECTION_CONF, RAW_DETECTION_IOU) is None
+        assert cache.get("content", "model", 0.25, RAW_DETECTION_IOU) is None
+        assert cache.get("content", "model", RAW_DETECTION_CONF, 0.7) is None
+        assert (cache.hits, cache.misses) == (2, 5)
+
+    # 缓存持久化在 SQLite 文件中，重新打开后仍然命中
+    with DetectionCache(tmp_path / "cache.sqlite3") as cache:
+        assert cache.get("content", "model", RAW_DETECTION_CONF, RAW_DETECTION_IOU) == results
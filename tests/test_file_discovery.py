@@ -0,0 +1,61 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from image_processor import FileDiscovery
+
+def _touch(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"")
+    return path
+
+def _relative(paths, root):
+    return sorted(str(Path(p).relative_to(root)).replace(os.sep, "/") for p in paths)
+
+def test_excludes_output_folder_inside_input(tmp_path):
+    root = tmp_path / "photos"
+    _touch(root / "a.jpg")
+    _touch(root / "album" / "b.PNG")
+    _touch(root / "album" / "deep" / "c.webp")
+    _touch(root / "censored" / "a.jpg")
+    _touch(root / "censored" / "album" / "b.PNG")
+    _touch(root / "notes.txt")
+
+    discovery = FileDiscovery(root, exclude_dirs=(root / "censored",))
+    assert _relative(discovery, root) == ["a.jpg", "album/b.PNG", "album/deep/c.webp"]
+    assert discovery.finished and discovery.found == 3
+
+def test_exclusion_matches_relative_and_absolute_paths(tmp_path, monkeypatch):
+    root = tmp_path / "photos"
+    _touch(root / "a.jpg")
+    _touch(root / "out" / "a.jpg")
+    monkeypatch.chdir(tmp_path)
+    assert _relative(FileDiscovery("photos", exclude_dirs=("photos/out",)), "photos") == ["a.jpg"]
+    assert _relative(FileDiscovery(root, exclude_dirs=(str(root / "album" / ".." / "out"),)), root) == ["a.jpg"]
+
+def test_without_exclusion_output_folder_is_walked(tmp_path):
+    root = tmp_path / "photos"
+    _touch(root / "a.jpg")
+    _touch(root / "out" / "a.jpg")
+    assert _relative(FileDiscovery(root), root) == ["a.jpg", "out/a.jpg"]
+
+def test_yields_before_walk_finishes(tmp_path):
+    root = tmp_path / "photos"
+    for index in range(3):
+        _touch(root / f"dir{index}" / f"{index}.jpg")
+    discovery = FileDiscovery(root)
+    iterator = iter(discovery)
+    next(iterator)
+    assert not discovery.finished and discovery.found == 1
+    assert len(list(iterator)) == 2
+    assert discovery.finished
+
+def test_does_not_follow_directory_symlinks(tmp_path):
+    root = tmp_path / "photos"
+    _touch(root / "a.jpg")
+    try:
+        os.symlink(root, root / "loop", target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip("当前系统不支持创建符号链接")
+    assert _relative(FileDiscovery(root), root) == ["a.jpg"]
@@ -0,0 +1,128 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("requests")
+
+import net_ingest
+from net_ingest import ImageDownloadError, fetch_first_image, fetch_image, fetch_images
+
+def _encode(image_format, size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 90)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+PNG_BYTES = _encode("PNG")
+JPEG_BYTES = _encode("JPEG", size=(64, 48))
+GIF_BYTES = _encode("GIF", size=(16, 12))
+LARGE_BODY = b"\xff" * 300_000
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """本地图片服务器替身：按路径返回不同的内容类型、长度与状态码"""
+
+    # (状态码, Content-Type, 响应体, 是否声明 Content-Length)
+    ROUTES = {
+        "/photo.png": (200, "image/png", PNG_BYTES, True),
+        "/download": (200, "image/jpeg; charset=binary", JPEG_BYTES, True),
+        "/animated.gif": (200, "image/gif", GIF_BYTES, True),
+        "/page.html": (200, "text/html; charset=utf-8", b"<html><img src='/photo.png'></html>", True),
+        "/untyped": (200, None, PNG_BYTES, True),
+        "/large-declared.jpg": (200, "image/jpeg", LARGE_BODY, True),
+        # 不声明长度、以关闭连接结束的响应体，只能在读取过程中发现超限
+        "/large-streamed.jpg": (200, "image/jpeg", LARGE_BODY, False),
+        "/empty.png": (200, "image/png", b"", True),
+    }
+
+    def do_GET(self):
+        route = self.ROUTES.get(self.path)
+        if route is None:
+            self.send_error(404)
+            return
+        status, content_type, body, declare_length = route
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        if declare_length:
+            self.send_header("Content-Length", str(len(body)))
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端超限后提前断开
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def _no_proxy(monkeypatch):
+    for name in ("HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY", "http_proxy", "https_proxy", "all_proxy"):
+        monkeypatch.delenv(name, raising=False)
+
+def test_fetches_image_in_memory(server_url):
+    source = fetch_image(f"{server_url}/photo.png")
+    assert source.path is None
+    assert source.name == "photo.png"
+    assert source.data == PNG_BYTES
+    assert source.rgb.shape == (30, 40, 3)
+
+def test_name_falls_back_to_content_type(server_url):
+    source = fetch_image(f"{server_url}/download")
+    assert source.name == "download.jpg"
+    assert source.rgb.shape == (48, 64, 3)
+
+def test_gif_is_decoded_to_first_frame(server_url):
+    assert fetch_image(f"{server_url}/animated.gif").rgb.shape == (12, 16, 3)
+
+@pytest.mark.parametrize("path", ["/page.html", "/untyped"])
+def test_rejects_non_image_content_type(server_url, path):
+    with pytest.raises(ImageDownloadError, match="不是图片"):
+        fetch_image(f"{server_url}{path}")
+
+def test_rejects_declared_length_over_cap(server_url):
+    with pytest.raises(ImageDownloadError, match="图片过大"):
+        fetch_image(f"{server_url}/large-declared.jpg", max_bytes=100_000)
+
+def test_aborts_streamed_body_over_cap(server_url):
+    with pytest.raises(ImageDownloadError, match="超过大小上限"):
+        fetch_image(f"{server_url}/large-streamed.jpg", max_bytes=100_000)
+
+def test_body_within_cap_is_accepted(server_url):
+    source = fetch_image(f"{server_url}/large-streamed.jpg", max_bytes=len(LARGE_BODY))
+    assert source.data == LARGE_BODY
+
+def test_http_errors_and_empty_bodies_are_reported(server_url):
+    with pytest.raises(ImageDownloadError, match="无法下载"):
+        fetch_image(f"{server_url}/missing.png")
+    with pytest.raises(ImageDownloadError, match="为空"):
+        fetch_image(f"{server_url}/empty.png")
+
+def test_fetch_images_keeps_order_and_reports_failures(server_url):
+    results = fetch_images([f"{server_url}/photo.png", f"{server_url}/page.html", f"{server_url}/download"])
+    assert [type(result).__name__ for result in results] == ["ImageSource", "ImageDownloadError", "ImageSource"]
+    assert results[2].name == "download.jpg"
+
+def test_fetch_first_image_skips_failed_candidates(server_url):
+    source = fetch_first_image([f"{server_url}/page.html", f"{server_url}/missing.png", f"{server_url}/photo.png"])
+    assert source.name == "photo.png"
+    with pytest.raises(ImageDownloadError, match="不是图片"):
+        fetch_first_image([f"{server_url}/page.html", f"{server_url}/missing.png"])
+
+def test_session_is_shared(server_url):
+    fetch_image(f"{server_url}/photo.png")
+    assert net_ingest.get_session() is net_ingest.get_session()
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from utils import OverlayTexture, apply_custom_image_mosaic, composite_mosaic, get_array_overlay_texture
+
+@pytest.mark.parametrize("alpha", [None, 0.6])
+def test_cached_overlay_renders_like_a_fresh_texture(alpha):
+    rng = np.random.default_rng(1)
+    overlay = rng.integers(0, 256, size=(120, 90, 4), dtype=np.uint8)
+    image = rng.integers(0, 256, size=(200, 160, 3), dtype=np.uint8)
+    box = (20, 30, 95, 140)
+    expected = composite_mosaic(image.copy(), [box], "custom_image", overlay=OverlayTexture(overlay), alpha=alpha)
+    for _ in range(2):
+        np.testing.assert_array_equal(apply_custom_image_mosaic(image, box, overlay, alpha=alpha), expected)
+
+def test_array_texture_cache_follows_content():
+    overlay = np.full((64, 64, 4), 255, dtype=np.uint8)
+    texture = get_array_overlay_texture(overlay)
+    assert get_array_overlay_texture(overlay.copy()) is texture
+    overlay[10, 10] = (0, 0, 0, 0)
+    assert get_array_overlay_texture(overlay) is not texture
@@ -0,0 +1,154 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_processor import ImageSource
+from server import CensorServer, LatencyRecorder, MicroBatcher
+from stub_model import StubDetectionModel, centered_box
+
+# 不经过环境变量中的代理访问本地服务
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+def _png_bytes(seed, size=(96, 64)):
+    rgb = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def _request(url, body=None):
+    """返回 (状态码, 响应头, 响应体)，错误状态码不抛出异常"""
+    try:
+        with _opener.open(urllib.request.Request(url, data=body), timeout=30) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(model, max_batch_size=8, max_wait_seconds=0.01):
+        server = CensorServer(("127.0.0.1", 0), model, max_batch_size, max_wait_seconds)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_concurrent_submissions_share_one_batch():
+    model = StubDetectionModel(centered_box())
+    # 等待窗口足够长，批次只会因为凑满而送入模型
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_seconds=5.0)
+    sources = [ImageSource(_png_bytes(seed)) for seed in range(4)]
+    futures = [batcher.submit(source, 0.25, 0.7) for source in sources]
+    results = [future.result(timeout=30) for future in futures]
+    assert model.batch_sizes == [4]
+    assert all(len(detections) == 1 for detections in results)
+    stats = batcher.stats()
+    assert stats["batches"] == 1 and stats["images"] == 4
+    assert stats["batch_size_histogram"] == {4: 1}
+
+def test_model_exception_reaches_every_waiter():
+    model = StubDetectionModel(error=RuntimeError("推理失败"))
+    batcher = MicroBatcher(model, max_batch_size=3, max_wait_seconds=5.0)
+    futures = [batcher.submit(ImageSource(_png_bytes(seed)), 0.25, 0.7) for seed in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="推理失败"):
+            future.result(timeout=30)
+    # 批量推理失败后逐张重试，每个请求都得到具体的异常
+    assert model.batch_sizes == [3, 1, 1, 1]
+
+def test_latency_recorder_percentiles():
+    recorder = LatencyRecorder()
+    for ms in range(1, 101):
+        recorder.record("/detect", ms / 1000.0, error=(ms % 10 == 0))
+    stats = recorder.stats()["/detect"]
+    assert stats["requests"] == 100 and stats["errors"] == 10
+    assert stats["p50_ms"] == pytest.approx(50.5)
+    assert stats["p90_ms"] == pytest.approx(90.1)
+    assert stats["p99_ms"] == pytest.approx(99.01)
+    assert stats["max_ms"] == pytest.approx(100.0)
+
+def test_latency_recorder_keeps_a_window():
+    recorder = LatencyRecorder(window=10)
+    for ms in range(1, 101):
+        recorder.record("/render", ms / 1000.0)
+    stats = recorder.stats()["/render"]
+    assert stats["requests"] == 100
+    assert stats["p50_ms"] == pytest.approx(95.5)
+
+def test_detect_coalesces_concurrent_requests(start_server):
+    model = StubDetectionModel(centered_box())
+    url = start_server(model, max_batch_size=4, max_wait_seconds=5.0)
+    bodies = [_png_bytes(seed) for seed in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda body: _request(f"{url}/detect?conf_threshold=0.5", body), bodies))
+    assert model.batch_sizes == [4]
+    for status, _, body in responses:
+        assert status == 200
+        payload = json.loads(body)
+        assert (payload["width"], payload["height"]) == (96, 64)
+        [[bbox, label, confidence]] = payload["detections"]
+        assert label == "nipple_f"
+        assert confidence == pytest.approx(0.9)
+        assert bbox == pytest.approx([24, 16, 72, 48], abs=1.0)
+
+def test_detect_reports_model_errors(start_server):
+    url = start_server(StubDetectionModel(error=RuntimeError("推理失败")))
+    status, _, body = _request(f"{url}/detect", _png_bytes(0))
+    assert status == 500
+    assert "推理失败" in json.loads(body)["error"]
+
+def test_detect_rejects_invalid_requests(start_server):
+    url = start_server(StubDetectionModel())
+    assert _request(f"{url}/detect", b"not an image")[0] == 400
+    assert _request(f"{url}/render?mosaic_type=unknown", _png_bytes(0))[0] == 400
+    assert _request(f"{url}/unknown", _png_bytes(0))[0] == 404
+
+def test_render_only_changes_detected_region(start_server):
+    url = start_server(StubDetectionModel(centered_box()))
+    body = _png_bytes(1)
+    query = urlencode({"mosaic_type": "黑色线条", "regions": "nipple_f", "format": "png"})
+    status, headers, rendered = _request(f"{url}/render?{query}", body)
+    assert status == 200
+    assert headers["Content-Type"] == "image/png"
+    assert headers["X-Rendered-Boxes"] == "1"
+    original = np.asarray(Image.open(io.BytesIO(body)).convert("RGB"))
+    result = np.asarray(Image.open(io.BytesIO(rendered)).convert("RGB"))
+    assert result.shape == original.shape
+    assert not np.array_equal(result[20:44, 28:68], original[20:44, 28:68])
+    np.testing.assert_array_equal(result[:10], original[:10])
+    np.testing.assert_array_equal(result[:, :20], original[:, :20])
+
+def test_render_skips_unselected_regions(start_server):
+    url = start_server(StubDetectionModel(centered_box()))
+    body = _png_bytes(2)
+    query = urlencode({"mosaic_type": "黑色线条", "regions": "penis", "format": "png"})
+    status, headers, rendered = _request(f"{url}/render?{query}", body)
+    assert status == 200
+    assert headers["X-Rendered-Boxes"] == "0"
+    np.testing.assert_array_equal(np.asarray(Image.open(io.BytesIO(rendered)).convert("RGB")),
+                                  np.asarray(Image.open(io.BytesIO(body)).convert("RGB")))
+
+def test_stats_reports_latency_percentiles(start_server):
+    url = start_server(StubDetectionModel(centered_box()))
+    for seed in range(5):
+        assert _request(f"{url}/detect", _png_bytes(seed))[0] == 200
+    status, _, body = _request(f"{url}/stats")
+    assert status == 200
+    stats = json.loads(body)
+    detect = stats["endpoints"]["/detect"]
+    assert detect["requests"] == 5 and detect["errors"] == 0
+    assert 0 < detect["p50_ms"] <= detect["p90_ms"] <= detect["p99_ms"] <= detect["max_ms"]
+    assert stats["inference"]["images"] == 5
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils import detect_censors, detect_censors_tiled, get_tile_grid, should_tile_image
+from stub_model import StubDetectionModel
+
+@pytest.mark.parametrize("width, height, tile_size, overlap", [
+    (3000, 2000, 1280, 0.2),
+    (4096, 4096, 1280, 0.2),
+    (2000, 1000, 640, 0.25),
+    (1281, 700, 640, 0.5),
+    (640, 640, 640, 0.2),
+])
+def test_tile_grid_covers_image_with_overlap(width, height, tile_size, overlap):
+    tiles = get_tile_grid(width, height, tile_size, overlap)
+    covered = np.zeros((height, width), dtype=bool)
+    for x1, y1, x2, y2 in tiles:
+        assert 0 <= x1 < x2 <= width and 0 <= y1 < y2 <= height
+        assert x2 - x1 == min(tile_size, width) and y2 - y1 == min(tile_size, height)
+        covered[y1:y2, x1:x2] = True
+    assert covered.all()
+
+    min_overlap = tile_size - int(tile_size * (1.0 - overlap))
+    for axis in (0, 1):
+        starts = sorted({tile[axis] for tile in tiles})
+        ends = sorted({tile[axis + 2] for tile in tiles})
+        for previous_end, next_start in zip(ends, starts[1:]):
+            assert previous_end - next_start >= min_overlap
+
+def test_tile_grid_for_image_smaller_than_one_tile():
+    assert get_tile_grid(300, 200, 640, 0.2) == [(0, 0, 300, 200)]
+    assert get_tile_grid(1000, 200, 640, 0.2) == [(0, 0, 640, 200), (360, 0, 1000, 200)]
+
+def _paint_regions(width, height, regions):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    for x1, y1, x2, y2 in regions:
+        image[y1:y2, x1:x2] = (255, 255, 255)
+    return image
+
+def _detect_bright_regions(image):
+    """替身检测器：每个亮色连通区域的外接框都是一个完整置信度相同的检测框"""
+    mask = (image.max(axis=2) > 127).astype(np.uint8)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+    return [(x, y, x + w, y + h, 0.9, 0) for x, y, w, h, _ in stats[1:count]]
+
+# 2000x1000 的图像按 640 的图块、0.25 的重叠切分：图块起点 x = 0, 480, 960, 1360；y = 0, 360
+SMALL_REGION = (600, 100, 660, 160)    # 被第一列图块的右边缘截断，完整出现在第二列图块中
+LARGE_REGION = (1000, 300, 1500, 700)  # 比重叠区域大，在每个图块中都被截断，只有缩小的整图能看到完整区域
+
+@pytest.mark.parametrize("supports_batch", [True, False])
+def test_seam_cut_boxes_merge_into_one_detection(supports_batch):
+    image = _paint_regions(2000, 1000, [SMALL_REGION, LARGE_REGION])
+    model = StubDetectionModel(_detect_bright_regions, supports_batch=supports_batch)
+    detections = detect_censors_tiled(image, model, conf_threshold=0.25, iou_threshold=0.7,
+                                      tile_size=640, overlap=0.25, batch_size=4, imgsz=640)
+    boxes = sorted(bbox for bbox, _, _ in detections)
+    assert len(boxes) == 2
+    # 缩小的整图检测的框在原图上有数个像素的误差
+    np.testing.assert_allclose(boxes[0], SMALL_REGION, atol=4)
+    np.testing.assert_allclose(boxes[1], LARGE_REGION, atol=4)
+    assert all(label == "nipple_f" for _, label, _ in detections)
+    # 1 张缩小的整图 + 8 个图块
+    assert sum(model.batch_sizes) == 9
+    assert max(model.batch_sizes) == (4 if supports_batch else 1)
+
+def test_region_inside_overlap_is_not_duplicated():
+    # 完整出现在两个相邻图块 (以及整图) 中的区域只保留一个检测框
+    region = (500, 450, 600, 550)
+    detections = detect_censors_tiled(_paint_regions(2000, 1000, [region]),
+                                      StubDetectionModel(_detect_bright_regions),
+                                      tile_size=640, overlap=0.25, imgsz=640)
+    assert len(detections) == 1
+    np.testing.assert_allclose(detections[0][0], region, atol=4)
+
+def test_detect_censors_tiles_only_large_images():
+    tiling = {"tile_size": 640, "overlap": 0.25, "min_image_size": 1500}
+    assert should_tile_image(2000, 1000, tiling)
+    assert not should_tile_image(1200, 1000, tiling)
+
+    model = StubDetectionModel(_detect_bright_regions)
+    detect_censors(_paint_regions(2000, 1000, [SMALL_REGION]), model, tiling=tiling)
+    assert sum(model.batch_sizes) == 9
+    model.batch_sizes.clear()
+    detect_censors(_paint_regions(1200, 1000, [SMALL_REGION]), model, tiling=tiling)
+    assert model.batch_sizes == [1]
@@ -0,0 +1,129 @@
+import cv2
+import numpy as np
+import pytest
+
+import video_processor
+from video_processor import BoxTracker, process_video
+from stub_model import StubDetectionModel
+
+FRAME_SIZE = (160, 120)
+BACKGROUND = 128
+SQUARE = 40
+# 纹理方块每帧的位移 (x, y)
+STEP = (3, 2)
+START = (30, 25)
+
+_TEXTURE = cv2.GaussianBlur(np.random.default_rng(7).integers(0, 256, (SQUARE, SQUARE), dtype=np.uint8), (3, 3), 0)
+
+def _frame(offset):
+    """灰色背景上放置一个带纹理的方块，offset 为方块左上角坐标；None 表示不放置方块"""
+    gray = np.full((FRAME_SIZE[1], FRAME_SIZE[0]), BACKGROUND, dtype=np.uint8)
+    if offset is not None:
+        x, y = offset
+        gray[y:y + SQUARE, x:x + SQUARE] = _TEXTURE
+    return gray
+
+def _square_at(index):
+    return START[0] + STEP[0] * index, START[1] + STEP[1] * index
+
+def _box_at(index):
+    x, y = _square_at(index)
+    return (x, y, x + SQUARE, y + SQUARE)
+
+def test_tracker_follows_shifted_square():
+    tracker = BoxTracker()
+    prev_gray = _frame(_square_at(0))
+    tracker.reset(prev_gray, [(_box_at(0), "nipple_f", 0.9)])
+    assert tracker.tracks[0]["points"] is not None
+    for index in range(1, 6):
+        gray = _frame(_square_at(index))
+        confidence = tracker.update(prev_gray, gray)
+        assert confidence >= 0.5
+        [box] = tracker.boxes()
+        np.testing.assert_allclose(box, _box_at(index), atol=1.5)
+        prev_gray = gray
+
+def test_forward_backward_check_rejects_inconsistent_flow():
+    prev_gray = _frame(_square_at(0))
+    # 同一位置换成另一块纹理 (例如被遮挡)：前向光流仍能 "找到" 对应点，但后向光流回不到原处
+    occluded = _frame(None)
+    x, y = _square_at(0)
+    occluded[y:y + SQUARE, x:x + SQUARE] = cv2.GaussianBlur(
+        np.random.default_rng(8).integers(0, 256, (SQUARE, SQUARE), dtype=np.uint8), (3, 3), 0)
+    unchecked = BoxTracker(fb_threshold=float("inf"))
+    unchecked.reset(prev_gray, [(_box_at(0), "nipple_f", 0.9)])
+    assert unchecked.update(prev_gray, occluded) == 1.0
+    tracker = BoxTracker()
+    tracker.reset(prev_gray, [(_box_at(0), "nipple_f", 0.9)])
+    assert tracker.update(prev_gray, occluded) < video_processor.TRACK_MIN_CONFIDENCE
+
+def test_lost_track_is_dropped():
+    tracker = BoxTracker()
+    prev_gray = _frame(_square_at(0))
+    tracker.reset(prev_gray, [(_box_at(0), "nipple_f", 0.9)])
+    # 方块消失：找不到足够的有效点，跟踪应被放弃而不是停留在错误位置
+    confidence = tracker.update(prev_gray, _frame(None))
+    assert confidence < video_processor.TRACK_MIN_CONFIDENCE
+    assert tracker.tracks[0]["points"] is None
+    # 失去跟踪的区域不再参与之后的光流计算
+    assert tracker.update(_frame(None), _frame(None)) == 1.0
+
+def test_untextured_region_stays_in_place():
+    tracker = BoxTracker()
+    gray = _frame(None)
+    tracker.reset(gray, [((10, 10, 50, 50), "nipple_f", 0.9)])
+    assert tracker.tracks[0]["points"] is None
+    assert tracker.update(gray, gray) == 1.0
+    assert tracker.boxes() == [(10.0, 10.0, 50.0, 50.0)]
+
+def _detect_square(image):
+    """替身检测器：以与背景差异明显的像素范围作为检测框"""
+    ys, xs = np.nonzero(np.abs(image[:, :, 1].astype(np.int16) - BACKGROUND) > 40)
+    if len(xs) == 0:
+        return []
+    return [(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, 0.9, 0)]
+
+@pytest.fixture
+def synthetic_video(tmp_path):
+    path = tmp_path / "input.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 25.0, FRAME_SIZE)
+    if not writer.isOpened():
+        pytest.skip("OpenCV 无可用的 MJPG 编码器")
+    frame_count = 23
+    for index in range(frame_count):
+        writer.write(cv2.cvtColor(_frame(_square_at(index % 12)), cv2.COLOR_GRAY2BGR))
+    writer.release()
+    return path, frame_count
+
+def _count_frames(path):
+    capture = cv2.VideoCapture(str(path))
+    count = 0
+    while capture.read()[0]:
+        count += 1
+    capture.release()
+    return count
+
+def test_process_video_writes_every_frame(synthetic_video, tmp_path, monkeypatch):
+    input_path, frame_count = synthetic_video
+    model = StubDetectionModel(_detect_square)
+    monkeypatch.setattr(video_processor, "get_detection_model", lambda: model)
+    output_path = tmp_path / "output" / "result.avi"
+    progress = []
+    stats = process_video(input_path, output_path, "黑色线条", ["nipple_f"], detect_interval=5,
+                          progress_callback=lambda done, total: progress.append((done, total)))
+    assert stats is not None and "error" not in stats
+    assert stats["frames"] == frame_count
+    assert _count_frames(output_path) == frame_count
+    assert progress[-1] == (frame_count, frame_count)
+    # 每 5 帧至少检测一次；方块跳回起点时跟踪失败会触发提前检测
+    assert stats["redetections"] >= 1
+    assert stats["detections"] >= -(-frame_count // 5)
+    assert len(model.batch_sizes) == stats["detections"]
+
+def test_process_video_respects_max_frames(synthetic_video, tmp_path, monkeypatch):
+    input_path, _ = synthetic_video
+    monkeypatch.setattr(video_processor, "get_detection_model", lambda: StubDetectionModel(_detect_square))
+    output_path = tmp_path / "partial.avi"
+    stats = process_video(input_path, output_path, "常规模糊", [], max_frames=7)
+    assert stats["frames"] == 7
+    assert _count_frames(output_path) == 7
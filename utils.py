@@ -1,17 +1,190 @@
 # utils.py
-from ultralytics import YOLO
 from PIL import Image, ImageFilter, ImageDraw
 import numpy as np
 import cv2
 import os
 import colorsys
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+MODEL_PATH = "models/model.pt"
+# 检测模型的推理后端: pytorch / onnx / onnx_int8 / openvino (见 detector_backends)，
+# 可通过环境变量 AUTOMATIC_CODING_BACKEND 或 set_detector_backend 指定
+DETECTOR_BACKEND = os.environ.get("AUTOMATIC_CODING_BACKEND", "pytorch")
+
+# 与阈值无关的原始候选框检测参数：以支持的最低置信度检测一次且不做有效的NMS
+# (IOU阈值为1.0时不会抑制任何框)，之后由 filter_detections 按任意阈值重新筛选
+RAW_DETECTION_CONF = 0.05
+RAW_DETECTION_IOU = 1.0
+RAW_DETECTION_MAX_DET = 1000
+# 检测模型的推理输入尺寸 (ultralytics 默认 imgsz)，检测用的图像无需以高于该尺寸的分辨率解码
+DETECTION_INPUT_SIZE = 640
+
+# 比较两组检测结果时，同类别且 IOU 不低于该值的两个框视为一致 (见 match_detections)
+BOX_AGREEMENT_IOU = 0.5
+
+# 超大图像的分块检测 (见 set_tiled_detection)：最长边不低于 TILE_MIN_IMAGE_SIZE 的图像切分为
+# 相互重叠的 TILE_SIZE 见方的图块，与一次缩小到推理尺寸的整图检测合并为批次推理，再合并图块接缝处的检测框。
+# 默认关闭，可通过环境变量 AUTOMATIC_CODING_TILING="图块尺寸,重叠比例,最小图像尺寸" 启用
+TILE_SIZE = 1280
+TILE_OVERLAP = 0.2
+TILE_MIN_IMAGE_SIZE = 3000
+TILE_BATCH_SIZE = 8
+# 检测框距图块内部边缘不超过该像素数时视为被接缝截断
+TILE_SEAM_MARGIN = 2
+# 被截断的框有这一比例以上的面积被其他图块 (或整图) 中同类别、置信度不低于它的框覆盖时丢弃
+TILE_SEAM_COVERAGE = 0.6
+
+# 按图像尺寸自适应选择推理输入尺寸 (见 set_adaptive_inference_size)：最长边限制在
+# [ADAPTIVE_MIN_INPUT_SIZE, ADAPTIVE_MAX_INPUT_SIZE] 内，宽高按图像比例取步长的整数倍 (矩形 letterbox)。
+# 默认关闭，可通过环境变量 AUTOMATIC_CODING_ADAPTIVE_IMGSZ="最小尺寸,最大尺寸" 启用
+ADAPTIVE_MIN_INPUT_SIZE = 320
+ADAPTIVE_MAX_INPUT_SIZE = 1280
+# 检测模型的最大下采样步长，推理输入的宽高需为其整数倍
+MODEL_STRIDE = 32
+
+# 进程内共享的检测模型注册表 (见 get_detection_model)
+_detection_model = None
+_detection_model_loaded = False
+_detection_model_lock = threading.Lock()
+_model_load_stats = {}
+_model_fingerprint = None
+_tiled_detection = None
+_adaptive_input_size = None
+
+def _mirror_setting_to_env(name, value):
+    """
+    将进程内的检测设置同步到环境变量 (value 为 None 时删除)：批处理以 spawn 方式启动的工作进程
+    不继承父进程的全局变量，只继承环境变量，导入本模块时会从环境变量恢复相同的设置。
+    """
+    if value is None:
+        os.environ.pop(name, None)
+    else:
+        os.environ[name] = str(value)
+
+def set_detector_backend(backend):
+    """切换检测后端，已加载的共享模型会在下次调用 get_detection_model 时按新后端重新加载"""
+    global DETECTOR_BACKEND, _detection_model, _detection_model_loaded
+    with _detection_model_lock:
+        DETECTOR_BACKEND = backend
+        _mirror_setting_to_env("AUTOMATIC_CODING_BACKEND", backend)
+        _detection_model = None
+        _detection_model_loaded = False
+
+def _parse_tiling_env(value):
+    if not value:
+        return None
+    try:
+        tile_size, overlap, min_image_size = (value.split(",") + ["", "", ""])[:3]
+        return _tiling_config(int(tile_size or TILE_SIZE), float(overlap or TILE_OVERLAP),
+                              int(min_image_size or TILE_MIN_IMAGE_SIZE))
+    except ValueError as e:
+        print(f"忽略无效的 AUTOMATIC_CODING_TILING 设置 ({value}): {e}")
+        return None
+
+def _tiling_config(tile_size, overlap, min_image_size):
+    if tile_size < 64:
+        raise ValueError(f"图块尺寸过小: {tile_size}")
+    if not 0.0 <= overlap < 0.9:
+        raise ValueError(f"图块重叠比例应在 0~0.9 之间: {overlap}")
+    return {"tile_size": int(tile_size), "overlap": float(overlap),
+            "min_image_size": max(int(min_image_size), int(tile_size))}
+
+def set_tiled_detection(enabled=True, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, min_image_size=TILE_MIN_IMAGE_SIZE):
+    """
+    启用或关闭超大图像的分块检测。
+    
+    Args:
+        enabled: False 时关闭分块检测
+        tile_size: 图块边长 (原图像素)，每个图块会被缩放到推理尺寸，越小对小区域的召回越好但图块越多
+        overlap: 相邻图块的重叠比例，应不小于待检测区域相对图块的尺寸，才能保证每个区域至少完整出现在一个图块中
+        min_image_size: 最长边达到该值的图像才分块检测，较小的图像仍一次整图检测
+    """
+    global _tiled_detection
+    _tiled_detection = _tiling_config(tile_size, overlap, min_image_size) if enabled else None
+    _mirror_setting_to_env("AUTOMATIC_CODING_TILING",
+                           f"{tile_size},{overlap},{min_image_size}" if _tiled_detection else None)
+
+def get_tiled_detection_config():
+    """返回当前的分块检测设置字典 (tile_size / overlap / min_image_size)，未启用时返回 None"""
+    return dict(_tiled_detection) if _tiled_detection is not None else None
+
+def should_tile_image(width, height, tiling=None):
+    """按分块检测设置 (默认为当前全局设置) 判断该尺寸的图像是否需要分块检测"""
+    tiling = _tiled_detection if tiling is None else tiling
+    return bool(tiling) and max(width, height) >= tiling["min_image_size"]
+
+_tiled_detection = _parse_tiling_env(os.environ.get("AUTOMATIC_CODING_TILING"))
+
+def _adaptive_config(min_size, max_size):
+    if min_size < MODEL_STRIDE or max_size < min_size:
+        raise ValueError(f"无效的推理尺寸范围: {min_size}~{max_size}")
+    return {"min_size": int(min_size), "max_size": int(max_size)}
+
+def _parse_adaptive_env(value):
+    if not value:
+        return None
+    try:
+        min_size, max_size = (value.split(",") + ["", ""])[:2]
+        return _adaptive_config(int(min_size or ADAPTIVE_MIN_INPUT_SIZE), int(max_size or ADAPTIVE_MAX_INPUT_SIZE))
+    except ValueError as e:
+        print(f"忽略无效的 AUTOMATIC_CODING_ADAPTIVE_IMGSZ 设置 ({value}): {e}")
+        return None
+
+def set_adaptive_inference_size(enabled=True, min_size=ADAPTIVE_MIN_INPUT_SIZE, max_size=ADAPTIVE_MAX_INPUT_SIZE):
+    """
+    启用或关闭按图像自适应的推理输入尺寸：小图 (如缩略图) 以较小的尺寸推理以节省时间，
+    大图以不超过 max_size 的尺寸推理以提高小区域的召回，不再统一使用模型默认尺寸。
+    """
+    global _adaptive_input_size
+    _adaptive_input_size = _adaptive_config(min_size, max_size) if enabled else None
+    _mirror_setting_to_env("AUTOMATIC_CODING_ADAPTIVE_IMGSZ",
+                           f"{min_size},{max_size}" if _adaptive_input_size else None)
+
+def get_adaptive_inference_size_config():
+    """返回当前的自适应推理尺寸设置字典 (min_size / max_size)，未启用时返回 None"""
+    return dict(_adaptive_input_size) if _adaptive_input_size is not None else None
+
+def choose_inference_size(width, height, min_size=ADAPTIVE_MIN_INPUT_SIZE, max_size=ADAPTIVE_MAX_INPUT_SIZE,
+                          stride=MODEL_STRIDE):
+    """
+    根据图像尺寸选择推理输入尺寸：最长边取图像最长边并限制在 [min_size, max_size] 内，
+    短边按图像宽高比缩放，二者均向上取 stride 的整数倍，得到贴合图像比例的矩形输入而不是正方形填充。
+    
+    Returns:
+        (高, 宽)，可直接作为 ultralytics 的 imgsz 参数
+    """
+    long_side = max(width, height, 1)
+    target = min(max(long_side, min_size), max_size)
+    ratio = target / long_side
+    return (max(stride, math.ceil(height * ratio / stride) * stride),
+            max(stride, math.ceil(width * ratio / stride) * stride))
+
+_adaptive_input_size = _parse_adaptive_env(os.environ.get("AUTOMATIC_CODING_ADAPTIVE_IMGSZ"))
 
 def load_models():
     """加载本地censor检测模型"""
+    global DETECTOR_BACKEND
     try:
         # 尝试加载.pt文件
-        pt_model_path = "models/model.pt"
+        pt_model_path = MODEL_PATH
+        if os.path.exists(pt_model_path) and DETECTOR_BACKEND != "pytorch":
+            # 导出的 ONNX / OpenVINO 模型缓存在权重文件旁，首次使用时自动导出
+            try:
+                from detector_backends import load_backend_model
+                censor_model = load_backend_model(DETECTOR_BACKEND, pt_model_path)
+                print(f"成功加载模型: {pt_model_path} (推理后端: {DETECTOR_BACKEND})")
+                return None, censor_model
+            except Exception as e_backend:
+                print(f"无法使用 {DETECTOR_BACKEND} 推理后端: {e_backend}，改用 PyTorch。")
+                DETECTOR_BACKEND = "pytorch"
         if os.path.exists(pt_model_path):
+            # 延迟导入 ultralytics (会连带导入 torch)，避免拖慢不需要模型的启动路径
+            from ultralytics import YOLO
             censor_model = YOLO(pt_model_path)
             print(f"成功加载模型: {pt_model_path}")
             return None, censor_model
@@ -22,46 +195,394 @@ def load_models():
         print(f"Error loading models: {e}")
         return None, None
 
-def detect_censors(image_path, detection_model, conf_threshold=0.25, iou_threshold=0.7):
+def _get_process_rss_mb():
+    """获取当前进程的常驻内存 (MB)，无法获取时返回 None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def get_detection_model():
+    """获取进程内共享的检测模型
+    
+    模型在首次调用时加载，且整个进程只加载一次 (线程安全)。
+    单图处理、批量处理与 GUI 均通过此函数复用同一个模型实例。
+    
+    Returns:
+        YOLO模型，加载失败时返回 None
+    """
+    global _detection_model, _detection_model_loaded
+    if _detection_model_loaded:
+        return _detection_model
+    with _detection_model_lock:
+        if not _detection_model_loaded:
+            rss_before = _get_process_rss_mb()
+            start_time = time.perf_counter()
+            _, _detection_model = load_models()
+            load_seconds = time.perf_counter() - start_time
+            rss_after = _get_process_rss_mb()
+            _model_load_stats.update({
+                "model_path": MODEL_PATH,
+                "loaded": _detection_model is not None,
+                "load_seconds": load_seconds,
+                "rss_before_mb": rss_before,
+                "rss_after_mb": rss_after,
+            })
+            _detection_model_loaded = True
+            if rss_before is not None and rss_after is not None:
+                print(f"检测模型加载耗时 {load_seconds:.2f}s，常驻内存 {rss_after:.1f} MB "
+                      f"(模型占用约 {rss_after - rss_before:.1f} MB)")
+            else:
+                print(f"检测模型加载耗时 {load_seconds:.2f}s")
+    return _detection_model
+
+def get_model_load_stats():
+    """获取检测模型的加载统计 (耗时、加载前后的常驻内存)，模型尚未加载时返回空字典"""
+    return dict(_model_load_stats)
+
+def get_model_fingerprint():
+    """
+    获取检测模型的指纹，用于持久化检测缓存与批处理日志的键：
+    权重文件的内容哈希 (只计算一次)，使用非 PyTorch 后端时附加后端名称 (量化模型的结果会略有不同)，
+    启用分块检测或自适应推理尺寸时附加相应设置。
+    """
+    fingerprint = get_weights_fingerprint()
+    if DETECTOR_BACKEND != "pytorch":
+        fingerprint += f":{DETECTOR_BACKEND}"
+    if _tiled_detection is not None:
+        fingerprint += ":tiled-{tile_size}-{overlap}-{min_image_size}".format(**_tiled_detection)
+    if _adaptive_input_size is not None:
+        fingerprint += ":imgsz-{min_size}-{max_size}".format(**_adaptive_input_size)
+    return fingerprint
+
+def get_weights_fingerprint():
+    """获取模型权重文件的内容哈希 (只计算一次)"""
+    global _model_fingerprint
+    if _model_fingerprint is None:
+        hasher = hashlib.blake2b(digest_size=20)
+        try:
+            with open(MODEL_PATH, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    hasher.update(chunk)
+            _model_fingerprint = hasher.hexdigest()
+        except OSError:
+            _model_fingerprint = "missing"
+    return _model_fingerprint
+
+def detect_censors(image, detection_model, conf_threshold=0.25, iou_threshold=0.7, raise_on_error=False,
+                   max_det=300, tiling=None, imgsz=None):
     """使用YOLO模型检测图像中的马赛克区域
     
     Args:
-        image_path: 图像路径
+        image: 图像路径，或内存中已解码的RGB图像(NumPy数组)
         detection_model: YOLO模型
         conf_threshold: 置信度阈值
         iou_threshold: IOU阈值
+        raise_on_error: 为True时检测异常直接抛出，否则打印错误并返回空列表
+        max_det: 每张图像最多保留的检测框数量
+        tiling: 分块检测设置，None 时使用全局设置 (见 set_tiled_detection)，False 时不分块；
+            只对内存中的图像生效
+        imgsz: 推理输入尺寸，None 时使用模型默认值；分块检测时用于每个图块与缩小的整图
     """
     if detection_model is None:
         return []
+    tiling = _tiled_detection if tiling is None else tiling
+    if isinstance(image, np.ndarray) and should_tile_image(image.shape[1], image.shape[0], tiling):
+        return detect_censors_tiled(image, detection_model, conf_threshold, iou_threshold,
+                                    raise_on_error=raise_on_error, max_det=max_det, imgsz=imgsz, **tiling)
     try:
+        if isinstance(image, np.ndarray):
+            # 内存中的图像约定为RGB，而YOLO按BGR解读NumPy输入
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
         # 使用YOLO进行检测，使用自定义阈值
-        results = detection_model(image_path, conf=conf_threshold, iou=iou_threshold, verbose=False)
+        predict_kwargs = {"imgsz": imgsz} if imgsz else {}
+        results = detection_model(image, conf=conf_threshold, iou=iou_threshold, max_det=max_det, verbose=False,
+                                  **predict_kwargs)
         
-        detected_objects = []
         if results and len(results) > 0:
-            result = results[0]
-            if result.boxes is not None:
-                boxes = result.boxes.xyxy.cpu().numpy()  # 边界框坐标 (x1,y1,x2,y2)
-                conf = result.boxes.conf.cpu().numpy()   # 置信度
-                cls = result.boxes.cls.cpu().numpy()     # 类别
-                
-                # 获取类别名称
-                names = result.names if hasattr(result, 'names') else {}
-                
-                for i in range(len(boxes)):
-                    x1, y1, x2, y2 = boxes[i]
-                    confidence = conf[i]
-                    class_id = int(cls[i])
-                    class_name = names.get(class_id, f"class_{class_id}")
-                    
-                    # 返回格式: (边界框, 标签, 置信度)
-                    detected_objects.append(((x1, y1, x2, y2), class_name, confidence))
-        
-        return detected_objects
+            return _result_to_detections(results[0])
+        return []
+    except Exception as e:
+        if raise_on_error:
+            raise
+        print(f"Error detecting censors: {e}")
+        return []
+
+def detect_censors_batch(images, detection_model, conf_threshold=0.25, iou_threshold=0.7, raise_on_error=False,
+                         max_det=300, imgsz=None):
+    """对一组RGB图像进行一次批量推理
+    
+    各图像由YOLO统一letterbox后组成一个批次送入模型，检测框会映射回各自原图坐标。
+    
+    Args:
+        images: RGB图像(NumPy数组)列表
+        detection_model: YOLO模型
+        conf_threshold: 置信度阈值
+        iou_threshold: IOU阈值
+        raise_on_error: 为True时检测异常直接抛出，否则打印错误并返回空结果
+        max_det: 每张图像最多保留的检测框数量
+        imgsz: 整个批次共用的推理输入尺寸，None 时使用模型默认值
+    
+    Returns:
+        与 images 一一对应的检测结果列表，每项格式同 detect_censors
+    """
+    if detection_model is None or not images:
+        return [[] for _ in images]
+    tiled_indices = [idx for idx, image in enumerate(images) if should_tile_image(image.shape[1], image.shape[0])]
+    if tiled_indices:
+        # 需要分块的超大图像各自以图块组成批次推理，其余图像仍合并为一个批次
+        results = [None] * len(images)
+        for idx in tiled_indices:
+            results[idx] = detect_censors(images[idx], detection_model, conf_threshold, iou_threshold,
+                                          raise_on_error, max_det, imgsz=imgsz)
+        rest = [idx for idx in range(len(images)) if results[idx] is None]
+        for idx, detections in zip(rest, detect_censors_batch([images[idx] for idx in rest], detection_model,
+                                                              conf_threshold, iou_threshold, raise_on_error, max_det,
+                                                              imgsz)):
+            results[idx] = detections
+        return results
+    if len(images) > 1 and not getattr(detection_model, "supports_batch", True):
+        # 导出为静态输入形状的后端 (ONNX / OpenVINO) 每次只能推理一张图像
+        return [detect_censors(image, detection_model, conf_threshold, iou_threshold, raise_on_error, max_det,
+                               imgsz=imgsz)
+                for image in images]
+    try:
+        batch = [cv2.cvtColor(image, cv2.COLOR_RGB2BGR) for image in images]
+        predict_kwargs = {"imgsz": imgsz} if imgsz else {}
+        results = detection_model(batch, conf=conf_threshold, iou=iou_threshold, max_det=max_det, verbose=False,
+                                  **predict_kwargs)
+        return [_result_to_detections(result) for result in results]
+    except Exception as e:
+        if raise_on_error:
+            raise
+        print(f"Error detecting censors: {e}")
+        return [[] for _ in images]
+
+def _tile_starts(length, tile_size, stride):
+    """沿一个方向的图块起点，最后一个图块与图像边缘对齐"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+def get_tile_grid(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """返回覆盖整幅图像的图块列表 [(x1, y1, x2, y2), ...]，相邻图块重叠 overlap 比例"""
+    stride = max(1, int(tile_size * (1.0 - overlap)))
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in _tile_starts(height, tile_size, stride)
+            for x in _tile_starts(width, tile_size, stride)]
+
+def detect_censors_tiled(image, detection_model, conf_threshold=0.25, iou_threshold=0.7, raise_on_error=False,
+                         max_det=300, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, min_image_size=None,
+                         batch_size=TILE_BATCH_SIZE, imgsz=None):
+    """对超大RGB图像分块检测
+    
+    图像被切分为相互重叠的图块，连同一张缩小到推理尺寸的整图 (用于检测跨越多个图块的大区域)
+    按 batch_size 组成批次推理。各图块的检测框平移回原图坐标后合并：被图块内部边缘截断、
+    且大部分面积已被其他图块中同类别、置信度不低于它的框覆盖的残缺框被丢弃，
+    其余的框再按类别做NMS (iou_threshold 为 1.0 时保留全部候选框，供 filter_detections 之后筛选)。
+    
+    Args:
+        min_image_size: 仅为与分块设置字典的键保持一致，这里不使用
+        imgsz: 每个图块 (以及缩小的整图) 的推理输入尺寸，整数或 (高, 宽)，None 时使用模型默认值
+    
+    Returns:
+        与 detect_censors 格式相同的检测结果列表 (原图坐标)
+    """
+    if detection_model is None:
+        return []
+    try:
+        height, width = image.shape[:2]
+        tiles = get_tile_grid(width, height, tile_size, overlap)
+        # 整图缩小到推理尺寸后再送入模型，避免为超大图像做一次整图颜色转换
+        input_size = max(imgsz) if isinstance(imgsz, (tuple, list)) else (imgsz or DETECTION_INPUT_SIZE)
+        overview_ratio = min(1.0, input_size / max(width, height))
+        overview = cv2.resize(image, (max(1, round(width * overview_ratio)), max(1, round(height * overview_ratio))),
+                              interpolation=cv2.INTER_AREA)
+        jobs = [((0, 0, width, height), overview, 1.0 / overview_ratio)]
+        jobs += [(tile, image[tile[1]:tile[3], tile[0]:tile[2]], 1.0) for tile in tiles]
+        if not getattr(detection_model, "supports_batch", True):
+            batch_size = 1
+        predict_kwargs = {"imgsz": imgsz} if imgsz else {}
+
+        boxes, scores, labels, tile_ids, cut = [], [], [], [], []
+        for chunk_start in range(0, len(jobs), batch_size):
+            chunk = jobs[chunk_start:chunk_start + batch_size]
+            results = detection_model([cv2.cvtColor(tile_rgb, cv2.COLOR_RGB2BGR) for _, tile_rgb, _ in chunk],
+                                      conf=conf_threshold, iou=iou_threshold, max_det=max_det, verbose=False,
+                                      **predict_kwargs)
+            for job_index, ((x1, y1, x2, y2), _, ratio), result in zip(range(chunk_start, len(jobs)), chunk, results):
+                for (bx1, by1, bx2, by2), label, confidence in _result_to_detections(result):
+                    box = (bx1 * ratio + x1, by1 * ratio + y1, bx2 * ratio + x1, by2 * ratio + y1)
+                    boxes.append(box)
+                    scores.append(float(confidence))
+                    labels.append(label)
+                    tile_ids.append(job_index)
+                    # 图块内部边缘 (不是原图边缘) 处的框可能只是区域的一部分
+                    cut.append((x1 > 0 and box[0] <= x1 + TILE_SEAM_MARGIN)
+                               or (y1 > 0 and box[1] <= y1 + TILE_SEAM_MARGIN)
+                               or (x2 < width and box[2] >= x2 - TILE_SEAM_MARGIN)
+                               or (y2 < height and box[3] >= y2 - TILE_SEAM_MARGIN))
+        if not boxes:
+            return []
+
+        boxes = np.array(boxes, dtype=np.float32)
+        scores = np.array(scores, dtype=np.float32)
+        tile_ids = np.array(tile_ids)
+        label_array = np.array(labels, dtype=object)
+        areas = np.clip(boxes[:, 2] - boxes[:, 0], 1e-6, None) * np.clip(boxes[:, 3] - boxes[:, 1], 1e-6, None)
+        keep = np.ones(len(boxes), dtype=bool)
+        for i in np.nonzero(cut)[0]:
+            # 覆盖框的置信度不低于残缺框，保证任意置信度阈值下丢弃残缺框时覆盖框都会被保留
+            others = (tile_ids != tile_ids[i]) & (label_array == labels[i]) & (scores >= scores[i]) & keep
+            if not others.any():
+                continue
+            inter_w = np.clip(np.minimum(boxes[others, 2], boxes[i, 2]) - np.maximum(boxes[others, 0], boxes[i, 0]), 0, None)
+            inter_h = np.clip(np.minimum(boxes[others, 3], boxes[i, 3]) - np.maximum(boxes[others, 1], boxes[i, 1]), 0, None)
+            if ((inter_w * inter_h) / areas[i]).max() >= TILE_SEAM_COVERAGE:
+                keep[i] = False
+
+        merged = [(tuple(boxes[i]), labels[i], scores[i]) for i in np.nonzero(keep)[0]]
+        # 同一区域完整出现在多个重叠图块中时由按类别的NMS去重
+        return filter_detections(merged, conf_threshold, iou_threshold, max_det=max_det)
     except Exception as e:
+        if raise_on_error:
+            raise
         print(f"Error detecting censors: {e}")
         return []
 
+def _result_to_detections(result):
+    """将单张图像的YOLO结果转换为 [(边界框, 标签, 置信度), ...] 格式"""
+    detected_objects = []
+    if result.boxes is not None:
+        boxes = result.boxes.xyxy.cpu().numpy()  # 边界框坐标 (x1,y1,x2,y2)
+        conf = result.boxes.conf.cpu().numpy()   # 置信度
+        cls = result.boxes.cls.cpu().numpy()     # 类别
+        
+        # 获取类别名称
+        names = result.names if hasattr(result, 'names') else {}
+        
+        for i in range(len(boxes)):
+            x1, y1, x2, y2 = boxes[i]
+            confidence = conf[i]
+            class_id = int(cls[i])
+            class_name = names.get(class_id, f"class_{class_id}")
+            
+            # 返回格式: (边界框, 标签, 置信度)
+            detected_objects.append(((x1, y1, x2, y2), class_name, confidence))
+    return detected_objects
+
+def detect_censor_candidates(image, detection_model, raise_on_error=False, imgsz=None):
+    """以最低置信度运行一次检测，返回与阈值无关的原始候选框 (格式同 detect_censors)
+    
+    候选框可通过 filter_detections 按任意置信度/IOU阈值重新筛选，无需再次推理。
+    """
+    return detect_censors(image, detection_model, RAW_DETECTION_CONF, RAW_DETECTION_IOU,
+                          raise_on_error=raise_on_error, max_det=RAW_DETECTION_MAX_DET, imgsz=imgsz)
+
+def detect_censor_candidates_batch(images, detection_model, raise_on_error=False, imgsz=None):
+    """detect_censor_candidates 的批量版本，对一组RGB图像进行一次批量推理"""
+    return detect_censors_batch(images, detection_model, RAW_DETECTION_CONF, RAW_DETECTION_IOU,
+                                raise_on_error=raise_on_error, max_det=RAW_DETECTION_MAX_DET, imgsz=imgsz)
+
+def non_max_suppression(boxes, scores, iou_threshold):
+    """NumPy实现的贪心非极大值抑制
+    
+    Args:
+        boxes: (N, 4) 边界框数组 (x1, y1, x2, y2)
+        scores: (N,) 置信度数组
+        iou_threshold: 与已保留框的IOU大于该值的框将被抑制
+    
+    Returns:
+        按置信度从高到低排列的保留框索引
+    """
+    order = np.argsort(-scores, kind="stable")
+    if iou_threshold >= 1.0 or len(order) <= 1:
+        return order
+    sorted_boxes = boxes[order]
+    x1, y1, x2, y2 = (sorted_boxes[:, k] for k in range(4))
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    # 一次性计算两两IOU矩阵，之后的贪心过程只需按行做布尔运算
+    inter_w = np.clip(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0, None)
+    inter_h = np.clip(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0, None)
+    inter = inter_w * inter_h
+    iou = inter / (areas[:, None] + areas[None, :] - inter + 1e-9)
+    suppresses = np.triu(iou > iou_threshold, k=1)
+    keep = np.ones(len(order), dtype=bool)
+    for i in np.nonzero(suppresses.any(axis=1))[0]:
+        if keep[i]:
+            keep &= ~suppresses[i]
+    return order[keep]
+
+def filter_detections(candidates, conf_threshold=0.25, iou_threshold=0.7, max_det=300):
+    """按置信度阈值和IOU阈值从原始候选框中筛选检测结果
+    
+    与YOLO内置后处理一致：先按置信度过滤，再按类别分别做NMS。
+    候选框数量在数百以内时耗时远低于1毫秒，拖动阈值滑块时无需重新推理。
+    
+    Args:
+        candidates: detect_censor_candidates 返回的候选框列表
+        conf_threshold: 置信度阈值
+        iou_threshold: IOU阈值
+        max_det: 最多保留的检测框数量
+    
+    Returns:
+        与 detect_censors 格式相同的检测结果列表
+    """
+    if not candidates:
+        return []
+    scores = np.fromiter((c[2] for c in candidates), dtype=np.float32, count=len(candidates))
+    selected = np.nonzero(scores > conf_threshold)[0]
+    if selected.size == 0:
+        return []
+    boxes = np.array([candidates[i][0] for i in selected], dtype=np.float32).reshape(-1, 4)
+    labels = [candidates[i][1] for i in selected]
+    # 按类别平移坐标，使不同类别的框互不重叠，从而一次NMS即可实现按类别抑制
+    label_ids = {label: idx for idx, label in enumerate(dict.fromkeys(labels))}
+    offsets = np.array([label_ids[label] for label in labels], dtype=np.float32) * (float(boxes.max()) + 1.0)
+    keep = non_max_suppression(boxes + offsets[:, None], scores[selected], iou_threshold)[:max_det]
+    return [candidates[selected[i]] for i in keep]
+
+def _box_iou(box_a, box_b):
+    inter_w = min(box_a[2], box_b[2]) - max(box_a[0], box_b[0])
+    inter_h = min(box_a[3], box_b[3]) - max(box_a[1], box_b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    return inter / (area_a + area_b - inter + 1e-9)
+
+def match_detections(reference, candidate, iou_threshold=BOX_AGREEMENT_IOU):
+    """
+    按置信度从高到低贪心匹配同类别的检测框。
+
+    Returns:
+        (匹配数, 匹配框的 IOU 列表)
+    """
+    unmatched = sorted(range(len(reference)), key=lambda i: -reference[i][2])
+    ious = []
+    for bbox, label, _ in sorted(candidate, key=lambda d: -d[2]):
+        best_index, best_iou = None, iou_threshold
+        for ref_index in unmatched:
+            if reference[ref_index][1] != label:
+                continue
+            iou = _box_iou(bbox, reference[ref_index][0])
+            if iou >= best_iou:
+                best_index, best_iou = ref_index, iou
+        if best_index is not None:
+            unmatched.remove(best_index)
+            ious.append(best_iou)
+    return len(ious), ious
+
 def adjust_box_by_scale(box, scale, img_shape):
     """根据比例调整边界框
     
@@ -108,6 +629,415 @@ def to_rgba(image: np.ndarray) -> np.ndarray:
         image = cv2.cvtColor(image, cv2.COLOR_RGB2RGBA)
     return image
 
+def _scaled_region(box, scale, img_shape):
+    """按比例调整边界框并转换为图像范围内的整数区域 (x1, y1, x2, y2)，区域为空时返回 None"""
+    h, w = img_shape[:2]
+    x1, y1, x2, y2 = [int(v) for v in adjust_box_by_scale(box, scale, (h, w))]
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(w, x2), min(h, y2)
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return (x1, y1, x2, y2)
+
+def group_overlapping_regions(regions):
+    """将相互重叠 (直接或经由其他区域间接重叠) 的矩形区域分为一组
+    
+    Args:
+        regions: [(x1, y1, x2, y2), ...] 整数区域列表
+    
+    Returns:
+        [(外接矩形, [组内区域, ...]), ...]，不同组的区域互不重叠
+    """
+    parents = list(range(len(regions)))
+
+    def _find(idx):
+        while parents[idx] != idx:
+            parents[idx] = parents[parents[idx]]
+            idx = parents[idx]
+        return idx
+
+    for i, region in enumerate(regions):
+        for j in range(i):
+            other = regions[j]
+            if region[0] < other[2] and other[0] < region[2] and region[1] < other[3] and other[1] < region[3]:
+                parents[_find(i)] = _find(j)
+    groups = {}
+    for idx, region in enumerate(regions):
+        groups.setdefault(_find(idx), []).append(region)
+    result = []
+    for members in groups.values():
+        bounds = (min(r[0] for r in members), min(r[1] for r in members),
+                  max(r[2] for r in members), max(r[3] for r in members))
+        result.append((bounds, members))
+    return result
+
+def _render_blur_region(roi, kernel_size=(31, 31), alpha=1.0):
+    """在区域视图上就地应用高斯模糊"""
+    blurred_roi = cv2.GaussianBlur(roi, kernel_size, 0)
+    # 应用透明度
+    if alpha < 1.0:
+        roi[...] = cv2.addWeighted(roi, 1.0 - alpha, blurred_roi, alpha, 0)
+    else:
+        roi[...] = blurred_roi
+
+def _line_band_mask(length, line_thickness, spacing):
+    """沿一个轴生成条纹掩码：线条中心位于 0, spacing, 2*spacing, ...，
+    每条线覆盖 [c - (t-1)//2, c + t//2]，与 PIL 绘制宽线时的像素范围一致"""
+    centers = np.arange(0, length, spacing)
+    starts = np.clip(centers - (line_thickness - 1) // 2, 0, length)
+    ends = np.clip(centers + line_thickness // 2 + 1, 0, length)
+    # 差分数组 + 前缀和，一次性标记所有线条覆盖的区间
+    coverage = np.zeros(length + 1, dtype=np.int32)
+    np.add.at(coverage, starts, 1)
+    np.add.at(coverage, ends, -1)
+    return np.cumsum(coverage[:-1]) > 0
+
+@lru_cache(maxsize=64)
+def _diagonal_half_width(line_thickness):
+    """测量 PIL 绘制 45° 宽线时每行覆盖的半宽 (像素)，使斜线粗细与原实现一致"""
+    if line_thickness <= 0:
+        return -1
+    size = 4 * line_thickness + 8
+    probe = Image.new('L', (size, size), 0)
+    ImageDraw.Draw(probe).line([(0, 0), (size, size)], fill=255, width=line_thickness)
+    return int(np.count_nonzero(np.asarray(probe)[size // 2])) // 2
+
+def _diagonal_band_mask(h, w, line_thickness, spacing):
+    """生成 45° 斜向条纹掩码 (h, w)，条纹沿 x - y 方向以 spacing 为周期分布"""
+    half_width = _diagonal_half_width(line_thickness)
+    # 掩码只取决于 x - y，先生成一条长度 h + w - 1 的周期序列，
+    # 再用负行步长的只读视图展开成二维，不额外分配 h * w 的内存
+    # 与原实现一致，条纹相位以 -max(w, h) 为起点
+    offsets = np.arange(-(h - 1), w) + max(w, h) + half_width
+    pattern = np.ascontiguousarray((offsets % spacing) <= 2 * half_width)
+    step = pattern.strides[0]
+    return np.lib.stride_tricks.as_strided(pattern[h - 1:], shape=(h, w), strides=(-step, step), writeable=False)
+
+def _render_black_lines_region(roi, line_thickness=5, spacing=10, direction='horizontal', alpha=1.0):
+    """在区域视图上就地绘制黑色线条 (坐标相对于区域左上角)
+    
+    条纹掩码直接由索引运算得到，不再经过 PIL 逐条绘制；透明度通过查找表一次混合。
+    """
+    h, w = roi.shape[:2]
+    if direction == 'horizontal':
+        mask = np.broadcast_to(_line_band_mask(h, line_thickness, spacing)[:, None], (h, w))
+    elif direction == 'vertical':
+        mask = np.broadcast_to(_line_band_mask(w, line_thickness, spacing)[None, :], (h, w))
+    elif direction == 'diagonal':
+        mask = _diagonal_band_mask(h, w, line_thickness, spacing)
+    else:
+        return
+    mask = np.ascontiguousarray(mask).view(np.uint8)
+    
+    # 应用透明度：黑色线条与原像素混合等价于把线条像素按 (1 - alpha) 缩放，
+    # 查找表由 addWeighted 生成，保证舍入方式与逐像素混合完全一致
+    if 0.0 < alpha < 1.0:
+        levels = np.arange(256, dtype=np.uint8)
+        lines_roi = cv2.LUT(roi, cv2.addWeighted(levels, 1.0 - alpha, levels, 0.0, 0))
+    else:
+        lines_roi = np.zeros_like(roi)
+    # 以掩码就地写回区域视图
+    cv2.copyTo(lines_roi, mask, roi)
+
+# 光效径向掩码缓存：键为 (h, w, feather)，值为定点化 (0-2^15) 的 uint16 掩码
+_LIGHT_MASK_BITS = 15
+LIGHT_MASK_CACHE_SIZE = 64
+# 尺寸相差在该比例以内的缓存掩码可直接缩放复用，径向渐变足够平滑，缩放误差可以忽略
+LIGHT_MASK_RESAMPLE_TOLERANCE = 0.1
+_light_mask_cache = OrderedDict()
+_light_mask_cache_lock = threading.Lock()
+_light_mask_cache_stats = {"hits": 0, "resampled": 0, "built": 0}
+
+def _build_light_mask(h, w, feather):
+    """计算中心亮、边缘暗的径向渐变掩码，返回定点化 (乘以 2^15) 的 uint16 数组"""
+    center_x, center_y = w // 2, h // 2
+    
+    # 生成径向渐变
+    y_indices, x_indices = np.ogrid[:h, :w]
+    dist_from_center = np.sqrt(((x_indices - center_x)**2 + (y_indices - center_y)**2).astype(np.float32))
+    max_dist = np.sqrt(center_x**2 + center_y**2) or 1.0
+    mask = np.clip(1.0 - dist_from_center / np.float32(max_dist), 0, 1)
+    mask = np.power(mask, np.float32(1.0 / (feather / 100.0 + 0.1)))
+    return (mask * float(1 << _LIGHT_MASK_BITS) + 0.5).astype(np.uint16)
+
+def get_light_mask(h, w, feather):
+    """获取 (h, w, feather) 对应的定点化径向掩码 (LRU 缓存)
+    
+    未命中时优先从羽化相同、尺寸相近的已缓存掩码缩放得到，否则重新计算。
+    返回的数组为只读的共享对象，调用方不可修改。
+    """
+    key = (h, w, feather)
+    with _light_mask_cache_lock:
+        mask = _light_mask_cache.get(key)
+        if mask is not None:
+            _light_mask_cache.move_to_end(key)
+            _light_mask_cache_stats["hits"] += 1
+            return mask
+        source = None
+        best_diff = LIGHT_MASK_RESAMPLE_TOLERANCE
+        for (ch, cw, cf), cached in _light_mask_cache.items():
+            if cf != feather:
+                continue
+            diff = max(abs(ch - h) / h, abs(cw - w) / w)
+            if diff <= best_diff:
+                source, best_diff = cached, diff
+    
+    if source is not None:
+        mask = cv2.resize(source, (w, h), interpolation=cv2.INTER_LINEAR)
+        stat = "resampled"
+    else:
+        mask = _build_light_mask(h, w, feather)
+        stat = "built"
+    mask.setflags(write=False)
+    
+    with _light_mask_cache_lock:
+        _light_mask_cache_stats[stat] += 1
+        _light_mask_cache[key] = mask
+        _light_mask_cache.move_to_end(key)
+        while len(_light_mask_cache) > LIGHT_MASK_CACHE_SIZE:
+            _light_mask_cache.popitem(last=False)
+    return mask
+
+def get_light_mask_cache_stats():
+    """返回光效掩码缓存的命中 / 缩放复用 / 重新计算次数"""
+    with _light_mask_cache_lock:
+        return dict(_light_mask_cache_stats, size=len(_light_mask_cache))
+
+def _fixed_point_weight(value):
+    """将 0-1 的混合权重转换为 0-256 的定点整数"""
+    return int(round(min(max(float(value), 0.0), 1.0) * 256))
+
+def _render_white_mist_region(roi, strength=0.8, color=(255, 255, 255)):
+    """在区域视图上就地混合雾气颜色
+    
+    权重在整个区域内恒定，混合结果只取决于 (通道, 像素值)，
+    因此预先按定点公式 (v*(256-a) + c*a + 128) >> 8 生成三通道查找表，一次查表完成，不分配颜色层。
+    """
+    a = _fixed_point_weight(strength)
+    levels = np.arange(256, dtype=np.uint32)[:, None]
+    lut = (levels * (256 - a) + np.asarray(color, dtype=np.uint32)[None, :3] * a + 128) >> 8
+    cv2.LUT(roi, lut.astype(np.uint8).reshape(256, 1, 3), dst=roi)
+
+def _render_light_region(roi, intensity=0.8, feather=30, color=(255, 255, 255)):
+    """在区域视图上就地应用中心亮、边缘暗的径向光效
+    
+    径向掩码来自 LRU 缓存，混合使用 uint16 定点运算：
+    out = (roi*(256-a) + c*a + 128) >> 8，其中 a = 掩码 * 强度 (0-256)。
+    各通道拆成连续平面后逐一计算，避免沿通道维广播带来的额外开销。
+    """
+    h, w = roi.shape[:2]
+    k = _fixed_point_weight(intensity)
+    mask = get_light_mask(h, w, feather).astype(np.uint32)
+    a = ((mask * k + (1 << (_LIGHT_MASK_BITS - 1))) >> _LIGHT_MASK_BITS).astype(np.uint16)
+    inv_a = 256 - a
+    # a <= 256，roi*(256-a) + c*a <= 255*256，整个计算不会溢出 uint16
+    blended_planes = []
+    for plane, c in zip(cv2.split(roi), color):
+        blended = plane.astype(np.uint16)
+        blended *= inv_a
+        blended += a * np.uint16(c)
+        blended += 128
+        blended >>= 8
+        blended_planes.append(blended.astype(np.uint8))
+    roi[...] = cv2.merge(blended_planes)
+
+class OverlayTexture:
+    """
+    自定义贴图纹理。
+    解码后只构建一次分辨率金字塔 (每级尺寸减半)，每个区域从不小于目标尺寸的最近一级缩放，
+    并以 LRU 缓存已缩放到目标尺寸的结果，同一尺寸的区域重复出现时无需再次缩放。
+    
+    按贴图自身 alpha 混合时使用预乘 alpha 的 RGBA 金字塔，缩放时透明像素的颜色不会渗入边缘；
+    指定固定 alpha 时贴图按不透明 RGB 处理 (与原行为一致)，对应的 RGB 金字塔在首次使用时才构建。
+    """
+
+    MIN_LEVEL_SIZE = 8
+    RESIZED_CACHE_SIZE = 32
+
+    def __init__(self, rgba):
+        rgba = np.asarray(rgba)
+        if rgba.ndim == 2:
+            rgba = cv2.cvtColor(rgba, cv2.COLOR_GRAY2RGBA)
+        elif rgba.shape[2] == 3:
+            rgba = cv2.cvtColor(rgba, cv2.COLOR_RGB2RGBA)
+        self.height, self.width = rgba.shape[:2]
+        self._rgba = rgba
+        rgb = np.ascontiguousarray(rgba[:, :, :3])
+        alpha = np.ascontiguousarray(rgba[:, :, 3])
+        premultiplied_rgb = cv2.multiply(rgb, cv2.merge([alpha, alpha, alpha]), scale=1.0 / 255.0)
+        self._premultiplied_levels = self._build_pyramid(premultiplied_rgb, alpha)
+        self._rgb_levels = None
+        self._resized = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build_pyramid(self, rgb, alpha=None):
+        """构建分辨率金字塔，alpha 不为 None 时每一级为预乘 RGB 与 alpha 拼接成的 RGBA"""
+        level = np.dstack([rgb, alpha]) if alpha is not None else np.ascontiguousarray(rgb)
+        levels = [level]
+        while min(level.shape[:2]) >= 2 * self.MIN_LEVEL_SIZE:
+            level = cv2.resize(level, (level.shape[1] // 2, level.shape[0] // 2), interpolation=cv2.INTER_AREA)
+            levels.append(level)
+        return levels
+
+    def _resize_from_pyramid(self, levels, target_width, target_height):
+        """从不小于目标尺寸的最近一级金字塔缩放到目标尺寸"""
+        source = levels[0]
+        for level in levels[1:]:
+            if level.shape[1] < target_width or level.shape[0] < target_height:
+                break
+            source = level
+        if source.shape[1] == target_width and source.shape[0] == target_height:
+            return source
+        downscaling = source.shape[1] >= target_width and source.shape[0] >= target_height
+        return cv2.resize(source, (target_width, target_height),
+                          interpolation=cv2.INTER_AREA if downscaling else cv2.INTER_LINEAR)
+
+    def resized(self, target_width, target_height, premultiplied=True):
+        """
+        获取缩放到目标尺寸的贴图 (LRU 缓存，返回值为共享对象，调用方不可修改)。
+        
+        premultiplied 为 True 时返回 (预乘 RGB 通道列表, 255 - alpha 的 uint16 数组)，
+        否则返回不透明处理的 RGB 数组。
+        """
+        key = (target_width, target_height, premultiplied)
+        with self._lock:
+            entry = self._resized.get(key)
+            if entry is not None:
+                self._resized.move_to_end(key)
+                return entry
+            if not premultiplied and self._rgb_levels is None:
+                self._rgb_levels = self._build_pyramid(self._rgba[:, :, :3])
+            levels = self._premultiplied_levels if premultiplied else self._rgb_levels
+
+        resized = self._resize_from_pyramid(levels, target_width, target_height)
+        if premultiplied:
+            rgb_planes = cv2.split(np.ascontiguousarray(resized[:, :, :3]))
+            entry = (rgb_planes, 255 - resized[:, :, 3].astype(np.uint16))
+        else:
+            entry = resized
+
+        with self._lock:
+            self._resized[key] = entry
+            self._resized.move_to_end(key)
+            while len(self._resized) > self.RESIZED_CACHE_SIZE:
+                self._resized.popitem(last=False)
+        return entry
+
+# 内存中贴图数组的纹理缓存：内容哈希 -> OverlayTexture (LRU)，供 apply_custom_image_mosaic 使用
+ARRAY_OVERLAY_CACHE_SIZE = 8
+_array_overlay_cache = OrderedDict()
+_array_overlay_cache_lock = threading.Lock()
+
+def get_array_overlay_texture(rgba):
+    """
+    获取贴图数组对应的 OverlayTexture，同一贴图反复使用时金字塔只构建一次。
+    以形状与像素内容的哈希为键 (而不是数组对象本身)，数组被就地修改后会重新构建。
+    """
+    rgba = np.ascontiguousarray(rgba)
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(repr((rgba.shape, rgba.dtype.str)).encode())
+    hasher.update(rgba)
+    key = hasher.digest()
+    with _array_overlay_cache_lock:
+        texture = _array_overlay_cache.get(key)
+        if texture is not None:
+            _array_overlay_cache.move_to_end(key)
+            return texture
+
+    texture = OverlayTexture(rgba)
+    with _array_overlay_cache_lock:
+        _array_overlay_cache[key] = texture
+        while len(_array_overlay_cache) > ARRAY_OVERLAY_CACHE_SIZE:
+            _array_overlay_cache.popitem(last=False)
+    return texture
+
+def _render_custom_image_region(roi, overlay, alpha=None):
+    """在区域视图上就地贴上缩放到区域大小的自定义图像
+    
+    Args:
+        roi: 区域视图
+        overlay: OverlayTexture
+        alpha: 覆盖强度，若为None则使用贴图自身alpha通道
+    """
+    target_height, target_width = roi.shape[:2]
+    
+    if alpha is not None:
+        # 使用用户指定的alpha值，贴图按不透明 RGB 混合
+        custom_rgb = overlay.resized(target_width, target_height, premultiplied=False)
+        if alpha >= 1.0:
+            roi[...] = custom_rgb
+        elif alpha > 0.0:
+            cv2.addWeighted(custom_rgb, alpha, roi, 1.0 - alpha, 0, dst=roi)
+        return
+    
+    # 预乘 alpha 混合：out = C_premul + roi * (255 - a) / 255，整数除 255 采用精确舍入
+    rgb_planes, inv_alpha = overlay.resized(target_width, target_height, premultiplied=True)
+    blended_planes = []
+    for plane, custom_plane in zip(cv2.split(roi), rgb_planes):
+        blended = plane.astype(np.uint16)
+        blended *= inv_alpha
+        blended += 128
+        blended += blended >> 8
+        blended >>= 8
+        blended_planes.append(cv2.add(blended.astype(np.uint8), custom_plane))
+    roi[...] = cv2.merge(blended_planes)
+
+# 打码效果名称 -> 区域渲染函数
+_REGION_RENDERERS = {
+    "blur": _render_blur_region,
+    "black_lines": _render_black_lines_region,
+    "white_mist": _render_white_mist_region,
+    "light": _render_light_region,
+    "custom_image": _render_custom_image_region,
+}
+
+# 效果在区域内均匀分布，重叠区域可在其外接矩形上一次渲染，再按各框的并集写回；
+# 光效与自定义图像依赖每个框自身的形状，保持逐框渲染
+MERGEABLE_EFFECTS = {"blur", "black_lines", "white_mist"}
+
+class RenderCancelledError(Exception):
+    """渲染过程中 cancel_check 返回 True 时抛出，表示该次渲染已过期被放弃"""
+
+def composite_mosaic(image, boxes, effect, scale=1.0, merge_overlaps=None, cancel_check=None, **effect_params):
+    """在单个工作缓冲区上就地合成打码效果
+    
+    每个效果只在其区域切片上渲染，不复制整幅图像，也不做通道顺序转换；
+    颜色参数需与 image 的通道顺序一致。重叠的区域合并为一组渲染，避免同一像素被重复处理，
+    且只写回组内各框覆盖的像素，框外的像素保持不变。
+    
+    Args:
+        image: 工作缓冲区 (会被就地修改)
+        boxes: 边界框列表 [(x1, y1, x2, y2), ...]
+        effect: 效果名称 ('blur', 'black_lines', 'white_mist', 'light', 'custom_image')
+        scale: 区域缩放比例
+        merge_overlaps: 是否合并重叠区域，None 时按效果类型决定 (见 MERGEABLE_EFFECTS)
+        cancel_check: 可选的无参回调，每个区域渲染前调用，返回 True 时抛出 RenderCancelledError
+        **effect_params: 传给对应区域渲染函数的参数
+        
+    Returns:
+        就地修改后的 image
+    """
+    renderer = _REGION_RENDERERS[effect]
+    regions = [region for region in (_scaled_region(box, scale, image.shape) for box in boxes) if region]
+    if merge_overlaps is None:
+        merge_overlaps = effect in MERGEABLE_EFFECTS
+    groups = group_overlapping_regions(regions) if merge_overlaps else [(region, [region]) for region in regions]
+    for (x1, y1, x2, y2), members in groups:
+        if cancel_check is not None and cancel_check():
+            raise RenderCancelledError()
+        roi = image[y1:y2, x1:x2]
+        if len(members) == 1:
+            renderer(roi, **effect_params)
+            continue
+        # 在外接矩形的副本上渲染，只把各框并集 (覆盖掩码) 内的像素写回
+        rendered = roi.copy()
+        renderer(rendered, **effect_params)
+        coverage = np.zeros(roi.shape[:2], dtype=bool)
+        for mx1, my1, mx2, my2 in members:
+            coverage[my1 - y1:my2 - y1, mx1 - x1:mx2 - x1] = True
+        roi[coverage] = rendered[coverage]
+    return image
+
 def apply_blur_mosaic(image_cv, box, kernel_size=(31, 31), scale=1.0, alpha=1.0):
     """应用常规模糊马赛克到指定边界框区域
     
@@ -121,26 +1051,7 @@ def apply_blur_mosaic(image_cv, box, kernel_size=(31, 31), scale=1.0, alpha=1.0)
     Returns:
         处理后的图像
     """
-    h, w = image_cv.shape[:2]
-    box = adjust_box_by_scale(box, scale, (h, w))
-    x1, y1, x2, y2 = [int(v) for v in box]
-    
-    output_image = image_cv.copy()
-    
-    # 提取区域
-    roi = output_image[y1:y2, x1:x2].copy()
-    
-    # 对区域进行模糊
-    if roi.size > 0:
-        blurred_roi = cv2.GaussianBlur(roi, kernel_size, 0)
-        
-        # 应用透明度
-        if alpha < 1.0:
-            output_image[y1:y2, x1:x2] = cv2.addWeighted(roi, 1.0 - alpha, blurred_roi, alpha, 0)
-        else:
-            output_image[y1:y2, x1:x2] = blurred_roi
-    
-    return output_image
+    return composite_mosaic(image_cv.copy(), [box], "blur", scale=scale, kernel_size=kernel_size, alpha=alpha)
 
 def apply_black_lines_mosaic(image_cv, box, line_thickness=5, spacing=10, scale=1.0, direction='horizontal', alpha=1.0):
     """应用动漫风格黑色线条马赛克
@@ -157,45 +1068,8 @@ def apply_black_lines_mosaic(image_cv, box, line_thickness=5, spacing=10, scale=
     Returns:
         处理后的图像
     """
-    h, w = image_cv.shape[:2]
-    box = adjust_box_by_scale(box, scale, (h, w))
-    x1, y1, x2, y2 = [int(v) for v in box]
-    
-    output_image = image_cv.copy()
-    
-    # 创建带线条的图层
-    lines_layer = output_image.copy()
-    pil_image = Image.fromarray(cv2.cvtColor(lines_layer, cv2.COLOR_BGR2RGB))
-    draw = ImageDraw.Draw(pil_image)
-    
-    if direction == 'horizontal':
-        for y in range(y1, y2, spacing):
-            draw.line([(x1, y), (x2, y)], fill="black", width=line_thickness)
-    elif direction == 'vertical':
-        for x in range(x1, x2, spacing):
-            draw.line([(x, y1), (x, y2)], fill="black", width=line_thickness)
-    elif direction == 'diagonal':
-        # 斜线马赛克
-        for i in range(-max(x2-x1, y2-y1), max(x2-x1, y2-y1), spacing):
-            x_start = max(x1, x1 + i)
-            y_start = max(y1, y1 - i)
-            x_end = min(x2, x2 + i)
-            y_end = min(y2, y2 - i)
-            if x_start < x_end and y_start < y_end:
-                draw.line([(x_start, y_start), (x_end, y_end)], fill="black", width=line_thickness)
-    
-    lines_layer = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-    
-    # 应用透明度
-    if 0.0 < alpha < 1.0:
-        # 只在边界框区域内应用透明度混合
-        roi = output_image[y1:y2, x1:x2].copy()
-        lines_roi = lines_layer[y1:y2, x1:x2].copy()
-        output_image[y1:y2, x1:x2] = cv2.addWeighted(roi, 1.0 - alpha, lines_roi, alpha, 0)
-    else:
-        output_image = lines_layer
-    
-    return output_image
+    return composite_mosaic(image_cv.copy(), [box], "black_lines", scale=scale, line_thickness=line_thickness,
+                            spacing=spacing, direction=direction, alpha=alpha)
 
 def apply_white_mist_mosaic(image_cv, box, strength=0.8, scale=1.0, color=(255, 255, 255)):
     """应用雾气马赛克
@@ -210,29 +1084,7 @@ def apply_white_mist_mosaic(image_cv, box, strength=0.8, scale=1.0, color=(255,
     Returns:
         处理后的图像
     """
-    h, w = image_cv.shape[:2]
-    box = adjust_box_by_scale(box, scale, (h, w))
-    x1, y1, x2, y2 = [int(v) for v in box]
-    
-    output_image = image_cv.copy()
-    
-    # 确保区域在图像范围内
-    h, w = output_image.shape[:2]
-    x1, y1 = max(0, x1), max(0, y1)
-    x2, y2 = min(w, x2), min(h, y2)
-    
-    if x1 >= x2 or y1 >= y2:
-        return output_image
-    
-    # 创建覆盖层
-    roi = output_image[y1:y2, x1:x2].copy()
-    color_layer = np.full_like(roi, color, dtype=np.uint8)
-    
-    # 混合
-    blended = cv2.addWeighted(roi, 1.0 - strength, color_layer, strength, 0)
-    output_image[y1:y2, x1:x2] = blended
-    
-    return output_image
+    return composite_mosaic(image_cv.copy(), [box], "white_mist", scale=scale, strength=strength, color=color)
 
 def apply_custom_image_mosaic(image_cv_rgb, box, custom_image_rgba_np, scale=1.0, alpha=None):
     """应用自定义图像马赛克
@@ -247,52 +1099,8 @@ def apply_custom_image_mosaic(image_cv_rgb, box, custom_image_rgba_np, scale=1.0
     Returns:
         处理后的RGB图像
     """
-    h, w = image_cv_rgb.shape[:2]
-    box = adjust_box_by_scale(box, scale, (h, w))
-    x1, y1, x2, y2 = [int(v) for v in box]
-    
-    output_image_rgb = image_cv_rgb.copy()
-    
-    # 确保区域在图像范围内
-    h, w = output_image_rgb.shape[:2]
-    x1, y1 = max(0, x1), max(0, y1)
-    x2, y2 = min(w, x2), min(h, y2)
-    
-    if x1 >= x2 or y1 >= y2:
-        return output_image_rgb
-    
-    # 计算目标区域大小
-    target_width = x2 - x1
-    target_height = y2 - y1
-    
-    if target_width <= 0 or target_height <= 0:
-        return output_image_rgb
-    
-    # 将自定义图像缩放到目标大小
-    resized_custom_image = cv2.resize(custom_image_rgba_np, (target_width, target_height))
-    
-    # 分离RGB和Alpha通道
-    custom_rgb = resized_custom_image[:, :, :3]
-    if resized_custom_image.shape[2] == 4:
-        if alpha is None:
-            custom_alpha = resized_custom_image[:, :, 3:4].astype(np.float32) / 255.0
-        else:
-            # 使用用户指定的alpha值
-            custom_alpha = np.ones((target_height, target_width, 1), dtype=np.float32) * alpha
-    else:
-        if alpha is None:
-            custom_alpha = np.ones((target_height, target_width, 1), dtype=np.float32)
-        else:
-            custom_alpha = np.ones((target_height, target_width, 1), dtype=np.float32) * alpha
-    
-    # 应用Alpha混合
-    roi = output_image_rgb[y1:y2, x1:x2].astype(np.float32)
-    custom_rgb = custom_rgb.astype(np.float32)
-    
-    blended = custom_alpha * custom_rgb + (1 - custom_alpha) * roi
-    output_image_rgb[y1:y2, x1:x2] = blended.astype(np.uint8)
-    
-    return output_image_rgb
+    return composite_mosaic(image_cv_rgb.copy(), [box], "custom_image", scale=scale,
+                            overlay=get_array_overlay_texture(custom_image_rgba_np), alpha=alpha)
 
 def apply_light_mosaic(image_cv, box, intensity=0.8, feather=30, color=(255, 255, 255), scale=1.0):
     """应用炫光马赛克效果
@@ -308,45 +1116,8 @@ def apply_light_mosaic(image_cv, box, intensity=0.8, feather=30, color=(255, 255
     Returns:
         处理后的图像
     """
-    h, w = image_cv.shape[:2]
-    box = adjust_box_by_scale(box, scale, (h, w))
-    x1, y1, x2, y2 = [int(v) for v in box]
-    
-    output_image = image_cv.copy()
-    
-    # 确保区域在图像范围内
-    h, w = output_image.shape[:2]
-    x1, y1 = max(0, x1), max(0, y1)
-    x2, y2 = min(w, x2), min(h, y2)
-    
-    if x1 >= x2 or y1 >= y2:
-        return output_image
-    
-    # 创建蒙版，中心亮，边缘暗
-    mask = np.zeros((y2-y1, x2-x1), dtype=np.float32)
-    center_x, center_y = (x2-x1)//2, (y2-y1)//2
-    
-    # 生成径向渐变
-    y_indices, x_indices = np.ogrid[:y2-y1, :x2-x1]
-    dist_from_center = np.sqrt((x_indices - center_x)**2 + (y_indices - center_y)**2)
-    max_dist = np.sqrt(center_x**2 + center_y**2)
-    mask = np.clip(1.0 - dist_from_center / max_dist, 0, 1)
-    mask = np.power(mask, 1.0 / (feather / 100.0 + 0.1))
-    
-    roi = output_image[y1:y2, x1:x2].copy()
-    
-    light_layer = np.full_like(roi, color, dtype=np.uint8)
-    
-    for c in range(3):
-        roi_channel = roi[:,:,c].astype(np.float32)
-        light_channel = light_layer[:,:,c].astype(np.float32)
-        
-        blended_channel = roi_channel * (1.0 - mask * intensity) + light_channel * (mask * intensity)
-        roi[:,:,c] = np.clip(blended_channel, 0, 255).astype(np.uint8)
-    
-    output_image[y1:y2, x1:x2] = roi
-    
-    return output_image
+    return composite_mosaic(image_cv.copy(), [box], "light", scale=scale, intensity=intensity,
+                            feather=feather, color=color)
 
 def get_available_labels():
     """获取可用的标签列表"""
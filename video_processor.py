@@ -0,0 +1,325 @@
+# video_processor.py
+"""
+视频打码：逐帧解码 (OpenCV)，只在关键帧上运行检测模型，其间的帧用 Lucas-Kanade 光流跟踪上一次检测到的区域，
+跟踪置信度不足时立即在当前帧重新检测。打码复用 composite_mosaic 合成引擎，
+结果经由 cv2.VideoWriter 逐帧写出；解码、处理与编码之间只有固定长度的队列，内存占用与视频长度无关。
+
+注意：OpenCV 不处理音轨，输出视频不含声音，需要时可用 ffmpeg 从原视频复制音轨。
+"""
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from image_processor import benchmark_reporter, build_effect_params, inference_size_for
+from utils import get_detection_model, detect_censors, composite_mosaic, RenderCancelledError
+
+SUPPORTED_VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm', '.wmv')
+# 输出扩展名 -> VideoWriter 编码器
+VIDEO_FOURCC = {
+    '.mp4': 'mp4v', '.m4v': 'mp4v', '.mov': 'mp4v',
+    '.avi': 'MJPG', '.mkv': 'XVID', '.webm': 'VP80',
+}
+# 每隔多少帧运行一次检测 (其间的帧依靠跟踪)
+DEFAULT_DETECT_INTERVAL = 5
+# 解码与编码队列的长度 (帧)
+VIDEO_QUEUE_SIZE = 8
+# 无法读取帧率时使用的默认值
+DEFAULT_VIDEO_FPS = 25.0
+
+# 每个区域最多跟踪的特征点数，少于 TRACK_MIN_POINTS 个有效点时视为跟踪失败
+TRACK_MAX_POINTS = 40
+TRACK_MIN_POINTS = 4
+# 前向-后向光流误差 (像素) 超过该值的点视为跟踪失败
+TRACK_FB_THRESHOLD = 1.0
+# 任一区域仍有效的特征点比例低于该值时，在当前帧重新检测
+TRACK_MIN_CONFIDENCE = 0.5
+# 单帧内区域尺寸变化的限制，避免个别离群点导致框突变
+TRACK_MAX_SCALE_STEP = 1.25
+
+_LK_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                  criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+_VIDEO_END = object()
+
+class BoxTracker:
+    """
+    基于稀疏光流的轻量多区域跟踪器。
+    每个检测框内提取角点，逐帧以金字塔 LK 光流前向、后向各计算一次，
+    保留前后一致的点，按其位移中值平移检测框、按点间距离变化的中值缩放检测框。
+    缺乏纹理 (提取不到足够角点) 的区域保持在原位，直到下一次检测。
+    """
+
+    def __init__(self, max_points=TRACK_MAX_POINTS, min_points=TRACK_MIN_POINTS, fb_threshold=TRACK_FB_THRESHOLD):
+        self.max_points = max_points
+        self.min_points = min_points
+        self.fb_threshold = fb_threshold
+        self.tracks = []
+
+    def reset(self, gray, detections):
+        """以新的检测结果 [(边界框, 标签, 置信度), ...] 重新初始化全部跟踪"""
+        height, width = gray.shape[:2]
+        self.tracks = []
+        for bbox, label, confidence in detections:
+            x1, y1, x2, y2 = (int(round(v)) for v in bbox)
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(width, x2), min(height, y2)
+            points = None
+            if x2 - x1 >= 8 and y2 - y1 >= 8:
+                points = cv2.goodFeaturesToTrack(gray[y1:y2, x1:x2], maxCorners=self.max_points, qualityLevel=0.01,
+                                                 minDistance=3)
+            if points is not None and len(points) >= self.min_points:
+                points = points.reshape(-1, 2) + np.array([x1, y1], dtype=np.float32)
+            else:
+                points = None
+            self.tracks.append({"box": np.array(bbox, dtype=np.float32), "label": label, "confidence": confidence,
+                                "points": points, "initial_points": 0 if points is None else len(points)})
+
+    def update(self, prev_gray, gray):
+        """
+        将全部跟踪推进到当前帧。
+
+        Returns:
+            本帧的跟踪置信度：各可跟踪区域中有效特征点占初始点数比例的最小值 (没有可跟踪区域时为 1.0)
+        """
+        tracked = [track for track in self.tracks if track["points"] is not None]
+        if not tracked:
+            return 1.0
+        counts = [len(track["points"]) for track in tracked]
+        prev_points = np.concatenate([track["points"] for track in tracked]).reshape(-1, 1, 2)
+        # 所有区域的特征点合并为一次前向、一次后向光流计算
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, prev_points, None, **_LK_PARAMS)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, next_points, None, **_LK_PARAMS)
+        fb_error = np.linalg.norm((back_points - prev_points).reshape(-1, 2), axis=1)
+        valid = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < self.fb_threshold)
+        prev_points, next_points = prev_points.reshape(-1, 2), next_points.reshape(-1, 2)
+
+        height, width = gray.shape[:2]
+        min_confidence = 1.0
+        offset = 0
+        for track, count in zip(tracked, counts):
+            track_valid = valid[offset:offset + count]
+            old_points = prev_points[offset:offset + count][track_valid]
+            new_points = next_points[offset:offset + count][track_valid]
+            offset += count
+            confidence = len(new_points) / track["initial_points"]
+            if len(new_points) < self.min_points:
+                confidence = 0.0
+                track["points"] = None
+            else:
+                shift = np.median(new_points - old_points, axis=0)
+                old_spread = np.linalg.norm(old_points - old_points.mean(axis=0), axis=1)
+                new_spread = np.linalg.norm(new_points - new_points.mean(axis=0), axis=1)
+                usable = old_spread > 1e-3
+                step = float(np.median(new_spread[usable] / old_spread[usable])) if usable.any() else 1.0
+                step = min(max(step, 1.0 / TRACK_MAX_SCALE_STEP), TRACK_MAX_SCALE_STEP)
+                x1, y1, x2, y2 = track["box"]
+                center_x, center_y = (x1 + x2) / 2 + shift[0], (y1 + y2) / 2 + shift[1]
+                half_w, half_h = (x2 - x1) * step / 2, (y2 - y1) * step / 2
+                track["box"] = np.array([max(0.0, center_x - half_w), max(0.0, center_y - half_h),
+                                         min(float(width), center_x + half_w), min(float(height), center_y + half_h)],
+                                        dtype=np.float32)
+                track["points"] = new_points.astype(np.float32)
+            min_confidence = min(min_confidence, confidence)
+        return min_confidence
+
+    def boxes(self):
+        return [tuple(float(v) for v in track["box"]) for track in self.tracks
+                if track["box"][2] > track["box"][0] and track["box"][3] > track["box"][1]]
+
+def _fourcc_for(output_path):
+    return cv2.VideoWriter_fourcc(*VIDEO_FOURCC.get(os.path.splitext(str(output_path))[1].lower(), 'mp4v'))
+
+def process_video(input_path, output_path, mosaic_type, selected_regions, custom_image_path=None,
+                  line_direction='horizontal', conf_threshold=0.25, iou_threshold=0.7,
+                  scale=1.0, alpha=1.0, blur_kernel_size=(31, 31),
+                  line_thickness=5, line_spacing=10,
+                  mist_color=(255, 255, 255),  # RGB
+                  light_intensity=0.8, light_feather=30, light_color=(255, 255, 255),  # RGB
+                  detect_interval=DEFAULT_DETECT_INTERVAL, min_track_confidence=TRACK_MIN_CONFIDENCE,
+                  max_frames=None, queue_size=VIDEO_QUEUE_SIZE,
+                  status_callback=None, progress_callback=None, cancel_check=None):
+    """
+    对视频打码。打码参数与 process_single_image 相同。
+
+    Args:
+        output_path: 输出视频路径 (编码器按扩展名选择)，为 None 时只处理不写出 (用于测速)
+        detect_interval: 每隔多少帧运行一次检测，1 表示逐帧检测；其间的帧用光流跟踪上一次的检测框
+        min_track_confidence: 跟踪置信度低于该值时在当前帧提前重新检测
+        max_frames: 最多处理的帧数，None 表示处理整个视频
+        progress_callback: 以 (已处理帧数, 总帧数) 调用，总帧数未知时为 0
+        cancel_check: 无参回调，返回 True 时停止处理 (已写出的部分仍是可播放的视频)
+
+    Returns:
+        统计字典 (frames / detections / redetections / fps / 各阶段耗时 等)，无法处理时返回 None
+    """
+    def _report(message):
+        print(message)
+        if status_callback:
+            status_callback(message)
+
+    detection_model = get_detection_model()
+    if not detection_model:
+        _report("错误：检测模型未能成功加载。")
+        return None
+    capture = cv2.VideoCapture(str(input_path))
+    if not capture.isOpened():
+        _report(f"错误：无法打开视频文件: {input_path}")
+        return None
+    fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_VIDEO_FPS
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = max(0, int(capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+    if max_frames is not None:
+        total_frames = min(total_frames, max_frames) if total_frames else max_frames
+
+    writer = None
+    if output_path is not None:
+        output_dir = os.path.dirname(os.path.abspath(str(output_path)))
+        os.makedirs(output_dir, exist_ok=True)
+        writer = cv2.VideoWriter(str(output_path), _fourcc_for(output_path), fps, (width, height))
+        if not writer.isOpened():
+            capture.release()
+            _report(f"错误：无法创建输出视频 (编码器不可用?): {output_path}")
+            return None
+
+    effect, effect_params = build_effect_params(
+        mosaic_type, custom_image_path=custom_image_path, line_direction=line_direction, alpha=alpha,
+        blur_kernel_size=blur_kernel_size, line_thickness=line_thickness, line_spacing=line_spacing,
+        mist_color=mist_color, light_intensity=light_intensity, light_feather=light_feather, light_color=light_color)
+    detect_interval = max(1, int(detect_interval))
+
+    stats = {"frames": 0, "detections": 0, "redetections": 0, "decode_seconds": 0.0, "detect_seconds": 0.0,
+             "track_seconds": 0.0, "render_seconds": 0.0, "fps_input": fps, "detect_interval": detect_interval}
+    frame_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    write_errors = []
+
+    def _read_frames():
+        try:
+            frame_index = 0
+            while not stop_event.is_set() and (max_frames is None or frame_index < max_frames):
+                read_start = time.perf_counter()
+                ok, frame_bgr = capture.read()
+                stats["decode_seconds"] += time.perf_counter() - read_start
+                if not ok:
+                    break
+                frame_queue.put(frame_bgr)
+                frame_index += 1
+        finally:
+            frame_queue.put(_VIDEO_END)
+
+    def _write_frames():
+        while True:
+            frame_bgr = write_queue.get()
+            if frame_bgr is _VIDEO_END:
+                break
+            if writer is not None and not write_errors:
+                try:
+                    writer.write(frame_bgr)
+                except Exception as e_write:
+                    write_errors.append(e_write)
+
+    reader_thread = threading.Thread(target=_read_frames, name="video-decode", daemon=True)
+    writer_thread = threading.Thread(target=_write_frames, name="video-encode", daemon=True)
+    reader_thread.start()
+    writer_thread.start()
+
+    tracker = BoxTracker()
+    prev_gray = None
+    frames_since_detect = 0
+    start_time = time.perf_counter()
+    cancelled = False
+    try:
+        while True:
+            frame_bgr = frame_queue.get()
+            if frame_bgr is _VIDEO_END:
+                break
+            if cancel_check is not None and cancel_check():
+                cancelled = True
+                break
+            frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+            gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+
+            need_detect = prev_gray is None or frames_since_detect >= detect_interval
+            if not need_detect:
+                track_start = time.perf_counter()
+                confidence = tracker.update(prev_gray, gray)
+                stats["track_seconds"] += time.perf_counter() - track_start
+                if confidence < min_track_confidence:
+                    need_detect = True
+                    stats["redetections"] += 1
+            if need_detect:
+                detect_start = time.perf_counter()
+                detections = detect_censors(frame_rgb, detection_model, conf_threshold, iou_threshold,
+                                            imgsz=inference_size_for(frame_rgb, detection_model))
+                detections = [d for d in detections if not selected_regions or d[1] in selected_regions]
+                tracker.reset(gray, detections)
+                stats["detect_seconds"] += time.perf_counter() - detect_start
+                stats["detections"] += 1
+                frames_since_detect = 0
+            frames_since_detect += 1
+            prev_gray = gray
+
+            render_start = time.perf_counter()
+            boxes = tracker.boxes()
+            if boxes and effect is not None:
+                composite_mosaic(frame_rgb, boxes, effect, scale=scale, **effect_params)
+                frame_bgr = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
+            stats["render_seconds"] += time.perf_counter() - render_start
+            write_queue.put(frame_bgr)
+
+            stats["frames"] += 1
+            if progress_callback:
+                progress_callback(stats["frames"], total_frames)
+    except RenderCancelledError:
+        cancelled = True
+    finally:
+        stop_event.set()
+        # 解除解码线程可能的阻塞后等待其退出
+        while reader_thread.is_alive():
+            try:
+                frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        write_queue.put(_VIDEO_END)
+        writer_thread.join()
+        capture.release()
+        if writer is not None:
+            writer.release()
+
+    elapsed_seconds = time.perf_counter() - start_time
+    stats["elapsed_seconds"] = elapsed_seconds
+    stats["fps"] = stats["frames"] / elapsed_seconds if elapsed_seconds > 0 else 0.0
+    stats["cancelled"] = cancelled
+    if write_errors:
+        stats["error"] = f"写出视频失败: {write_errors[0]}"
+    _report(f"视频处理{'已取消' if cancelled else '完成'}：{stats['frames']} 帧，检测 {stats['detections']} 次 "
+            f"(其中跟踪不足提前检测 {stats['redetections']} 次)，{stats['fps']:.1f} 帧/秒")
+    return stats
+
+def benchmark_detect_intervals(input_path, intervals=(1, 2, 5, 10), max_frames=300, status_callback=None,
+                               **render_params):
+    """
+    在同一段视频上比较不同检测间隔 N 的处理速度 (帧/秒，不写出视频)，用于在速度与跟踪精度之间取舍。
+
+    Returns:
+        {N: 统计字典}
+    """
+    report_message = benchmark_reporter(status_callback)
+    get_detection_model()
+    render_params.setdefault("mosaic_type", "常规模糊")
+    render_params.setdefault("selected_regions", [])
+    report = {}
+    for interval in intervals:
+        stats = process_video(input_path, None, detect_interval=interval, max_frames=max_frames, **render_params)
+        if stats is None:
+            break
+        report[interval] = stats
+        report_message(f"检测间隔 {interval}: {stats['fps']:.1f} 帧/秒 (检测 {stats['detections']} 次，"
+                       f"提前检测 {stats['redetections']} 次)")
+    return report